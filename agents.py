@@ -19,6 +19,7 @@ class SQLAgent(dspy.Signature):
     - **Ensure correctness**: Use exact table and column names as per the database schema.
     - **Adapt to SQL dialect**: Adjust syntax for MySQL, PostgreSQL, or other specified databases.
     - **Optimize for large datasets**: Use indexed columns in filtering, apply `LIMIT` where appropriate, and avoid unnecessary full-table scans.
+    - **Learn from the examples**: Verified queries for similar questions show the tables, joins and conventions that work on this database; adapt them rather than copying them.
     - **ONLY return the SQL query** without explanations or additional text.
     """
 
@@ -31,6 +32,9 @@ class SQLAgent(dspy.Signature):
     sql_dialect = dspy.InputField(
         desc="The SQL dialect to use (e.g., MySQL, PostgreSQL, SQLite, SQL Server, etc.)."
     )
+    examples = dspy.InputField(
+        desc="Similar questions with SQL that ran successfully on this database, or None."
+    )
     generated_sql = dspy.OutputField(
         desc="Optimized SQL query that accurately retrieves the requested data while considering the specified SQL dialect."
     )
@@ -173,3 +177,39 @@ class error_fix_agent(dspy.Signature):
     generated_sql = dspy.OutputField(
         desc="The corrected SQL query with the issue resolved."
     )
+
+
+class error_fix_fused_agent(dspy.Signature):
+    """
+    **Task:**
+    Diagnose a failed SQL query and return the corrected query in a single step.
+    This combines the Error Reasoning Agent and the Error Fix Agent to save one round-trip.
+
+    **Inputs:**
+    1. **SQL Error Message:** The error message returned by the SQL engine.
+    2. **Incorrect Query:** The SQL query that caused the error.
+    3. **Database Information:** The user's query intent and the schema (tables, columns, types, keys).
+
+    **Output:**
+    1. **Fix Reasoning:** A short diagnosis of the error and the change needed to resolve it.
+    2. **Corrected SQL:** The fixed query, using only tables and columns that exist in the schema.
+
+    **Guidelines:**
+    - If the user input is not asking for data, set the reasoning to `NOT ASKING FOR SQL` and return `SELECT "NOT ASKING FOR SQL";`.
+    - Keep the user's intent; change only what is needed to fix the error.
+    - **ONLY return the SQL query** in the corrected SQL field, without explanations.
+    """
+
+    error_message = dspy.InputField(
+        desc="The SQL error message returned by the database engine."
+    )
+    incorrect_sql = dspy.InputField(desc="The SQL query that caused the error.")
+    information = dspy.InputField(
+        desc="User's query intent and database schema details."
+    )
+    error_fix_reasoning = dspy.OutputField(
+        desc="Short diagnosis of the error and the fix applied."
+    )
+    generated_sql = dspy.OutputField(
+        desc="The corrected SQL query with the issue resolved."
+    )
@@ -1,19 +1,256 @@
-import os
+import time
+
+_boot_started = time.perf_counter()
+
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, Response, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-import sqlalchemy
-from sqlalchemy import create_engine, text
-import json
+from typing import List, Optional, Union
 import uvicorn
-from main import AgentSystem
-from config import db_info
-from log import logger
+from main import AgentSystem, configure_lm
+from config import (
+    db_info,
+    SEMANTIC_CACHE_ENABLED,
+    RAG_ENABLED,
+    EXAMPLES_ENABLED,
+    SUMMARIES_ENABLED,
+    COLD_START_BUDGET_SECONDS,
+    SCHEMA_INTROSPECTION_ENABLED,
+    GUARD_ENABLED,
+    SPECULATIVE_ENABLED,
+    RESULT_CACHE_ENABLED,
+    SINGLEFLIGHT_ENABLED,
+    JOBS_ENABLED,
+    JOB_POLL_SECONDS,
+    BATCH_CONCURRENCY,
+    BATCH_MAX_QUESTIONS,
+    DEFAULT_PAGE_SIZE,
+    MAX_PAGE_SIZE,
+    DEFAULT_DATABASE,
+)
+from db import get_engine, dispose_engine, stream_query
+from schema import SchemaProvider
+from databases import DatabaseRouter, UnknownDatabase
+from guard import QueryGuard
+from speculation import SpeculationBudget
+from result_cache import ResultCache
+from singleflight import SingleFlight
+from batch import parse_questions, run_batch
+from jobs import FINISHED, JobQueueFull, create_job_queue
+from metrics import PROMETHEUS_MEDIA_TYPE, REGISTRY, setup_tracing, stage, stats_collector
+from columnar import ARROW_STREAM_MEDIA_TYPE, table_to_ipc
+from pagination import (
+    InvalidPageToken,
+    decode_page_token,
+    encode_page_token,
+    paginate_sql,
+)
+from serialization import ORJSONResultResponse, dataframe_to_records, dumps, table_to_records
+from log import log_payload, logger, request_id
 import asyncio
+import uuid
+
+_imports_done = time.perf_counter()
+
+
+class AppContext:
+    """
+    Long-lived objects shared by every request handled by this worker.
+    """
+
+    def __init__(self):
+        self.engine = None
+        self.databases = None
+        self.schema_provider = None
+        self.schema_index = None
+        self.semantic_cache = None
+        self.embeddings = None
+        self.sql_system = None
+        self.jobs = None
+        self.boot_timings = {"imports": _imports_done - _boot_started}
+
+    async def _timed(self, name, func, *args, in_thread=True):
+        """
+        Runs a boot step and records its duration; blocking steps run in a thread.
+        """
+        started = time.perf_counter()
+        if asyncio.iscoroutinefunction(func):
+            result = await func(*args)
+        elif in_thread:
+            result = await asyncio.to_thread(func, *args)
+        else:
+            result = func(*args)
+        self.boot_timings[name] = time.perf_counter() - started
+        return result
+
+    async def start(self):
+        """
+        Builds the engine, agent system and optional caches/indexes once.
+        """
+        # dspy settings belong to the thread that configures them first
+        await self._timed("lm", configure_lm, in_thread=False)
+        self.engine = get_engine()
+        self.databases = DatabaseRouter.from_config()
+        await self._timed("databases", self.databases.start)
+        # Every database gets its own schema cache, schema index and result cache
+        targets = self.databases.databases
+        if SCHEMA_INTROSPECTION_ENABLED:
+            for db in targets.values():
+                db.schema_provider = SchemaProvider(db.engine)
+
+            async def refresh_schemas():
+                await asyncio.gather(*(db.schema_provider.refresh() for db in targets.values()))
+
+            await self._timed("schema", refresh_schemas)
+        if RESULT_CACHE_ENABLED:
+            for db in targets.values():
+                db.result_cache = ResultCache(db.engine)
+        default = targets[DEFAULT_DATABASE]
+        self.schema_provider = default.schema_provider
+        if SEMANTIC_CACHE_ENABLED or RAG_ENABLED or EXAMPLES_ENABLED:
+            from embeddings import get_embedding_service
+
+            self.embeddings = await self._timed("embeddings", get_embedding_service)
+        if SEMANTIC_CACHE_ENABLED:
+            from cache import SemanticQueryCache
+
+            self.semantic_cache = SemanticQueryCache()
+            # Load the embedding model now rather than on the first request
+            await self._timed("semantic_cache", self.semantic_cache.embed, "warm up")
+        if RAG_ENABLED and self.schema_provider is not None:
+            from rag import get_schema_index
+
+            for name, db in targets.items():
+                db.schema_index = get_schema_index(None if name == DEFAULT_DATABASE else name)
+                await self._timed(
+                    f"rag_{name}", db.schema_index.sync, await db.schema_provider.get()
+                )
+            self.schema_index = default.schema_index
+        if EXAMPLES_ENABLED:
+            from examples import get_example_store
+
+            for name, db in targets.items():
+                db.example_store = get_example_store(None if name == DEFAULT_DATABASE else name)
+                if db.schema_provider is not None:
+                    # Drops pairs invalidated by schema changes made while we were down
+                    await self._timed(
+                        f"examples_{name}", db.example_store.sweep, await db.schema_provider.get()
+                    )
+        if SUMMARIES_ENABLED and SCHEMA_INTROSPECTION_ENABLED:
+            from summaries import SummaryManager
+
+            for db in targets.values():
+                db.summaries = SummaryManager(db)
+                db.summaries.start()
+        self.sql_system = AgentSystem(
+            dataset_information=db_info,
+            max_retry=3,
+            cache=self.semantic_cache,
+            schema_provider=self.schema_provider,
+            schema_index=self.schema_index,
+            guard=QueryGuard(engine=self.engine) if GUARD_ENABLED else None,
+            speculation=SpeculationBudget() if SPECULATIVE_ENABLED else None,
+            result_cache=default.result_cache,
+            singleflight=SingleFlight() if SINGLEFLIGHT_ENABLED else None,
+            databases=self.databases,
+            example_store=default.example_store,
+            summaries=default.summaries,
+        )
+        if JOBS_ENABLED:
+            self.jobs = create_job_queue(self.sql_system)
+            self.jobs.start()
+        self.register_metrics()
+        self.boot_timings["total"] = time.perf_counter() - _boot_started
+        if self.boot_timings["total"] > COLD_START_BUDGET_SECONDS:
+            logger.warning(
+                f"Cold start took {self.boot_timings['total']:.2f}s, over the "
+                f"{COLD_START_BUDGET_SECONDS:.2f}s budget: {self.boot_timings}"
+            )
+        else:
+            logger.info(f"Cold start finished: {self.boot_timings}")
 
-app = FastAPI()
+    def register_metrics(self):
+        """
+        Exposes the statistics of the shared caches and limiters on /metrics.
+        """
+        sources = [
+            ("query_to_sql_semantic_cache", "Semantic question cache", self.semantic_cache,
+             ["hits", "misses", "evictions", "size"]),
+            ("query_to_sql_result_cache", "Result-set cache", self.sql_system.result_cache,
+             ["hits", "misses", "evictions", "invalidations", "size", "bytes"]),
+            ("query_to_sql_singleflight", "Request coalescing", self.sql_system.singleflight,
+             ["started", "coalesced", "in_flight"]),
+            ("query_to_sql_ratelimit", "LLM rate limiter", self.sql_system.rate_limiter,
+             ["calls", "throttled", "waited_seconds"]),
+            ("query_to_sql_speculation", "Speculative generation", self.sql_system.speculation,
+             ["granted", "denied", "inflight"]),
+            ("query_to_sql_embeddings", "Embedding service", self.embeddings,
+             ["texts", "cache_hits", "batches", "encoded", "encode_seconds"]),
+            ("query_to_sql_jobs", "Background jobs", self.jobs,
+             ["submitted", "rejected", "succeeded", "failed", "cancelled", "queued", "running"]),
+        ]
+        for name, documentation, source, keys in sources:
+            if source is not None:
+                REGISTRY.add_collector(name, stats_collector(name, documentation, source.stats, keys))
+            else:
+                REGISTRY.remove_collector(name)
+
+    async def stop(self):
+        if self.jobs is not None:
+            await self.jobs.stop()
+        if self.databases is not None:
+            await self.databases.stop()
+        await dispose_engine()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    context = AppContext()
+    await context.start()
+    app.state.context = context
+    try:
+        yield
+    finally:
+        await context.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+setup_tracing(app)
+
+class RequestIdMiddleware:
+    """
+    Tags everything logged while a request is handled with its id: the
+    caller's X-Request-ID when sent, otherwise a new one. The id is echoed
+    back in the response headers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        value = headers.get(b"x-request-id", b"").decode("latin-1")[:64] or uuid.uuid4().hex
+        token = request_id.set(value)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = [*message["headers"], (b"x-request-id", value.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id.reset(token)
+
+
+app.add_middleware(RequestIdMiddleware)
 
 # Add CORS middleware
 app.add_middleware(
@@ -22,74 +259,572 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID"],
 )
 
-# Database Configuration
-mysql_host = os.getenv("mysql_host", "localhost")
-mysql_port = int(os.getenv("mysql_port", "3306"))
-mysql_user = os.getenv("mysql_user", "root")
-mysql_password = os.getenv("mysql_password", "")
-mysql_database = os.getenv("mysql_database", "chatbot")
-
-# Database URL
-DATABASE_URL = f"mysql+pymysql://{mysql_user}:{mysql_password}@{mysql_host}:{mysql_port}/{mysql_database}"
-
-# SQLAlchemy Engine & Session
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_size=10, max_overflow=20)
-
 # Set up Jinja2 templates
 templates = Jinja2Templates(directory="templates")
 
 
-async def get_sql(query: str):
-    sql_system = AgentSystem(dataset_information=db_info, max_retry=3)
+async def get_sql(
+    query: str, context: AppContext, page_size=None, tenant=None, database=None, truncate=True
+):
+    sql_system = context.sql_system
     try:
-        responses = await sql_system.forward(query=query)
-        logger.debug(f"sql generated: {responses}")
+        # Identical concurrent questions share one run; a disconnecting caller
+        # only detaches from it
+        responses = await sql_system.forward_coalesced(
+            query=query, page_size=page_size, tenant=tenant, database=database, truncate=truncate
+        )
+        log_payload("sql generated", responses)
         return responses
     except Exception as e:
         logger.error(f"Execution failed: {e}")
         raise
 
 
+async def cancel_on_disconnect(request: Request, coro, poll_interval=0.5):
+    """
+    Runs `coro` but cancels it as soon as the HTTP client disconnects, so that
+    in-flight database queries are killed instead of running to completion.
+    Work shared with other callers through singleflight keeps running until
+    its last caller is gone.
+    """
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=poll_interval)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.warning("Client disconnected, cancelling query processing.")
+                task.cancel()
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        if not task.done():
+            task.cancel()
+
+
 # Define the request model for receiving the query
 class QueryRequest(BaseModel):
     query: str
+    page_size: Optional[int] = None
+    # Selects the latency tier, e.g. whether speculative generation is allowed
+    tenant: Optional[str] = None
+    # Target database; defaults to the one named like the tenant, else the default
+    database: Optional[str] = None
 
 
-@app.post("/execute_query/")
-async def execute_query(request: QueryRequest):
+class BatchQuestion(BaseModel):
+    id: Optional[str] = None
+    query: str
+
+
+class BatchRequest(BaseModel):
+    questions: List[Union[str, BatchQuestion]]
+    concurrency: int = BATCH_CONCURRENCY
+    page_size: Optional[int] = None
+    tenant: Optional[str] = None
+    database: Optional[str] = None
+
+
+class PageRequest(BaseModel):
+    page_token: str
+
+
+def resolve_database(http_request: Request, name=None, tenant=None):
+    """
+    Checks up front that a request names a known database.
+    """
+    try:
+        return http_request.app.state.context.sql_system.database(name, tenant)
+    except UnknownDatabase as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+def resolve_page_size(page_size):
+    if not page_size or page_size <= 0:
+        page_size = DEFAULT_PAGE_SIZE
+    return min(page_size, MAX_PAGE_SIZE) if page_size else None
+
+
+async def answer_query(request: QueryRequest, http_request: Request, page_size, truncate=True):
+    """
+    Runs the agent pipeline for a request and returns its successful result dict.
+    """
+    context = http_request.app.state.context
+    resolve_database(http_request, request.database, request.tenant)
     try:
         # Await the result of the asynchronous get_sql function
-        result = await get_sql(request.query)  # Await here
-        
-        # The generated SQL is wrapped in a list, so we need to extract the query
-        result_sql = str(result["sql"][0])  # Extract the first item from the list
-        
-        logger.debug(f"Executing query: {result_sql}")
-        
-        # Execute SQL query on the database
-        with engine.connect() as conn:
-            result = conn.execute(text(result_sql))
-            logger.debug(f"Query result: {result}")
-            
-            # Fetch all rows from the result and convert them into a list of dictionaries
-            columns = result.keys()
-            rows = [dict(zip(columns, row)) for row in result.fetchall()]
-            
-            # Convert Decimal to float for easier handling in JavaScript
-            for row in rows:
-                row['total_sales_units'] = float(row['total_sales_units'])
-            
-            logger.debug(f"Rows: {rows}")
-            return {"data": rows}
+        result = await cancel_on_disconnect(
+            http_request,
+            get_sql(request.query, context, page_size, request.tenant, request.database, truncate),
+        )
+    except (asyncio.CancelledError, HTTPException):
+        raise
+    except Exception as e:
+        logger.error(f"Error: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # forward() already executed the SQL; reuse the result of the successful attempt
+    if result["result"] is None:
+        detail = result["error"] or "No SQL query could be generated."
+        raise HTTPException(status_code=400, detail=detail)
+    return result
+
+
+def sse(event, data):
+    """
+    Encodes one server-sent event with a JSON payload.
+    """
+    return f"event: {event}\ndata: ".encode() + dumps(data) + b"\n\n"
+
+
+def wants_arrow(http_request: Request):
+    return ARROW_STREAM_MEDIA_TYPE in http_request.headers.get("accept", "")
+
+
+def page_response(
+    http_request, sql, table, offset, page_size, has_more, df=None, database=None, truncated=False
+):
+    """
+    Renders one page as JSON, or as an Arrow IPC stream when the client sends
+    `Accept: application/vnd.apache.arrow.stream`. `truncated` tells the
+    client the cost guard capped the query with a LIMIT.
+    """
+    num_rows = table.num_rows if table is not None else len(df)
+    next_token = (
+        encode_page_token(sql, offset + num_rows, page_size, database) if has_more else None
+    )
+    arrow = wants_arrow(http_request)
+    with stage("serialize", format="arrow" if arrow else "json", rows=num_rows):
+        return _render_page(sql, table, df, offset, next_token, arrow, truncated)
+
+
+def _render_page(sql, table, df, offset, next_token, arrow, truncated=False):
+    if arrow:
+        if table is None:
+            import pyarrow as pa
+
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        body = table_to_ipc(
+            table,
+            {
+                "sql": sql,
+                "offset": str(offset),
+                "next_page_token": next_token,
+                "truncated": str(truncated).lower(),
+            },
+        )
+        return Response(content=body, media_type=ARROW_STREAM_MEDIA_TYPE)
+
+    if table is not None:
+        columns, rows = table_to_records(table)
+    else:
+        columns, rows = dataframe_to_records(df)
+    return ORJSONResultResponse(
+        {
+            "sql": sql,
+            "columns": columns,
+            "data": rows,
+            "offset": offset,
+            "next_page_token": next_token,
+            "truncated": truncated,
+        }
+    )
+
+
+@app.post("/execute_query/")
+async def execute_query(request: QueryRequest, http_request: Request):
+    page_size = resolve_page_size(request.page_size)
+    result = await answer_query(request, http_request, page_size)
+    logger.debug(f"Returning {len(result['result'])} rows for: {result['final_sql']}")
+    return page_response(
+        http_request,
+        result["final_sql"],
+        result["arrow"],
+        0,
+        page_size,
+        result["has_more"],
+        df=result["result"],
+        database=result["database"],
+        truncated=result["truncated"],
+    )
+
+
+# Rows per `rows` event of /execute_query/events
+SSE_ROWS_PER_EVENT = 100
+
+
+@app.get("/execute_query/events")
+async def execute_query_events(
+    query: str,
+    http_request: Request,
+    page_size: Optional[int] = None,
+    tenant: Optional[str] = None,
+    database: Optional[str] = None,
+):
+    """
+    Answers a question as server-sent events, for `EventSource` clients.
+
+    Pipeline events are sent as they happen: `generating`, `sql_token` (the
+    SQL as the model writes it), `executing`, `retry`, `reasoning`, and so
+    on. Then come `result` (SQL and columns), the first page in `rows`
+    events, and `done` with the `next_page_token`; on failure, `failed`.
+    """
+    page_size = resolve_page_size(page_size)
+    resolve_database(http_request, database, tenant)
+    sql_system = http_request.app.state.context.sql_system
+    events = asyncio.Queue()
+    # Not coalesced: every caller gets its own progress events
+    task = asyncio.ensure_future(
+        sql_system.forward(
+            query,
+            page_size,
+            tenant,
+            on_event=lambda event, data: events.put_nowait((event, data)),
+            database=database,
+        )
+    )
+
+    async def stream():
+        try:
+            while not (task.done() and events.empty()):
+                getter = asyncio.ensure_future(events.get())
+                await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter.done():
+                    yield sse(*getter.result())
+                else:
+                    getter.cancel()
+            result = task.result()
+            if result["result"] is None:
+                yield sse("failed", {"detail": result["error"] or "No SQL query could be generated."})
+                return
+            sql, table = result["final_sql"], result["arrow"]
+            if table is not None:
+                columns, rows = table_to_records(table)
+            else:
+                columns, rows = dataframe_to_records(result["result"])
+            yield sse("result", {"sql": sql, "columns": columns, "truncated": result["truncated"]})
+            for start in range(0, len(rows), SSE_ROWS_PER_EVENT):
+                yield sse("rows", {"data": rows[start:start + SSE_ROWS_PER_EVENT]})
+            next_token = (
+                encode_page_token(sql, len(rows), page_size, result["database"])
+                if result["has_more"]
+                else None
+            )
+            yield sse("done", {"row_count": len(rows), "next_page_token": next_token})
+        finally:
+            # Also reached when the client disconnects mid-stream
+            task.cancel()
+
+    return StreamingResponse(
+        stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
+@app.post("/execute_query/page")
+async def execute_query_page(request: PageRequest, http_request: Request):
+    """
+    Fetches the next page of an already validated query without calling the LLM.
+    """
+    try:
+        sql, offset, page_size, database = decode_page_token(request.page_token)
+    except InvalidPageToken as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    sql_system = http_request.app.state.context.sql_system
+    try:
+        table = await cancel_on_disconnect(
+            http_request,
+            sql_system.execute_arrow(sql, page_size, offset, db=sql_system.database(database)),
+        )
+    except (asyncio.CancelledError, HTTPException):
+        raise
     except Exception as e:
         logger.error(f"Error: {e}")
         raise HTTPException(status_code=400, detail=str(e))
+    has_more = table.num_rows > page_size
+    return page_response(
+        http_request, sql, table.slice(0, page_size), offset, page_size, has_more, database=database
+    )
+
+
+@app.post("/execute_query/stream")
+async def execute_query_stream(request: QueryRequest, http_request: Request):
+    """
+    Streams the full result as NDJSON: a `meta` object with the SQL and column
+    names, one JSON array per row, then an `end` object with the row count.
+
+    The first page comes from the validation run in forward(); the remaining
+    rows are read through a server-side cursor in bounded batches.
+    """
+    page_size = resolve_page_size(request.page_size)
+    # The stream promises every row, so the guard may reject but never truncate
+    result = await answer_query(request, http_request, page_size, truncate=False)
+    sql = result["final_sql"]
+    # The rest of the rows come from what page 1 was read with, e.g. a summary table
+    source_sql = result["source_sql"]
+    first_page = result["result"]
+
+    async def ndjson():
+        row_count = len(first_page)
+        yield dumps(
+            {"type": "meta", "sql": sql, "columns": [str(c) for c in first_page.columns]}
+        ) + b"\n"
+        yield b"".join(
+            dumps(list(row)) + b"\n"
+            for row in first_page.itertuples(index=False, name=None)
+        )
+        if result["has_more"]:
+            try:
+                db = http_request.app.state.context.sql_system.database(result["database"])
+                stream = stream_query(paginate_sql(source_sql, None, row_count), engine=db.read_engine())
+                await stream.__anext__()  # column names, already sent
+                async for batch in stream:
+                    row_count += len(batch)
+                    yield b"".join(dumps(list(row)) + b"\n" for row in batch)
+            except Exception as e:
+                logger.error(f"Streaming failed after {row_count} rows: {e}")
+                yield dumps({"type": "error", "detail": str(e)}) + b"\n"
+                return
+        yield dumps({"type": "end", "row_count": row_count}) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+@app.post("/batch")
+async def batch(request: BatchRequest, http_request: Request):
+    """
+    Answers a list of questions and streams NDJSON: one `result` record per
+    question as soon as it is answered (in completion order, carrying the
+    question `id`), then a `summary` record. Duplicate questions are answered
+    once; `concurrency` questions run at a time.
+    """
+    if len(request.questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(
+            status_code=400, detail=f"A batch can have at most {BATCH_MAX_QUESTIONS} questions."
+        )
+    try:
+        questions = parse_questions(
+            [item if isinstance(item, str) else item.model_dump() for item in request.questions]
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    resolve_database(http_request, request.database, request.tenant)
+    sql_system = http_request.app.state.context.sql_system
+    records = run_batch(
+        sql_system,
+        questions,
+        request.concurrency,
+        resolve_page_size(request.page_size),
+        request.tenant,
+        request.database,
+    )
+
+    async def ndjson():
+        async for record in records:
+            yield dumps(record) + b"\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
+
+def get_job_queue(http_request: Request):
+    jobs = http_request.app.state.context.jobs
+    if jobs is None:
+        raise HTTPException(status_code=404, detail="Background jobs are disabled.")
+    return jobs
+
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: QueryRequest, http_request: Request):
+    """
+    Queues a question for the background workers and returns its job id at
+    once. Poll `GET /jobs/{id}` or subscribe to `GET /jobs/{id}/events`.
+    """
+    jobs = get_job_queue(http_request)
+    resolve_database(http_request, request.database, request.tenant)
+    try:
+        job = await jobs.submit(
+            request.query, resolve_page_size(request.page_size), request.tenant, request.database
+        )
+    except JobQueueFull as e:
+        raise HTTPException(status_code=503, detail=f"Job queue is full: {e}")
+    return {
+        "job_id": job["id"],
+        "status": job["status"],
+        "status_url": f"/jobs/{job['id']}",
+        "events_url": f"/jobs/{job['id']}/events",
+    }
+
+
+@app.get("/jobs/stats")
+async def job_stats(request: Request):
+    jobs = request.app.state.context.jobs
+    if jobs is None:
+        return {"enabled": False}
+    return {"enabled": True, **jobs.stats()}
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, http_request: Request):
+    """
+    Returns the status of a job and, once it succeeded, the first page of its
+    result in the `/execute_query/` format.
+    """
+    job = await get_job_queue(http_request).get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job.")
+    return ORJSONResultResponse(job)
+
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, http_request: Request):
+    job = await get_job_queue(http_request).cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job.")
+    return ORJSONResultResponse(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, http_request: Request):
+    """
+    Server-sent events with the job after each status change; the stream
+    ends after the final (succeeded, failed or cancelled) event.
+    """
+    jobs = get_job_queue(http_request)
+    if await jobs.get(job_id) is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired job.")
+
+    async def events():
+        status = None
+        while True:
+            job = await jobs.get(job_id)
+            if job is None:
+                yield sse("error", {"detail": "Job expired."})
+                return
+            if job["status"] != status:
+                status = job["status"]
+                yield sse(status, job)
+            if status in FINISHED or await http_request.is_disconnected():
+                return
+            await asyncio.sleep(JOB_POLL_SECONDS)
+
+    return StreamingResponse(
+        events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"}
+    )
+
+
+@app.get("/cache/stats")
+async def cache_stats(request: Request):
+    semantic_cache = request.app.state.context.semantic_cache
+    if semantic_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **semantic_cache.stats()}
+
+
+@app.get("/embeddings/stats")
+async def embedding_stats(request: Request):
+    embeddings = request.app.state.context.embeddings
+    if embeddings is None:
+        return {"enabled": False}
+    return {"enabled": True, **embeddings.stats()}
+
+
+@app.get("/cache/results/stats")
+async def result_cache_stats(request: Request):
+    result_cache = request.app.state.context.sql_system.result_cache
+    if result_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **result_cache.stats()}
+
+
+@app.get("/databases/stats")
+async def database_stats(request: Request):
+    """
+    Health, lag and in-flight reads of every replica, per database.
+    """
+    return request.app.state.context.databases.stats()
+
+
+@app.get("/examples/stats")
+async def example_stats(request: Request):
+    """
+    Size and hit counters of the few-shot example store of each database.
+    """
+    if not EXAMPLES_ENABLED:
+        return {"enabled": False}
+    databases = request.app.state.context.databases.databases
+    return {
+        "enabled": True,
+        "databases": {name: db.example_store.stats() for name, db in databases.items()},
+    }
+
+
+@app.get("/summaries/stats")
+async def summary_stats(request: Request):
+    """
+    Summary tables of each database, with their freshness and hit counts,
+    and the most frequent aggregate shapes of the recent workload.
+    """
+    databases = request.app.state.context.databases.databases
+    if not any(db.summaries is not None for db in databases.values()):
+        return {"enabled": False}
+    return {
+        "enabled": True,
+        "databases": {name: db.summaries.stats() for name, db in databases.items()},
+    }
+
+
+@app.get("/singleflight/stats")
+async def singleflight_stats(request: Request):
+    singleflight = request.app.state.context.sql_system.singleflight
+    if singleflight is None:
+        return {"enabled": False}
+    return {"enabled": True, **singleflight.stats()}
+
+
+@app.get("/routing/stats")
+async def routing_stats(request: Request):
+    return request.app.state.context.sql_system.router.stats()
+
+
+@app.get("/ratelimit/stats")
+async def ratelimit_stats(request: Request):
+    rate_limiter = request.app.state.context.sql_system.rate_limiter
+    if rate_limiter is None:
+        return {"enabled": False}
+    return {"enabled": True, **rate_limiter.stats()}
+
+
+@app.get("/speculation/stats")
+async def speculation_stats(request: Request):
+    speculation = request.app.state.context.sql_system.speculation
+    if speculation is None:
+        return {"enabled": False}
+    return {"enabled": True, **speculation.stats()}
 
 
+@app.get("/metrics")
+async def metrics():
+    """
+    Prometheus scrape endpoint: stage latency histograms, LLM call latency and
+    tokens per model, retries, request outcomes and cache statistics.
+    """
+    return Response(content=REGISTRY.render(), media_type=PROMETHEUS_MEDIA_TYPE)
 
 
+@app.get("/health")
+async def health(request: Request):
+    context = request.app.state.context
+    timings = context.boot_timings
+    snapshot = context.schema_provider.snapshot if context.schema_provider else None
+    return {
+        "status": "ok",
+        "schema_version": snapshot.version if snapshot else None,
+        "boot_seconds": timings,
+        "cold_start_budget_seconds": COLD_START_BUDGET_SECONDS,
+        "within_budget": timings.get("total", 0.0) <= COLD_START_BUDGET_SECONDS,
+    }
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -0,0 +1,136 @@
+import asyncio
+import time
+
+import orjson
+
+from log import logger
+from config import BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY
+from cache import normalize_question
+from jobs import result_payload
+from serialization import dumps
+
+
+def parse_questions(items):
+    """
+    Turns questions given as strings or `{"id", "question"|"query"}` dicts into
+    `(id, question)` pairs; items without an id are numbered from 1.
+    """
+    questions = []
+    for number, item in enumerate(items, 1):
+        if isinstance(item, str):
+            question_id, question = str(number), item
+        else:
+            question_id = str(item.get("id") or number)
+            question = item.get("question") or item.get("query")
+        if not question or not question.strip():
+            raise ValueError(f"Question {question_id} is empty")
+        questions.append((question_id, question.strip()))
+    return questions
+
+
+def load_questions(path):
+    """
+    Reads questions from a JSONL file: one JSON object or string per line, or
+    plain question text.
+    """
+    items = []
+    with open(path, "rb") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                items.append(orjson.loads(line))
+            except orjson.JSONDecodeError:
+                items.append(line.decode("utf-8"))
+    return parse_questions(items)
+
+
+def dedupe(questions):
+    """
+    Groups `(id, question)` pairs by normalized question text; returns a list
+    of `(question, [ids])` in first-seen order.
+    """
+    groups = {}
+    for question_id, question in questions:
+        key = normalize_question(question)
+        if key not in groups:
+            groups[key] = (question, [])
+        groups[key][1].append(question_id)
+    return list(groups.values())
+
+
+async def run_batch(
+    sql_system, questions, concurrency=BATCH_CONCURRENCY, page_size=None, tenant=None, database=None
+):
+    """
+    Answers a batch of `(id, question)` pairs and yields one record per input
+    question as soon as its answer is ready, then a summary record.
+
+    Duplicates are answered once. The schema is prepared once for the whole
+    batch and at most `concurrency` questions run at a time; LLM calls still
+    go through the rate limiter of `sql_system`.
+    """
+    started = time.perf_counter()
+    concurrency = max(1, min(concurrency, BATCH_MAX_CONCURRENCY))
+    groups = dedupe(questions)
+    await sql_system.get_schema(sql_system.database(database, tenant))
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def answer(question, ids):
+        async with semaphore:
+            question_started = time.perf_counter()
+            try:
+                result = await sql_system.forward_coalesced(question, page_size, tenant, database)
+                if result["result"] is None:
+                    raise RuntimeError(result["error"] or "No SQL query could be generated.")
+                record = {"status": "ok", **result_payload(result, page_size)}
+            except Exception as e:
+                logger.error(f"Batch question failed: {question}: {e}")
+                record = {"status": "error", "error": str(e)}
+            record["seconds"] = time.perf_counter() - question_started
+            return question, ids, record
+
+    tasks = [asyncio.ensure_future(answer(question, ids)) for question, ids in groups]
+    succeeded = failed = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            question, ids, record = await next_done
+            for index, question_id in enumerate(ids):
+                if record["status"] == "ok":
+                    succeeded += 1
+                else:
+                    failed += 1
+                yield {"type": "result", "id": question_id, "question": question,
+                       "deduplicated": index > 0, **record}
+    finally:
+        # The consumer went away (e.g. the HTTP client disconnected)
+        for task in tasks:
+            task.cancel()
+
+    wall_seconds = time.perf_counter() - started
+    logger.info(
+        f"Batch of {len(questions)} questions ({len(groups)} unique) answered in {wall_seconds:.2f}s"
+    )
+    yield {
+        "type": "summary",
+        "questions": len(questions),
+        "unique": len(groups),
+        "succeeded": succeeded,
+        "failed": failed,
+        "concurrency": concurrency,
+        "wall_seconds": wall_seconds,
+    }
+
+
+async def write_batch(sql_system, questions, output, concurrency=BATCH_CONCURRENCY, page_size=None):
+    """
+    Runs a batch and writes each record as an NDJSON line to the binary file
+    `output`, flushing as results arrive. Returns the summary record.
+    """
+    summary = None
+    async for record in run_batch(sql_system, questions, concurrency, page_size):
+        output.write(dumps(record) + b"\n")
+        output.flush()
+        summary = record
+    return summary
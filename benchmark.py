@@ -0,0 +1,609 @@
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+import dspy
+import litellm
+import orjson
+from sqlalchemy import inspect, text
+
+from log import logger
+from cache import normalize_question
+from columnar import fetch_arrow
+from db import dispose_engine, use_engine
+from guard import QueryGuard
+from main import AgentSystem
+from metrics import collect_stages, record_llm_usage
+from ratelimit import InProcessBackend, RateLimiter
+from result_cache import ResultCache
+from routing import ModelRouter
+from schema import SchemaProvider
+from singleflight import SingleFlight
+from speculation import SpeculationBudget
+
+
+DEFAULT_CORPUS = "benchmarks/questions.jsonl"
+DEFAULT_SCHEMA = "benchmarks/schema.sql"
+DEFAULT_DATABASE = "sqlite+aiosqlite:///benchmarks/bench.db"
+
+FIRST_NAMES = ["John", "Jane", "Alice", "Bob", "Charlie", "David", "Eva", "Frank", "Grace", "Henry"]
+LAST_NAMES = ["Doe", "Smith", "Johnson", "Brown", "Lee", "White", "Green", "Black", "Clark", "Adams"]
+DEPARTMENTS = ["Sales", "Marketing", "HR", "Engineering", "Finance"]
+
+FIELD_PATTERN = re.compile(r"\[\[ ## (\w+) ## \]\]\n(.*?)(?=\n\n\[\[ ## |\Z)", re.DOTALL)
+SQL_BLOCK_PATTERN = re.compile(r"```sql\n(.*?)\n```", re.DOTALL)
+
+
+class Question:
+    def __init__(self, id, question, gold_sql=None):
+        self.id = id
+        self.question = question
+        self.gold_sql = gold_sql
+
+
+def load_corpus(path):
+    """
+    Reads a JSONL corpus; each line needs `question` (or `query`) and may have
+    `id` and `gold_sql` (or `sql`).
+    """
+    questions = []
+    with open(path, "rb") as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = orjson.loads(line)
+            question = item.get("question") or item.get("query")
+            if not question:
+                raise ValueError(f"{path}:{number} has no 'question' field")
+            questions.append(
+                Question(
+                    str(item.get("id") or item.get("request_id") or number),
+                    question,
+                    item.get("gold_sql") or item.get("sql"),
+                )
+            )
+    return questions
+
+
+class StubLM(dspy.LM):
+    """
+    Deterministic stand-in for GroqLM that answers from the corpus gold SQL.
+
+    Every call sleeps `latency` +/- `jitter` seconds (in the calling thread, like
+    a real blocking completion). The first generation for a question is
+    corrupted with a misspelt table (`typo_rate`, fixed by local repair) or a
+    syntax error (`syntax_rate`, needs the LLM fix agents), and calls fail with
+    a rate-limit error at `rate_limit_rate`. Which questions fail is decided
+    by hashing, so runs are reproducible for a given `seed`.
+    """
+
+    def __init__(
+        self,
+        corpus,
+        model="stub/small",
+        latency=0.2,
+        jitter=0.05,
+        typo_rate=0.0,
+        syntax_rate=0.0,
+        rate_limit_rate=0.0,
+        seed=0,
+    ):
+        super().__init__(model=model, cache=False, num_retries=0)
+        self.gold = {normalize_question(q.question): q.gold_sql for q in corpus}
+        self.latency = latency
+        self.jitter = jitter
+        self.typo_rate = typo_rate
+        self.syntax_rate = syntax_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.seed = seed
+        self.calls = 0
+        self.throttled = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._throttled = set()
+        self._lock = threading.Lock()
+
+    def _roll(self, *parts):
+        digest = hashlib.sha256("|".join(map(str, (self.seed, *parts))).encode("utf-8"))
+        return int(digest.hexdigest()[:8], 16) / 2 ** 32
+
+    def _gold_for(self, question):
+        gold = self.gold.get(normalize_question(question))
+        return gold or "SELECT 'NOT ASKING FOR SQL'"
+
+    def _corrupt(self, question, sql, temperature):
+        roll = self._roll(question, temperature)
+        if roll < self.typo_rate:
+            match = re.search(r"\b(from|join)\s+(\w+)", sql, re.IGNORECASE)
+            if match:
+                return f"{sql[:match.start(2)]}{match.group(2)}s{sql[match.end(2):]}"
+        elif roll < self.typo_rate + self.syntax_rate:
+            return re.sub(r"\bFROM\b", "FORM", sql, count=1, flags=re.IGNORECASE)
+        return sql
+
+    def __call__(self, prompt=None, messages=None, **kwargs):
+        messages = messages or [{"role": "user", "content": prompt}]
+        system, user = messages[0]["content"], messages[-1]["content"]
+        fields = re.findall(
+            r"\d+\. `(\w+)`", system.split("Your output fields are:")[1].split("All interactions")[0]
+        )
+        inputs = {name: value.strip() for name, value in FIELD_PATTERN.findall(user)}
+
+        delay = self.latency + self.jitter * (2 * self._roll(user, "latency") - 1)
+        time.sleep(max(0.0, delay))
+
+        key = (user, kwargs.get("temperature"))
+        with self._lock:
+            self.calls += 1
+            throttle = key not in self._throttled and self._roll(user, "rate_limit") < self.rate_limit_rate
+            if throttle:
+                self._throttled.add(key)
+                self.throttled += 1
+        if throttle:
+            raise litellm.RateLimitError("Stub rate limit", llm_provider="stub", model=self.model)
+
+        values = {}
+        if "user_query" in inputs:
+            question = inputs["user_query"]
+            values["generated_sql"] = self._corrupt(
+                question, self._gold_for(question), kwargs.get("temperature")
+            )
+        elif "error_message" in inputs:
+            question = inputs.get("information", "").split("\n")[0].replace("User query:", "").strip()
+            gold = self._gold_for(question)
+            values["error_fix_reasoning"] = (
+                f"The query failed with: {inputs['error_message'][:200]}\n"
+                f"Use this query:\n```sql\n{gold}\n```"
+            )
+            values["generated_sql"] = gold
+        elif "instruction" in inputs:
+            found = SQL_BLOCK_PATTERN.search(inputs["instruction"])
+            values["generated_sql"] = found.group(1) if found else inputs["instruction"]
+        values.setdefault("reasoning", "Following the instructions.")
+
+        output = "\n\n".join(f"[[ ## {name} ## ]]\n{values.get(name, '')}" for name in fields)
+        output += "\n\n[[ ## completed ## ]]"
+        usage = {
+            "prompt_tokens": sum(len(m["content"]) for m in messages) // 4,
+            "completion_tokens": len(output) // 4,
+        }
+        with self._lock:
+            self.prompt_tokens += usage["prompt_tokens"]
+            self.completion_tokens += usage["completion_tokens"]
+        record_llm_usage({"model": self.model, "usage": usage})
+        return [output]
+
+
+def _fake_value(rng, column, column_type):
+    column_type = column_type.lower()
+    if "int" in column_type:
+        return rng.randint(1, 1000)
+    if any(name in column_type for name in ("real", "float", "double", "decimal", "numeric")):
+        return round(rng.uniform(1, 500), 2)
+    if "date" in column_type or "time" in column_type:
+        return (date(2021, 1, 1) + timedelta(days=rng.randrange(730))).isoformat()
+    if "name" in column:
+        return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    if "department" in column:
+        return rng.choice(DEPARTMENTS)
+    return f"{column}_{rng.randrange(50)}"
+
+
+async def seed_database(engine, schema_path=DEFAULT_SCHEMA, rows=500, seed=0):
+    """
+    Creates the benchmark schema and fills every table with `rows` synthetic
+    rows. Primary keys are sequential and foreign keys point at the first 90%
+    of the parent rows, so "without any ..." questions have answers. Does
+    nothing when the database already has tables.
+    """
+
+    def _tables(sync_conn):
+        inspector = inspect(sync_conn)
+        tables = {}
+        for name in inspector.get_table_names():
+            primary = set(inspector.get_pk_constraint(name).get("constrained_columns") or [])
+            references = {
+                col: (fk["referred_table"], ref)
+                for fk in inspector.get_foreign_keys(name)
+                for col, ref in zip(fk["constrained_columns"], fk["referred_columns"])
+            }
+            columns = [(col["name"], str(col["type"])) for col in inspector.get_columns(name)]
+            tables[name] = (columns, primary, references)
+        return tables
+
+    async with engine.begin() as conn:
+        if await conn.run_sync(lambda c: inspect(c).get_table_names()):
+            return False
+        with open(schema_path, "r", encoding="utf-8") as f:
+            ddl = f.read()
+        statements = re.sub(r"--[^\n]*", "", ddl).split(";")
+        for statement in statements:
+            if statement.strip():
+                await conn.execute(text(statement))
+        tables = await conn.run_sync(_tables)
+
+        rng = random.Random(seed)
+        keys, pending = {}, dict(tables)
+        while pending:
+            # Parents before children
+            ready = [
+                name
+                for name, (_, _, references) in pending.items()
+                if all(ref_table in keys or ref_table == name for ref_table, _ in references.values())
+            ] or list(pending)
+            for name in ready:
+                columns, primary, references = pending.pop(name)
+                records = []
+                for index in range(rows):
+                    record = {}
+                    for column, column_type in columns:
+                        if column in primary:
+                            record[column] = index + 1
+                        elif column in references and references[column][0] in keys:
+                            parents = keys[references[column][0]]
+                            record[column] = rng.choice(parents[: max(1, int(len(parents) * 0.9))])
+                        else:
+                            record[column] = _fake_value(rng, column, column_type)
+                    records.append(record)
+                keys[name] = [index + 1 for index in range(rows)]
+                names = [column for column, _ in columns]
+                insert = text(
+                    f"INSERT INTO {name} ({', '.join(names)}) "
+                    f"VALUES ({', '.join(':' + column for column in names)})"
+                )
+                await conn.execute(insert, records)
+        logger.info(f"Seeded {len(tables)} benchmark tables with {rows} rows each.")
+    return True
+
+
+def _normalize_value(value):
+    if isinstance(value, (float, Decimal)):
+        return round(float(value), 4)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return value
+
+
+def rows_match(actual, gold, ordered):
+    """
+    Compares result rows by value (column names are ignored); row order only
+    matters when the gold query has an ORDER BY.
+    """
+    actual = [tuple(_normalize_value(v) for v in row) for row in actual]
+    gold = [tuple(_normalize_value(v) for v in row) for row in gold]
+    if not ordered:
+        actual, gold = sorted(actual, key=repr), sorted(gold, key=repr)
+    return actual == gold
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of a list of numbers.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, min(len(ordered) - 1, math.ceil(p / 100 * len(ordered)) - 1))]
+
+
+def summarize_timings(values):
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 50),
+        "p95": percentile(values, 95),
+        "p99": percentile(values, 99),
+    }
+
+
+class Sample:
+    def __init__(self, question, seconds, stages, ok, error=None, rows=None, retries=None, truncated=False):
+        self.question = question
+        self.seconds = seconds
+        self.stages = stages
+        self.ok = ok
+        self.error = error
+        self.rows = rows
+        # Fix notes from `error_reason` ("Local repair: ..." for local fixes);
+        # None when unknown, as the API does not return them
+        self.retries = retries
+        self.truncated = truncated
+
+
+async def gold_results(corpus):
+    gold = {}
+    for item in corpus:
+        if item.gold_sql:
+            table = await fetch_arrow(item.gold_sql)
+            gold[item.id] = [tuple(row.values()) for row in table.to_pylist()]
+    return gold
+
+
+def build_agent_system(lm_factory, args):
+    return AgentSystem(
+        max_retry=3,
+        schema_provider=SchemaProvider(),
+        guard=QueryGuard() if not args.no_guard else None,
+        speculation=SpeculationBudget() if args.speculative else None,
+        router=ModelRouter(lm_factory),
+        rate_limiter=RateLimiter(
+            InProcessBackend(), requests_per_minute=args.rpm, tokens_per_minute=args.tpm
+        ),
+        result_cache=ResultCache() if args.result_cache else None,
+        singleflight=SingleFlight() if args.coalesce else None,
+    )
+
+
+async def run_inprocess(system, corpus, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+    forward = system.forward_coalesced if args.coalesce else system.forward
+
+    async def one(item):
+        async with semaphore:
+            with collect_stages() as stages:
+                started = time.perf_counter()
+                result = await forward(item.question)
+                seconds = time.perf_counter() - started
+            table = result["arrow"]
+            rows = [tuple(row.values()) for row in table.to_pylist()] if table is not None else None
+            return Sample(
+                item, seconds, stages, result["result"] is not None, result["error"], rows,
+                list(result["error_reason"]),
+            )
+
+    return await asyncio.gather(*(one(item) for _ in range(args.iterations) for item in corpus))
+
+
+async def run_http(client, corpus, args):
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(item):
+        async with semaphore:
+            with collect_stages() as stages:
+                started = time.perf_counter()
+                response = await client.post(
+                    "/execute_query/", json={"query": item.question, "page_size": args.page_size}
+                )
+                seconds = time.perf_counter() - started
+            if response.status_code != 200:
+                return Sample(item, seconds, stages, False, f"HTTP {response.status_code}: {response.text[:200]}")
+            body = response.json()
+            rows = [tuple(row.values()) for row in body["data"]]
+            return Sample(item, seconds, stages, True, rows=rows, truncated=bool(body.get("next_page_token")))
+
+    return await asyncio.gather(*(one(item) for _ in range(args.iterations) for item in corpus))
+
+
+def build_report(samples, gold, wall_seconds, stubs, args):
+    total = len(samples)
+    latencies = [sample.seconds for sample in samples]
+    stages = {}
+    for sample in samples:
+        for name, seconds, _ in sample.stages:
+            stages.setdefault(name, []).append(seconds)
+    known = [sample for sample in samples if sample.retries is not None]
+    retried = [sample for sample in known if sample.retries]
+    local = sum(1 for s in known for note in s.retries if str(note).startswith("Local repair"))
+    llm_fixes = sum(1 for s in known for note in s.retries if not str(note).startswith("Local repair"))
+
+    checked, correct, per_question = 0, 0, {}
+    for sample in samples:
+        stats = per_question.setdefault(
+            sample.question.id, {"runs": 0, "errors": 0, "correct": 0, "checked": 0, "seconds": []}
+        )
+        stats["runs"] += 1
+        stats["seconds"].append(sample.seconds)
+        if not sample.ok:
+            stats["errors"] += 1
+        expected = gold.get(sample.question.id)
+        if expected is None or sample.truncated:
+            continue
+        checked += 1
+        stats["checked"] += 1
+        ordered = bool(re.search(r"\border\s+by\b", sample.question.gold_sql, re.IGNORECASE))
+        if sample.ok and rows_match(sample.rows or [], expected, ordered):
+            correct += 1
+            stats["correct"] += 1
+
+    llm_calls = len(stages.get("llm_call", []))
+    return {
+        "config": {
+            key: value for key, value in vars(args).items()
+            if key not in ("output", "baseline", "fail_on_regression")
+        },
+        "summary": {
+            "questions": total,
+            "wall_seconds": wall_seconds,
+            "throughput_qps": total / wall_seconds if wall_seconds else None,
+            "latency_p50": percentile(latencies, 50),
+            "latency_p95": percentile(latencies, 95),
+            "latency_p99": percentile(latencies, 99),
+            "error_rate": sum(1 for s in samples if not s.ok) / total if total else None,
+            "retry_rate": len(retried) / len(known) if known else None,
+            "local_repairs_per_question": local / len(known) if known else None,
+            "llm_fixes_per_question": llm_fixes / len(known) if known else None,
+            "llm_calls_per_question": llm_calls / total if total and stages else None,
+            "accuracy": correct / checked if checked else None,
+        },
+        "stages": {name: summarize_timings(values) for name, values in sorted(stages.items())},
+        "llm": {
+            "calls": sum(stub.calls for stub in stubs),
+            "throttled": sum(stub.throttled for stub in stubs),
+            "prompt_tokens": sum(stub.prompt_tokens for stub in stubs),
+            "completion_tokens": sum(stub.completion_tokens for stub in stubs),
+        },
+        "questions": {
+            qid: {
+                "runs": stats["runs"],
+                "errors": stats["errors"],
+                "accuracy": stats["correct"] / stats["checked"] if stats["checked"] else None,
+                "p50": percentile(stats["seconds"], 50),
+            }
+            for qid, stats in per_question.items()
+        },
+        "errors": sorted({s.error for s in samples if s.error and not s.ok})[:20],
+    }
+
+
+# Summary metrics where a larger value is better; every other metric is a cost
+HIGHER_IS_BETTER = {"throughput_qps", "accuracy"}
+
+
+def diff_reports(current, baseline, tolerance):
+    """
+    Compares summary metrics and per-stage p95 against a baseline report.
+
+    Returns `(rows, regressions)`; a metric regresses when it got worse by more
+    than `tolerance` (relative, or absolute for rates that were zero).
+    """
+    pairs = [(key, current["summary"].get(key), baseline["summary"].get(key)) for key in current["summary"]]
+    for name, stats in current["stages"].items():
+        previous = baseline.get("stages", {}).get(name, {})
+        pairs.append((f"stage.{name}.p95", stats.get("p95"), previous.get("p95")))
+
+    rows, regressions = [], []
+    for key, now, before in pairs:
+        if key in ("questions", "wall_seconds") or now is None or before is None:
+            continue
+        change = (now - before) / before if before else (now - before)
+        worse = -change if key in HIGHER_IS_BETTER else change
+        rows.append((key, before, now, change))
+        if worse > tolerance:
+            regressions.append(key)
+    return rows, regressions
+
+
+def print_report(report, diff=None):
+    summary = report["summary"]
+    print(f"\n{summary['questions']} questions in {summary['wall_seconds']:.2f}s")
+    for key, value in summary.items():
+        if key not in ("questions", "wall_seconds"):
+            print(f"  {key:28} {value:.4f}" if value is not None else f"  {key:28} -")
+    print("\nStage                      count      p50      p95      p99")
+    for name, stats in report["stages"].items():
+        print(
+            f"  {name:22} {stats['count']:7d} {stats['p50']:8.4f} {stats['p95']:8.4f} {stats['p99']:8.4f}"
+        )
+    if report["errors"]:
+        print("\nErrors:")
+        for error in report["errors"]:
+            print(f"  {error[:160]}")
+    if diff is not None:
+        rows, regressions = diff
+        print("\nAgainst baseline                   before      now   change")
+        for key, before, now, change in rows:
+            flag = "  REGRESSION" if key in regressions else ""
+            print(f"  {key:30} {before:9.4f} {now:9.4f} {change:+8.1%}{flag}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Replay a question corpus against AgentSystem or the API with a stub LLM."
+    )
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSONL with question/gold_sql per line")
+    parser.add_argument("--mode", choices=["inprocess", "http"], default="inprocess")
+    parser.add_argument("--url", help="Load-test a running server instead of the in-process app (http mode)")
+    parser.add_argument("--database", default=DEFAULT_DATABASE, help="SQLAlchemy async URL of the stand-in database")
+    parser.add_argument("--schema", default=DEFAULT_SCHEMA, help="DDL used to create an empty database")
+    parser.add_argument("--rows", type=int, default=500, help="Synthetic rows per table when seeding")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--llm-latency", type=float, default=0.2)
+    parser.add_argument("--llm-jitter", type=float, default=0.05)
+    parser.add_argument("--typo-rate", type=float, default=0.1)
+    parser.add_argument("--syntax-rate", type=float, default=0.05)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=0, help="Rate limiter requests/minute (0 = unlimited)")
+    parser.add_argument("--tpm", type=int, default=0, help="Rate limiter tokens/minute (0 = unlimited)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-guard", action="store_true")
+    parser.add_argument("--speculative", action="store_true")
+    parser.add_argument("--result-cache", action="store_true")
+    parser.add_argument("--coalesce", action="store_true")
+    parser.add_argument("--output", help="Write the JSON report here")
+    parser.add_argument("--baseline", help="Compare against a previous JSON report")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument("--fail-on-regression", action="store_true")
+    return parser.parse_args(argv)
+
+
+async def run(args):
+    corpus = load_corpus(args.corpus)
+    stubs = []
+
+    def lm_factory(model):
+        stub = StubLM(
+            corpus,
+            model=f"stub/{model}",
+            latency=args.llm_latency,
+            jitter=args.llm_jitter,
+            typo_rate=args.typo_rate,
+            syntax_rate=args.syntax_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            seed=args.seed,
+        )
+        stubs.append(stub)
+        return stub
+
+    gold = {}
+    if not args.url:
+        engine = use_engine(args.database)
+        await seed_database(engine, args.schema, args.rows, args.seed)
+        gold = await gold_results(corpus)
+
+    started = time.perf_counter()
+    try:
+        if args.mode == "inprocess":
+            samples = await run_inprocess(build_agent_system(lm_factory, args), corpus, args)
+        elif args.url:
+            import httpx
+
+            async with httpx.AsyncClient(base_url=args.url, timeout=120) as client:
+                samples = await run_http(client, corpus, args)
+        else:
+            import httpx
+            from app import app
+
+            async with app.router.lifespan_context(app):
+                sql_system = app.state.context.sql_system
+                sql_system.router = ModelRouter(lm_factory)
+                sql_system.rate_limiter = RateLimiter(
+                    InProcessBackend(), requests_per_minute=args.rpm, tokens_per_minute=args.tpm
+                )
+                transport = httpx.ASGITransport(app=app)
+                async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=120) as client:
+                    started = time.perf_counter()
+                    samples = await run_http(client, corpus, args)
+        wall_seconds = time.perf_counter() - started
+    finally:
+        await dispose_engine()
+    return build_report(samples, gold, wall_seconds, stubs, args)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = asyncio.run(run(args))
+    diff = None
+    if args.baseline:
+        with open(args.baseline, "rb") as f:
+            diff = diff_reports(report, orjson.loads(f.read()), args.tolerance)
+    print_report(report, diff)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(orjson.dumps(report, option=orjson.OPT_INDENT_2))
+    if diff is not None and diff[1] and args.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
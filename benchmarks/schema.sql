@@ -0,0 +1,16 @@
+-- Local stand-in for the schema described in config.db_info, used by benchmark.py
+CREATE TABLE employee (
+    employee_id INTEGER PRIMARY KEY,
+    full_name TEXT NOT NULL,
+    department TEXT NOT NULL
+);
+
+CREATE TABLE sales (
+    sale_id INTEGER PRIMARY KEY,
+    employee_id INTEGER NOT NULL REFERENCES employee (employee_id),
+    units_sold REAL NOT NULL,
+    sale_date DATE NOT NULL
+);
+
+CREATE INDEX idx_sales_employee ON sales (employee_id);
+CREATE INDEX idx_sales_date ON sales (sale_date);
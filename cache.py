@@ -0,0 +1,220 @@
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+
+from log import logger
+from config import (
+    SEMANTIC_CACHE_MAX_SIZE,
+    SEMANTIC_CACHE_STORE_RESULTS,
+    SEMANTIC_CACHE_THRESHOLD,
+    SEMANTIC_CACHE_TTL_SECONDS,
+)
+
+
+def normalize_question(text):
+    """
+    Lower-cases a question and collapses whitespace and trailing punctuation so
+    trivially different spellings of the same question share one key.
+    """
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip(" ?.!")
+
+
+# Numbers and quoted values: questions that differ only in them ("sales in
+# 2023" vs "sales in 2024") embed almost identically but need different SQL
+QUESTION_LITERAL_PATTERN = re.compile(r"'[^']*'|\"[^\"]*\"|\d+(?:[.,]\d+)*")
+# Unquoted names are told apart by their capitals ("employees in Sales" vs
+# "in HR"); a sentence's first word is only a name when it is an acronym
+WORD_PATTERN = re.compile(r"[^\W\d_][\w&-]*")
+SENTENCE_END_PATTERN = re.compile(r"[.!?;:]+\s+")
+
+
+def question_names(text):
+    """
+    Returns the capitalized words of a question that do not just start a
+    sentence, e.g. department or product names.
+    """
+    names = []
+    for sentence in SENTENCE_END_PATTERN.split(text):
+        for index, word in enumerate(WORD_PATTERN.findall(sentence)):
+            if word == "I" or word.islower():
+                continue
+            if index == 0 and not (word.isupper() and len(word) > 1):
+                continue
+            names.append(word)
+    return names
+
+
+def question_literals(text):
+    """
+    Returns the numbers, quoted values and capitalized names of a question, in
+    a canonical order.
+    """
+    literals = QUESTION_LITERAL_PATTERN.findall(text)
+    literals += question_names(QUESTION_LITERAL_PATTERN.sub(" ", text))
+    return tuple(sorted(literal.lower() for literal in literals))
+
+
+def default_embedder(texts):
+    """
+    Encodes texts with the shared embedding service, also used by RAG.
+    """
+    from embeddings import get_embedding_service
+
+    return get_embedding_service().encode(texts)
+
+
+class CacheEntry:
+    def __init__(self, question, schema_version, sql, embedding, df=None):
+        self.id = uuid.uuid4().hex
+        self.question = question
+        self.schema_version = schema_version
+        self.sql = sql
+        self.embedding = embedding
+        self.literals = question_literals(question)
+        self.df = df
+        self.created_at = time.monotonic()
+
+
+class SemanticQueryCache:
+    """
+    Bounded LRU/TTL cache of answered questions, matched by embedding similarity.
+
+    A lookup only considers entries generated against the same schema version,
+    so a schema change never serves SQL written for the old structure, and with
+    the same numbers and quoted values as the question.
+    """
+
+    def __init__(
+        self,
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        max_size=SEMANTIC_CACHE_MAX_SIZE,
+        ttl_seconds=SEMANTIC_CACHE_TTL_SECONDS,
+        store_results=SEMANTIC_CACHE_STORE_RESULTS,
+        embedder=None,
+    ):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.store_results = store_results
+        self.embedder = embedder or default_embedder
+        self.entries = OrderedDict()
+        self.exact = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def embed(self, question):
+        """
+        Returns the unit-normalized embedding of a question.
+        """
+        vector = np.asarray(self.embedder([question])[0], dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expired(self, entry, now):
+        return self.ttl_seconds and now - entry.created_at > self.ttl_seconds
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id, None)
+        if entry is not None:
+            key = (normalize_question(entry.question), entry.schema_version)
+            if self.exact.get(key) == entry_id:
+                del self.exact[key]
+        return entry
+
+    def _purge_expired(self, now):
+        for entry_id in [k for k, e in self.entries.items() if self._expired(e, now)]:
+            self._remove(entry_id)
+            self.evictions += 1
+
+    def lookup(self, question, schema_version, embedding=None):
+        """
+        Returns `(entry, embedding)` where entry is the closest cached entry at or
+        above the similarity threshold, or None. Exact (normalized) matches are
+        served without computing an embedding; the embedding is returned so the
+        caller can reuse it when storing the answer.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self._purge_expired(now)
+            entry_id = self.exact.get((normalize_question(question), schema_version))
+            if entry_id is not None:
+                self.entries.move_to_end(entry_id)
+                self.hits += 1
+                return self.entries[entry_id], embedding
+            literals = question_literals(question)
+            candidates = [
+                e
+                for e in self.entries.values()
+                if e.schema_version == schema_version and e.literals == literals
+            ]
+
+        best, best_score = None, -1.0
+        if candidates:
+            if embedding is None:
+                embedding = self.embed(question)
+            matrix = np.stack([e.embedding for e in candidates])
+            scores = matrix @ embedding
+            index = int(np.argmax(scores))
+            best, best_score = candidates[index], float(scores[index])
+
+        with self.lock:
+            if best is not None and best_score >= self.threshold and best.id in self.entries:
+                self.entries.move_to_end(best.id)
+                self.hits += 1
+                logger.debug(
+                    f"Semantic cache hit ({best_score:.3f}): '{question}' ~ '{best.question}'"
+                )
+                return best, embedding
+            self.misses += 1
+            return None, embedding
+
+    def store(self, question, schema_version, sql, df=None, embedding=None):
+        """
+        Caches validated SQL (and, if enabled, its result) for a question.
+        """
+        if embedding is None:
+            embedding = self.embed(question)
+        entry = CacheEntry(
+            question,
+            schema_version,
+            sql,
+            embedding,
+            df=df if self.store_results else None,
+        )
+        key = (normalize_question(question), schema_version)
+        with self.lock:
+            previous = self.exact.get(key)
+            if previous is not None:
+                self._remove(previous)
+            self.entries[entry.id] = entry
+            self.exact[key] = entry.id
+            while len(self.entries) > self.max_size:
+                oldest = next(iter(self.entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return entry
+
+    def invalidate(self, entry):
+        """
+        Drops an entry, e.g. when its cached SQL no longer executes.
+        """
+        with self.lock:
+            self._remove(entry.id)
+
+    def stats(self):
+        with self.lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+            }
@@ -0,0 +1,85 @@
+import asyncio
+import pandas as pd
+import pyarrow as pa
+from log import logger
+from config import ARROW_BATCH_SIZE, DB_QUERY_TIMEOUT_SECONDS
+from db import stream_query
+
+
+ARROW_STREAM_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+
+def rows_to_record_batch(columns, rows):
+    """
+    Builds an Arrow record batch from a list of row tuples, one column at a time.
+    """
+    if rows:
+        arrays = [pa.array(values) for values in zip(*rows)]
+    else:
+        arrays = [pa.array([], type=pa.null()) for _ in columns]
+    return pa.RecordBatch.from_arrays(arrays, names=list(columns))
+
+
+def batches_to_table(columns, batches):
+    """
+    Combines record batches into one table, widening types that differ between
+    batches (e.g. an all-NULL batch or DECIMAL values of different precision).
+    """
+    if not batches:
+        return pa.Table.from_batches([rows_to_record_batch(columns, [])])
+    tables = [pa.Table.from_batches([batch]) for batch in batches]
+    if len(tables) == 1:
+        return tables[0]
+    return pa.concat_tables(tables, promote_options="permissive")
+
+
+async def fetch_arrow(sql_query, params=None, timeout=DB_QUERY_TIMEOUT_SECONDS, engine=None):
+    """
+    Executes a query and returns its result as a `pyarrow.Table`.
+
+    Rows are read from a server-side cursor in ARROW_BATCH_SIZE partitions and
+    each partition is turned into a record batch straight away, so the full
+    result never exists as Python tuples at once.
+    """
+
+    async def _collect():
+        stream = stream_query(sql_query, params, batch_size=ARROW_BATCH_SIZE, engine=engine)
+        columns = await stream.__anext__()
+        batches = []
+        async for partition in stream:
+            batches.append(rows_to_record_batch(columns, partition))
+        return batches_to_table(columns, batches)
+
+    try:
+        return await asyncio.wait_for(_collect(), timeout or None)
+    except asyncio.TimeoutError:
+        raise TimeoutError(
+            f"Query exceeded the {timeout}s execution timeout and was cancelled."
+        )
+
+
+def arrow_to_dataframe(table):
+    """
+    Wraps an Arrow table in an Arrow-backed DataFrame without copying column data.
+    """
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def table_to_ipc(table, metadata=None):
+    """
+    Serializes a table to the Arrow IPC streaming format.
+
+    `metadata` (str -> str) is attached to the schema, which is how the SQL and
+    paging token travel with the data for programmatic clients.
+    """
+    if metadata:
+        existing = table.schema.metadata or {}
+        table = table.replace_schema_metadata(
+            {**existing, **{k: v for k, v in metadata.items() if v is not None}}
+        )
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    buffer = sink.getvalue()
+    logger.debug(f"Serialized {table.num_rows} rows to {buffer.size} bytes of Arrow IPC")
+    return buffer.to_pybytes()
@@ -1,3 +1,10 @@
+import json
+import os
+from dotenv import load_dotenv
+
+# Load environment variables before any setting below is read
+load_dotenv()
+
 db_info = """### Database Structure:
 
 ### Database Structure:
@@ -43,7 +50,7 @@ db_info = """### Database Structure:
     | 10      | 6           | 300        | 2021-01-01 |
 
     ### Key Points:
-    - **Relationships**: One-to-many between `employee` and `product_sales` via `employee_id`.
+    - **Relationships**: One-to-many between `employee` and `sales` via `employee_id`.
     - **Indexes**: Likely primary keys on `employee_id` and `sale_id`.
 
     ### Example Query:
@@ -51,8 +58,216 @@ db_info = """### Database Structure:
     ```sql
     SELECT e.full_name, SUM(p.units_sold) AS total_sales_units
     FROM employee e
-    JOIN product_sales p ON e.employee_id = p.employee_id
+    JOIN sales p ON e.employee_id = p.employee_id
     GROUP BY e.employee_id;
     ```
    
    """
+
+
+def env_flag(name, default=False):
+    """
+    Reads a boolean environment variable ("1", "true", "yes", "on").
+    """
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Semantic question cache
+SEMANTIC_CACHE_ENABLED = env_flag("SEMANTIC_CACHE_ENABLED", False)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_SIZE = int(os.getenv("SEMANTIC_CACHE_MAX_SIZE", "512"))
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "3600"))
+SEMANTIC_CACHE_STORE_RESULTS = env_flag("SEMANTIC_CACHE_STORE_RESULTS", False)
+
+# Application startup
+RAG_ENABLED = env_flag("RAG_ENABLED", False)
+COLD_START_BUDGET_SECONDS = float(os.getenv("COLD_START_BUDGET_SECONDS", "10"))
+
+# Database pool (one async pool per process)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "30"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_QUERY_TIMEOUT_SECONDS = float(os.getenv("DB_QUERY_TIMEOUT_SECONDS", "30"))
+
+# Result paging and streaming
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "1000"))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", "10000"))
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "500"))
+PAGE_TOKEN_SECRET = os.getenv("PAGE_TOKEN_SECRET", "")
+PAGE_TOKEN_TTL_SECONDS = float(os.getenv("PAGE_TOKEN_TTL_SECONDS", "3600"))
+
+# Columnar (Arrow) results
+ARROW_BATCH_SIZE = int(os.getenv("ARROW_BATCH_SIZE", "10000"))
+
+# Live schema introspection (falls back to db_info above when disabled or unreachable)
+SCHEMA_INTROSPECTION_ENABLED = env_flag("SCHEMA_INTROSPECTION_ENABLED", True)
+SCHEMA_REFRESH_SECONDS = float(os.getenv("SCHEMA_REFRESH_SECONDS", "60"))
+# Row estimates and comments of unchanged tables are re-read on this slower timer
+SCHEMA_STATS_REFRESH_SECONDS = float(os.getenv("SCHEMA_STATS_REFRESH_SECONDS", "3600"))
+
+# Per-question schema retrieval (used when RAG_ENABLED)
+RAG_PERSIST_DIR = os.getenv("RAG_PERSIST_DIR", "./chroma")
+RAG_TOP_K = int(os.getenv("RAG_TOP_K", "8"))
+RAG_TOKEN_BUDGET = int(os.getenv("RAG_TOKEN_BUDGET", "1500"))
+RAG_FK_EXPANSION = env_flag("RAG_FK_EXPANSION", True)
+
+# EXPLAIN dry run and cost guard for generated SQL
+GUARD_ENABLED = env_flag("GUARD_ENABLED", True)
+GUARD_MAX_ESTIMATED_ROWS = int(os.getenv("GUARD_MAX_ESTIMATED_ROWS", "1000000"))
+GUARD_MAX_FULL_SCAN_ROWS = int(os.getenv("GUARD_MAX_FULL_SCAN_ROWS", "500000"))
+# "rewrite" adds LIMIT / MAX_EXECUTION_TIME to expensive plans, "reject" refuses them
+GUARD_ACTION = os.getenv("GUARD_ACTION", "reject")
+GUARD_MAX_EXECUTION_MS = int(os.getenv("GUARD_MAX_EXECUTION_MS", "10000"))
+GUARD_DEFAULT_LIMIT = int(os.getenv("GUARD_DEFAULT_LIMIT", "1000"))
+
+# Error handling in the retry loop
+LOCAL_REPAIR_ENABLED = env_flag("LOCAL_REPAIR_ENABLED", True)
+LOCAL_REPAIR_MAX_ATTEMPTS = int(os.getenv("LOCAL_REPAIR_MAX_ATTEMPTS", "3"))
+# Most typing errors (inserted, dropped or changed characters) a local fix accepts
+LOCAL_REPAIR_MAX_EDITS = int(os.getenv("LOCAL_REPAIR_MAX_EDITS", "2"))
+# Diagnose and fix in one LLM call instead of error_reasoning_agent + error_fix_agent
+FUSED_ERROR_FIX = env_flag("FUSED_ERROR_FIX", False)
+
+# Speculative parallel SQL generation (latency-sensitive tenants only)
+SPECULATIVE_ENABLED = env_flag("SPECULATIVE_ENABLED", False)
+SPECULATIVE_CANDIDATES = int(os.getenv("SPECULATIVE_CANDIDATES", "3"))
+SPECULATIVE_TEMPERATURES = [
+    float(t) for t in os.getenv("SPECULATIVE_TEMPERATURES", "0.1,0.5,0.9").split(",") if t.strip()
+]
+# Comma-separated tenant names allowed to speculate; empty means every tenant
+SPECULATIVE_TENANTS = [t.strip() for t in os.getenv("SPECULATIVE_TENANTS", "").split(",") if t.strip()]
+# Maximum speculative requests in flight per worker; extra requests run serially
+SPECULATIVE_MAX_INFLIGHT = int(os.getenv("SPECULATIVE_MAX_INFLIGHT", "8"))
+
+# Model cascade: a small model first, a larger one for hard questions and fixes
+MODEL = os.getenv("MODEL") or "groq/llama3-8b-8192"
+# Empty disables escalation and every agent uses MODEL
+ESCALATION_MODEL = os.getenv("ESCALATION_MODEL", "groq/llama3-70b-8192")
+# Questions scoring at least this go straight to ESCALATION_MODEL
+ROUTING_COMPLEXITY_THRESHOLD = float(os.getenv("ROUTING_COMPLEXITY_THRESHOLD", "3"))
+# Send error reasoning/fix calls to ESCALATION_MODEL
+ROUTING_ESCALATE_FIXES = env_flag("ROUTING_ESCALATE_FIXES", True)
+
+# Rate limiting of LLM calls. The memory backend gives every worker process the
+# full quota; use redis to share one quota between several workers
+RATE_LIMIT_ENABLED = env_flag("RATE_LIMIT_ENABLED", True)
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # "memory" or "redis"
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost:6379/0")
+# Per-model quotas; 0 disables a limit
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "30"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "6000"))
+# Adaptive cap on concurrent LLM calls per worker and model
+RATE_LIMIT_MAX_CONCURRENCY = int(os.getenv("RATE_LIMIT_MAX_CONCURRENCY", "8"))
+RATE_LIMIT_MIN_CONCURRENCY = int(os.getenv("RATE_LIMIT_MIN_CONCURRENCY", "1"))
+RATE_LIMIT_MAX_RETRIES = int(os.getenv("RATE_LIMIT_MAX_RETRIES", "5"))
+RATE_LIMIT_BACKOFF_SECONDS = float(os.getenv("RATE_LIMIT_BACKOFF_SECONDS", "1"))
+RATE_LIMIT_MAX_BACKOFF_SECONDS = float(os.getenv("RATE_LIMIT_MAX_BACKOFF_SECONDS", "60"))
+
+# Result-set cache keyed by normalized SQL
+RESULT_CACHE_ENABLED = env_flag("RESULT_CACHE_ENABLED", True)
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Results larger than this are never cached
+RESULT_CACHE_MAX_ENTRY_BYTES = int(os.getenv("RESULT_CACHE_MAX_ENTRY_BYTES", str(16 * 1024 * 1024)))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "60"))
+# Per-table TTL overrides as JSON, e.g. {"sales": 5}
+RESULT_CACHE_TABLE_TTLS = json.loads(os.getenv("RESULT_CACHE_TABLE_TTLS") or "{}")
+# How often INFORMATION_SCHEMA.TABLES.UPDATE_TIME is polled (MySQL); 0 = TTL only
+RESULT_CACHE_POLL_SECONDS = float(os.getenv("RESULT_CACHE_POLL_SECONDS", "5"))
+
+# Share one pipeline run between concurrent identical questions
+SINGLEFLIGHT_ENABLED = env_flag("SINGLEFLIGHT_ENABLED", True)
+
+# Background jobs for long-running questions
+JOBS_ENABLED = env_flag("JOBS_ENABLED", True)
+JOB_BACKEND = os.getenv("JOB_BACKEND", "memory")  # "memory" or "rq"
+JOB_REDIS_URL = os.getenv("JOB_REDIS_URL", "redis://localhost:6379/0")
+JOB_QUEUE_NAME = os.getenv("JOB_QUEUE_NAME", "query_to_sql")
+# Background tasks per API worker running jobs (memory backend)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Submissions are refused with 503 once this many jobs are waiting
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "100"))
+JOB_TIMEOUT_SECONDS = float(os.getenv("JOB_TIMEOUT_SECONDS", "300"))
+JOB_RESULT_TTL_SECONDS = int(os.getenv("JOB_RESULT_TTL_SECONDS", "3600"))
+# How often /jobs/{id}/events checks for status changes
+JOB_POLL_SECONDS = float(os.getenv("JOB_POLL_SECONDS", "0.5"))
+
+# Text embeddings for the schema index and the semantic cache
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "onnx")  # "onnx" or "sentence-transformers"
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+# model.onnx / tokenizer.json are read from here when present
+EMBEDDING_ONNX_DIR = os.getenv("EMBEDDING_ONNX_DIR", "./models/all-MiniLM-L6-v2")
+EMBEDDING_QUANTIZE = env_flag("EMBEDDING_QUANTIZE", False)
+# onnxruntime intra-op threads; 0 lets onnxruntime decide
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0"))
+EMBEDDING_MAX_LENGTH = int(os.getenv("EMBEDDING_MAX_LENGTH", "256"))
+# Largest forward pass, and how long the first request waits for others to join it
+EMBEDDING_MAX_BATCH_SIZE = int(
+    os.getenv("EMBEDDING_MAX_BATCH_SIZE") or os.getenv("RAG_EMBED_BATCH_SIZE", "64")
+)
+EMBEDDING_MAX_WAIT_MS = float(os.getenv("EMBEDDING_MAX_WAIT_MS", "5"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+
+# Batch answering (POST /batch and `python main.py --batch`)
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "16"))
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", "1000"))
+
+# Database targets and read replicas. DATABASES is JSON mapping a name to a
+# URL or to {"url", "replicas", "pool_size", "max_overflow", "max_lag_seconds"};
+# the DEFAULT_DATABASE target uses DATABASE_URL unless listed there
+DATABASES = json.loads(os.getenv("DATABASES") or "{}")
+DEFAULT_DATABASE = os.getenv("DEFAULT_DATABASE", "default")
+# Comma-separated replica URLs of the default target
+DB_REPLICA_URLS = [url.strip() for url in os.getenv("DB_REPLICA_URLS", "").split(",") if url.strip()]
+# Replicas further behind than this are only used when no other copy can serve reads
+DB_REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "30"))
+DB_HEALTH_CHECK_SECONDS = float(os.getenv("DB_HEALTH_CHECK_SECONDS", "5"))
+DB_HEALTH_CHECK_TIMEOUT = float(os.getenv("DB_HEALTH_CHECK_TIMEOUT", "2"))
+# Query returning the replica lag in seconds (e.g. from a heartbeat table);
+# empty reads SHOW REPLICA STATUS on MySQL
+DB_REPLICA_LAG_SQL = os.getenv("DB_REPLICA_LAG_SQL", "")
+# Send reads to the primary when a target has no usable replica
+DB_PRIMARY_FALLBACK = env_flag("DB_PRIMARY_FALLBACK", False)
+
+# Few-shot examples: verified question/SQL pairs kept under RAG_PERSIST_DIR and
+# the nearest ones added to the SQL agent prompt
+EXAMPLES_ENABLED = env_flag("EXAMPLES_ENABLED", False)
+EXAMPLES_TOP_K = int(os.getenv("EXAMPLES_TOP_K", "3"))
+# Cosine similarity a stored question needs to be used as an example
+EXAMPLES_MIN_SIMILARITY = float(os.getenv("EXAMPLES_MIN_SIMILARITY", "0.6"))
+# A new pair this close to a stored question is not stored
+EXAMPLES_DEDUPE_SIMILARITY = float(os.getenv("EXAMPLES_DEDUPE_SIMILARITY", "0.97"))
+EXAMPLES_MAX_SIZE = int(os.getenv("EXAMPLES_MAX_SIZE", "5000"))
+
+# Summary tables for repeated aggregate queries (needs schema introspection and
+# CREATE/DROP rights on the primary); matching SQL is rewritten to read them
+SUMMARIES_ENABLED = env_flag("SUMMARIES_ENABLED", False)
+# Summary tables are named <prefix><fact table>_<hash> and hidden from the prompt schema
+SUMMARY_TABLE_PREFIX = os.getenv("SUMMARY_TABLE_PREFIX", "_summary_")
+# A shape is materialized once it is seen this often in the last SUMMARY_HISTORY_SIZE queries
+SUMMARY_MIN_QUERIES = int(os.getenv("SUMMARY_MIN_QUERIES", "5"))
+SUMMARY_HISTORY_SIZE = int(os.getenv("SUMMARY_HISTORY_SIZE", "1000"))
+SUMMARY_MAX_TABLES = int(os.getenv("SUMMARY_MAX_TABLES", "10"))
+# Summaries over fewer base rows, or not this many times smaller, are dropped again
+SUMMARY_MIN_ROWS = int(os.getenv("SUMMARY_MIN_ROWS", "100000"))
+SUMMARY_MIN_REDUCTION = float(os.getenv("SUMMARY_MIN_REDUCTION", "10"))
+SUMMARY_REFRESH_SECONDS = float(os.getenv("SUMMARY_REFRESH_SECONDS", "60"))
+# Whether this process builds and refreshes summaries. On MySQL a server lock
+# lets one worker at a time do it; on other databases turn it off on all
+# workers but one. Every worker reads the summaries' state from the database
+SUMMARY_MAINTAINER = env_flag("SUMMARY_MAINTAINER", True)
+# Full rebuild interval, which also picks up updated and deleted rows
+SUMMARY_REBUILD_SECONDS = float(os.getenv("SUMMARY_REBUILD_SECONDS", "3600"))
+# Older summaries are only used on MySQL, while their fact table's UPDATE_TIME is unchanged
+SUMMARY_MAX_STALENESS_SECONDS = float(os.getenv("SUMMARY_MAX_STALENESS_SECONDS", "300"))
+# Ever-increasing column per fact table as JSON, e.g. {"sales": "sale_id"}; by
+# default the integer primary key. Tables without one are only rebuilt in full
+SUMMARY_WATERMARK_COLUMNS = json.loads(os.getenv("SUMMARY_WATERMARK_COLUMNS") or "{}")
+
+# OpenTelemetry tracing (OTLP exporter configured by the OTEL_EXPORTER_OTLP_* variables)
+OTEL_ENABLED = env_flag("OTEL_ENABLED", False)
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "query_to_sql")
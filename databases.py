@@ -0,0 +1,316 @@
+import asyncio
+import time
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from log import logger
+from config import (
+    DATABASES,
+    DEFAULT_DATABASE,
+    DB_REPLICA_URLS,
+    DB_REPLICA_MAX_LAG_SECONDS,
+    DB_HEALTH_CHECK_SECONDS,
+    DB_HEALTH_CHECK_TIMEOUT,
+    DB_REPLICA_LAG_SQL,
+    DB_PRIMARY_FALLBACK,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+)
+from db import create_engine_for, get_engine
+
+
+class UnknownDatabase(LookupError):
+    pass
+
+
+class NoReplicaAvailable(ConnectionError):
+    pass
+
+
+class Replica:
+    """
+    A read replica with its own pool and the outcome of its last health check.
+    """
+
+    def __init__(self, url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+        self.engine = create_engine_for(url, pool_size, max_overflow)
+        self.label = self.engine.url.render_as_string(hide_password=True)
+        self.healthy = True
+        self.lag = 0.0
+        self.inflight = 0
+        self.failures = 0
+        self.error = None
+        self.checked_at = None
+
+    async def _read_lag(self, lag_sql=DB_REPLICA_LAG_SQL):
+        async with self.engine.connect() as conn:
+            if lag_sql:
+                return (await conn.execute(text(lag_sql))).scalar()
+            if self.engine.dialect.name != "mysql":
+                await conn.execute(text("SELECT 1"))
+                return 0.0
+            try:
+                row = (await conn.execute(text("SHOW REPLICA STATUS"))).mappings().first()
+            except DBAPIError:
+                # MySQL before 8.0.22 and MariaDB
+                row = (await conn.execute(text("SHOW SLAVE STATUS"))).mappings().first()
+            if row is None:
+                # Not a replication channel, e.g. a managed read-only endpoint
+                return 0.0
+            return row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+
+    async def check(self, timeout=DB_HEALTH_CHECK_TIMEOUT):
+        """
+        Connects and reads the replication lag; a replica that cannot be
+        reached, or whose replication is stopped, is marked down.
+        """
+        self.checked_at = time.time()
+        try:
+            lag = await asyncio.wait_for(self._read_lag(), timeout)
+        except Exception as e:
+            self.mark_down(e)
+            return
+        if lag is None:
+            self.mark_down("replication is not running")
+            return
+        if not self.healthy:
+            logger.info(f"Replica {self.label} is back ({float(lag):.0f}s behind).")
+        self.healthy, self.lag, self.error = True, float(lag), None
+
+    async def _select_one(self):
+        async with self.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+
+    async def ping(self, timeout=DB_HEALTH_CHECK_TIMEOUT):
+        try:
+            await asyncio.wait_for(self._select_one(), timeout)
+            return True
+        except Exception:
+            return False
+
+    def mark_down(self, error):
+        if self.healthy:
+            logger.warning(f"Replica {self.label} is down: {error}")
+        self.healthy = False
+        self.failures += 1
+        self.error = str(error)
+
+    def stats(self):
+        return {
+            "replica": self.label,
+            "healthy": self.healthy,
+            "lag_seconds": self.lag,
+            "inflight": self.inflight,
+            "failures": self.failures,
+            "error": self.error,
+            "checked_at": self.checked_at,
+        }
+
+
+class Database:
+    """
+    One target database: the primary, its replicas, and the schema provider,
+    schema index, result cache, example store and summary tables built for it.
+
+    Generated SQL is read-only and runs on the least busy replica within
+    `max_lag_seconds`, failing over to the next one when a replica stops
+    answering. Without replicas, reads go to the primary.
+    """
+
+    def __init__(
+        self,
+        name,
+        url=None,
+        replicas=(),
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        max_lag_seconds=DB_REPLICA_MAX_LAG_SECONDS,
+        primary_fallback=DB_PRIMARY_FALLBACK,
+    ):
+        self.name = name
+        # None means the process-wide engine of DATABASE_URL
+        self.url = url
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.max_lag_seconds = max_lag_seconds
+        self.primary_fallback = primary_fallback
+        self.replicas = [Replica(replica, pool_size, max_overflow) for replica in replicas]
+        self.schema_provider = None
+        self.schema_index = None
+        self.result_cache = None
+        self.example_store = None
+        self.summaries = None
+        self._engine = None
+
+    @property
+    def engine(self):
+        """
+        The primary's engine, created on first use.
+        """
+        if self.url is None:
+            return get_engine()
+        if self._engine is None:
+            self._engine = create_engine_for(self.url, self.pool_size, self.max_overflow)
+        return self._engine
+
+    def read_order(self):
+        """
+        Returns the copies to try for a read, best first: healthy replicas
+        within the lag limit by fewest queries in flight, then the primary
+        when `primary_fallback` is on, else lagging replicas. `None` stands
+        for the primary.
+        """
+        if not self.replicas:
+            return [None]
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        fresh = sorted(
+            (r for r in healthy if r.lag <= self.max_lag_seconds), key=lambda r: (r.inflight, r.lag)
+        )
+        if self.primary_fallback:
+            return fresh + [None]
+        return fresh + sorted((r for r in healthy if r.lag > self.max_lag_seconds), key=lambda r: r.lag)
+
+    def read_engine(self):
+        """
+        Returns the engine the next read should use.
+        """
+        order = self.read_order()
+        if not order:
+            raise NoReplicaAvailable(f"No replica of database '{self.name}' is available.")
+        return self.engine if order[0] is None else order[0].engine
+
+    async def read(self, func):
+        """
+        Awaits `func(engine)` on the best copy for reads. When it fails on a
+        replica that then does not answer a ping, the replica is marked down
+        and the next copy is tried; errors of the query itself are raised.
+        """
+        error = None
+        for replica in self.read_order():
+            if replica is None:
+                return await func(self.engine)
+            replica.inflight += 1
+            try:
+                return await func(replica.engine)
+            except Exception as e:
+                if await replica.ping():
+                    raise
+                replica.mark_down(e)
+                error = e
+                logger.warning(f"Failing over reads of database '{self.name}' from {replica.label}.")
+            finally:
+                replica.inflight -= 1
+        raise NoReplicaAvailable(
+            f"No replica of database '{self.name}' is available"
+            + (f": {error}" if error is not None else ".")
+        )
+
+    def replica_lag(self, engine):
+        """
+        Seconds the copy behind `engine` was last seen behind the primary; 0
+        for the primary itself.
+        """
+        for replica in self.replicas:
+            if replica.engine is engine:
+                return replica.lag
+        return 0.0
+
+    async def dispose(self):
+        if self.summaries is not None:
+            await self.summaries.stop()
+        for replica in self.replicas:
+            await replica.engine.dispose()
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+
+    def stats(self):
+        return {
+            "primary": self.engine.url.render_as_string(hide_password=True),
+            "replicas": [replica.stats() for replica in self.replicas],
+            "schema_version": (
+                self.schema_provider.snapshot.version
+                if self.schema_provider is not None and self.schema_provider.snapshot is not None
+                else None
+            ),
+        }
+
+
+class DatabaseRouter:
+    """
+    Resolves the target database of a request and keeps the health of every
+    replica current with a background check every `health_check_seconds`.
+    """
+
+    def __init__(self, databases, default=DEFAULT_DATABASE, health_check_seconds=DB_HEALTH_CHECK_SECONDS):
+        self.databases = databases
+        self.default = default
+        self.health_check_seconds = health_check_seconds
+        self._task = None
+
+    @classmethod
+    def from_config(cls, config=DATABASES, default=DEFAULT_DATABASE, default_replicas=DB_REPLICA_URLS):
+        """
+        Builds the targets listed in DATABASES, plus the default target on
+        DATABASE_URL with DB_REPLICA_URLS unless DATABASES defines it.
+        """
+        databases = {}
+        for name, spec in config.items():
+            if isinstance(spec, str):
+                spec = {"url": spec}
+            databases[name] = Database(
+                name,
+                spec["url"],
+                spec.get("replicas", ()),
+                pool_size=int(spec.get("pool_size", DB_POOL_SIZE)),
+                max_overflow=int(spec.get("max_overflow", DB_MAX_OVERFLOW)),
+                max_lag_seconds=float(spec.get("max_lag_seconds", DB_REPLICA_MAX_LAG_SECONDS)),
+            )
+        if default not in databases:
+            databases[default] = Database(default, None, default_replicas)
+        return cls(databases, default)
+
+    def resolve(self, name=None, tenant=None):
+        """
+        Returns the database named by the request; without a name, the one
+        named like the tenant if there is one, else the default.
+        """
+        if name:
+            try:
+                return self.databases[name]
+            except KeyError:
+                raise UnknownDatabase(f"Unknown database '{name}'.")
+        return self.databases.get(tenant) or self.databases[self.default]
+
+    async def check_health(self):
+        replicas = [replica for db in self.databases.values() for replica in db.replicas]
+        await asyncio.gather(*(replica.check() for replica in replicas))
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.health_check_seconds)
+            try:
+                await self.check_health()
+            except Exception as e:
+                logger.error(f"Replica health check failed: {e}")
+
+    async def start(self):
+        """
+        Checks every replica once, then keeps checking in the background.
+        """
+        if any(db.replicas for db in self.databases.values()):
+            await self.check_health()
+            self._task = asyncio.create_task(self._monitor())
+        logger.info(
+            "Databases: "
+            + ", ".join(f"{name} ({len(db.replicas)} replicas)" for name, db in self.databases.items())
+        )
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for db in self.databases.values():
+            await db.dispose()
+
+    def stats(self):
+        return {name: db.stats() for name, db in self.databases.items()}
@@ -0,0 +1,175 @@
+import asyncio
+import os
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from log import logger
+from config import (
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_QUERY_TIMEOUT_SECONDS,
+    STREAM_BATCH_SIZE,
+)
+
+
+# Database Configuration
+mysql_host = os.getenv("mysql_host", "localhost")
+mysql_port = int(os.getenv("mysql_port", "3306"))
+mysql_user = os.getenv("mysql_user", "root")
+mysql_password = os.getenv("mysql_password", "")
+mysql_database = os.getenv("mysql_database", "chatbot")
+
+# Database URL (aiomysql gives a native asyncio driver, no thread pool involved)
+DATABASE_URL = os.getenv(
+    "DATABASE_URL",
+    f"mysql+aiomysql://{mysql_user}:{mysql_password}@{mysql_host}:{mysql_port}/{mysql_database}",
+)
+
+_engine = None
+# Unpooled engines for KILL QUERY, one per database URL
+_kill_engines = {}
+
+
+def create_engine_for(url, pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW):
+    """
+    Creates an async engine with its own bounded pool.
+    """
+    options = {"pool_pre_ping": True}
+    if not url.startswith("sqlite"):
+        options.update(
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+        )
+    return create_async_engine(url, **options)
+
+
+def get_engine():
+    """
+    Returns the process-wide async engine, creating it on first use.
+
+    Engine creation does not open a connection, so no lock is needed: the event
+    loop is single threaded and this function never awaits.
+    """
+    global _engine
+    if _engine is None:
+        _engine = create_engine_for(DATABASE_URL)
+        logger.info(
+            f"Async database engine created for {mysql_host}:{mysql_port} "
+            f"(pool_size={DB_POOL_SIZE}, max_overflow={DB_MAX_OVERFLOW})"
+        )
+    return _engine
+
+
+def use_engine(url):
+    """
+    Replaces the process-wide engine, e.g. with a local SQLite database for the
+    benchmark. Must be called before the engine is first used.
+    """
+    global _engine
+    _engine = create_engine_for(url)
+    logger.info(f"Using database {_engine.url.render_as_string(hide_password=True)}")
+    return _engine
+
+
+async def dispose_engine():
+    """
+    Closes every pooled connection; called on application shutdown.
+    """
+    global _engine
+    if _engine is not None:
+        await _engine.dispose()
+    _engine = None
+    for engine in _kill_engines.values():
+        await engine.dispose()
+    _kill_engines.clear()
+
+
+def kill_engine(engine):
+    """
+    Returns an engine without a pool for the database of `engine`. A kill is
+    most needed when runaway queries hold every pooled connection, so it must
+    never wait for a slot of that pool.
+    """
+    key = engine.url.render_as_string(hide_password=False)
+    if key not in _kill_engines:
+        _kill_engines[key] = create_async_engine(engine.url, poolclass=NullPool)
+    return _kill_engines[key]
+
+
+async def kill_query(engine, connection_id):
+    """
+    Aborts the statement running on a MySQL connection from a second,
+    unpooled connection.
+    """
+    try:
+        async with kill_engine(engine).connect() as conn:
+            await conn.execute(text(f"KILL QUERY {int(connection_id)}"))
+        logger.warning(f"Killed server-side query on connection {connection_id}")
+    except Exception as e:
+        logger.error(f"Failed to kill query on connection {connection_id}: {e}")
+
+
+async def run_query(sql_query, params=None, timeout=DB_QUERY_TIMEOUT_SECONDS, engine=None):
+    """
+    Executes a statement on the shared pool and returns `(columns, rows)`.
+
+    When the timeout expires or the calling task is cancelled (for example
+    because the HTTP client disconnected), the query is killed on the server
+    and the connection is discarded instead of being returned to the pool.
+    """
+    engine = engine or get_engine()
+    async with engine.connect() as conn:
+        connection_id = None
+        if engine.dialect.name == "mysql":
+            raw = await conn.get_raw_connection()
+            connection_id = raw.driver_connection.thread_id()
+
+        async def _execute():
+            result = await conn.execute(text(sql_query), params or {})
+            return list(result.keys()), result.fetchall()
+
+        async def _abort():
+            if connection_id is not None:
+                await asyncio.shield(kill_query(engine, connection_id))
+            await conn.invalidate()
+
+        try:
+            return await asyncio.wait_for(_execute(), timeout or None)
+        except asyncio.TimeoutError:
+            await _abort()
+            raise TimeoutError(
+                f"Query exceeded the {timeout}s execution timeout and was cancelled."
+            )
+        except asyncio.CancelledError:
+            await _abort()
+            raise
+
+
+async def stream_query(sql_query, params=None, batch_size=STREAM_BATCH_SIZE, engine=None):
+    """
+    Streams a statement through an unbuffered server-side cursor.
+
+    Yields the column names first and then lists of at most `batch_size` rows,
+    so memory stays bounded regardless of the result size. Cancelling the
+    consumer kills the query on the server like `run_query` does.
+    """
+    engine = engine or get_engine()
+    async with engine.connect() as conn:
+        connection_id = None
+        if engine.dialect.name == "mysql":
+            raw = await conn.get_raw_connection()
+            connection_id = raw.driver_connection.thread_id()
+        try:
+            result = await conn.stream(text(sql_query), params or {})
+            yield list(result.keys())
+            async for partition in result.partitions(batch_size):
+                yield partition
+        except (asyncio.CancelledError, GeneratorExit):
+            if connection_id is not None:
+                await asyncio.shield(kill_query(engine, connection_id))
+            await conn.invalidate()
+            raise
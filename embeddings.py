@@ -0,0 +1,283 @@
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import numpy as np
+
+from log import logger
+from config import (
+    EMBEDDING_BACKEND,
+    EMBEDDING_MODEL,
+    EMBEDDING_ONNX_DIR,
+    EMBEDDING_QUANTIZE,
+    EMBEDDING_THREADS,
+    EMBEDDING_MAX_LENGTH,
+    EMBEDDING_MAX_BATCH_SIZE,
+    EMBEDDING_MAX_WAIT_MS,
+    EMBEDDING_CACHE_SIZE,
+)
+
+
+_service = None
+_lock = threading.Lock()
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class SentenceTransformerBackend:
+    """
+    Encodes with sentence-transformers on torch.
+    """
+
+    name = "sentence-transformers"
+
+    def __init__(self, model_name=EMBEDDING_MODEL):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name)
+
+    def encode(self, texts):
+        vectors = self.model.encode(texts, batch_size=len(texts), normalize_embeddings=True)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class OnnxBackend:
+    """
+    Encodes with onnxruntime and a Rust `tokenizers` tokenizer, without torch:
+    mean pooling over the token embeddings, then L2 normalization, as the
+    sentence-transformers pipeline of MiniLM-style models does.
+
+    `model.onnx` and `tokenizer.json` are read from `model_dir` when present,
+    otherwise downloaded from the Hugging Face repository of `model_name`.
+    With `quantize`, the weights are quantized to int8 once (dynamic
+    quantization) and the result is kept in `model_dir`.
+    """
+
+    name = "onnx"
+
+    def __init__(
+        self,
+        model_name=EMBEDDING_MODEL,
+        model_dir=EMBEDDING_ONNX_DIR,
+        quantize=EMBEDDING_QUANTIZE,
+        threads=EMBEDDING_THREADS,
+        max_length=EMBEDDING_MAX_LENGTH,
+    ):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = self._file(model_name, model_dir, "model.onnx", "onnx/model.onnx")
+        if quantize:
+            model_path = self._quantized(model_path, model_dir)
+        self.tokenizer = Tokenizer.from_file(
+            self._file(model_name, model_dir, "tokenizer.json", "tokenizer.json")
+        )
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.tokenizer.enable_padding()
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(
+            model_path, sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        logger.info(f"ONNX embedding model loaded from {model_path}.")
+
+    @staticmethod
+    def _file(model_name, model_dir, local_name, hub_name):
+        path = os.path.join(model_dir, local_name)
+        if os.path.exists(path):
+            return path
+        from huggingface_hub import hf_hub_download
+
+        return hf_hub_download(model_name, hub_name)
+
+    @staticmethod
+    def _quantized(model_path, model_dir):
+        path = os.path.join(model_dir, "model_int8.onnx")
+        if not os.path.exists(path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            os.makedirs(model_dir, exist_ok=True)
+            quantize_dynamic(model_path, path, weight_type=QuantType.QInt8)
+            logger.info(f"Quantized {model_path} to int8 at {path}.")
+        return path
+
+    def encode(self, texts):
+        encodings = self.tokenizer.encode_batch(list(texts))
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        inputs = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            inputs["token_type_ids"] = np.array([e.type_ids for e in encodings], dtype=np.int64)
+        token_embeddings = self.session.run(None, inputs)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return _normalize(pooled.astype(np.float32))
+
+
+def create_backend(kind=EMBEDDING_BACKEND):
+    if kind == "onnx":
+        try:
+            return OnnxBackend()
+        except Exception as e:
+            logger.warning(f"ONNX embedding backend unavailable, using sentence-transformers: {e}")
+    return SentenceTransformerBackend()
+
+
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+
+
+class EmbeddingService:
+    """
+    Unit-normalized text embeddings shared by the schema index and the
+    semantic cache.
+
+    Repeated strings are served from an LRU cache. Misses from concurrent
+    callers are coalesced by one worker thread: it waits up to `max_wait_ms`
+    for more requests after the first one and encodes everything it collected
+    (at most `max_batch_size` texts per forward pass) together.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        max_batch_size=EMBEDDING_MAX_BATCH_SIZE,
+        max_wait_ms=EMBEDDING_MAX_WAIT_MS,
+        cache_size=EMBEDDING_CACHE_SIZE,
+    ):
+        self.backend = backend or create_backend()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.requests = queue.Queue()
+        self.counters = {"texts": 0, "cache_hits": 0, "batches": 0, "encoded": 0, "encode_seconds": 0.0}
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self._work, name="embeddings", daemon=True)
+        self.worker.start()
+
+    def _cached(self, texts):
+        vectors = {}
+        with self.lock:
+            self.counters["texts"] += len(texts)
+            for text in texts:
+                vector = self.cache.get(text)
+                if vector is not None:
+                    self.cache.move_to_end(text)
+                    vectors[text] = vector
+            self.counters["cache_hits"] += len(vectors)
+        return vectors
+
+    def _remember(self, texts, vectors):
+        with self.lock:
+            for text, vector in zip(texts, vectors):
+                self.cache[text] = vector
+                self.cache.move_to_end(text)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def _work(self):
+        while True:
+            batch = [self.requests.get()]
+            size = len(batch[0].texts)
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch_size:
+                try:
+                    request = self.requests.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                batch.append(request)
+                size += len(request.texts)
+            try:
+                self._run(batch)
+            except Exception as e:
+                # The thread serves every later request; it must outlive any batch
+                logger.error(f"Embedding worker error: {e}")
+
+    def _run(self, batch):
+        # Requests whose caller gave up are dropped; the others can no longer be cancelled
+        batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        texts = list(dict.fromkeys(text for request in batch for text in request.texts))
+        try:
+            started = time.perf_counter()
+            vectors = []
+            for start in range(0, len(texts), self.max_batch_size):
+                vectors.extend(self.backend.encode(texts[start:start + self.max_batch_size]))
+            with self.lock:
+                self.counters["batches"] += 1
+                self.counters["encoded"] += len(texts)
+                self.counters["encode_seconds"] += time.perf_counter() - started
+            self._remember(texts, vectors)
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(texts)} texts failed: {e}")
+            for request in batch:
+                request.future.set_exception(e)
+            return
+        by_text = dict(zip(texts, vectors))
+        for request in batch:
+            request.future.set_result(by_text)
+
+    def _submit(self, texts):
+        """
+        Returns `(cached, future)`; the future is None when every text was cached.
+        """
+        cached = self._cached(texts)
+        missing = list(dict.fromkeys(text for text in texts if text not in cached))
+        if not missing:
+            return cached, None
+        request = _Request(missing)
+        self.requests.put(request)
+        return cached, request.future
+
+    @staticmethod
+    def _stack(texts, cached, computed):
+        return np.stack([cached[text] if text in cached else computed[text] for text in texts])
+
+    def encode(self, texts):
+        """
+        Returns a float32 array with one unit-length embedding per text; blocks
+        the calling thread until its batch has run.
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        cached, future = self._submit(texts)
+        return self._stack(texts, cached, future.result() if future is not None else {})
+
+    def stats(self):
+        with self.lock:
+            batches = self.counters["batches"]
+            return {
+                **self.counters,
+                "backend": self.backend.name,
+                "cache_size": len(self.cache),
+                "mean_batch_size": self.counters["encoded"] / batches if batches else 0.0,
+                "pending": self.requests.qsize(),
+            }
+
+
+def get_embedding_service():
+    """
+    Returns the process-wide embedding service, loading the model on first use.
+    """
+    global _service
+    if _service is None:
+        with _lock:
+            if _service is None:
+                _service = EmbeddingService()
+                logger.info(f"Embedding service using the {_service.backend.name} backend.")
+    return _service
@@ -0,0 +1,249 @@
+import hashlib
+import re
+import threading
+import time
+from log import logger
+from config import (
+    EXAMPLES_TOP_K,
+    EXAMPLES_MIN_SIMILARITY,
+    EXAMPLES_DEDUPE_SIMILARITY,
+    EXAMPLES_MAX_SIZE,
+)
+from cache import normalize_question
+from rag import ChromaEmbeddingFunction, encode, get_client
+from result_cache import normalize_sql
+
+
+EXAMPLES_COLLECTION_NAME = "query_examples"
+# Prompt value when no stored question is close enough
+NO_EXAMPLES = "None"
+# Answer of the agents to questions that are not about the data; it executes
+# but is no example of anything
+NOT_SQL_MARKER = "NOT ASKING FOR SQL"
+
+_stores = {}
+_lock = threading.Lock()
+
+
+def tables_fingerprint(tables, snapshot):
+    """
+    Fingerprint of the definitions of `tables` in a schema snapshot, or None
+    when one of them is not in it. Over a static schema description it is the
+    snapshot version.
+    """
+    if not snapshot.tables:
+        return snapshot.version
+    by_name = {name.lower(): table for name, table in snapshot.tables.items()}
+    parts = []
+    for name in tables:
+        table = by_name.get(name)
+        if table is None:
+            return None
+        parts.append(f"{name}:{table.fingerprint}")
+    return hashlib.md5(";".join(parts).encode("utf-8")).hexdigest()
+
+
+class Example:
+    def __init__(self, question, sql, similarity):
+        self.question = question
+        self.sql = sql
+        self.similarity = similarity
+
+    def render(self):
+        return f"Question: {self.question}\nSQL: {self.sql}"
+
+
+def render_examples(examples):
+    """
+    Formats examples for the `examples` input of the SQL agent.
+    """
+    if not examples:
+        return NO_EXAMPLES
+    return "\n\n".join(example.render() for example in examples)
+
+
+class ExampleStore:
+    """
+    Verified question/SQL pairs of one database, in a Chroma collection, used
+    as few-shot examples for the SQL agent.
+
+    Each pair keeps a fingerprint of the tables its SQL reads. A pair is
+    deleted once any of them changes or disappears: when retrieval meets it,
+    and in a sweep of the whole collection after each schema change. A
+    question is stored once per normalized spelling and not at all when a
+    stored question is nearly identical; beyond `max_size` pairs the oldest
+    are evicted.
+    """
+
+    def __init__(
+        self,
+        collection_name=EXAMPLES_COLLECTION_NAME,
+        top_k=EXAMPLES_TOP_K,
+        min_similarity=EXAMPLES_MIN_SIMILARITY,
+        dedupe_similarity=EXAMPLES_DEDUPE_SIMILARITY,
+        max_size=EXAMPLES_MAX_SIZE,
+    ):
+        self.collection_name = collection_name
+        self.top_k = top_k
+        self.min_similarity = min_similarity
+        self.dedupe_similarity = dedupe_similarity
+        self.max_size = max_size
+        self.collection = None
+        self.swept_version = None
+        self.counters = {"added": 0, "deduplicated": 0, "evicted": 0, "invalidated": 0, "retrieved": 0}
+        self.lock = threading.Lock()
+
+    def _get_collection(self):
+        if self.collection is None:
+            self.collection = get_client().get_or_create_collection(
+                name=self.collection_name,
+                embedding_function=ChromaEmbeddingFunction(),
+                metadata={"hnsw:space": "cosine"},
+            )
+        return self.collection
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def _delete(self, ids, counter):
+        if ids:
+            self._get_collection().delete(ids=ids)
+            self._count(counter, len(ids))
+
+    def sweep(self, snapshot):
+        """
+        Deletes every pair whose tables changed; runs once per schema version.
+        """
+        if self.swept_version == snapshot.version:
+            return
+        collection = self._get_collection()
+        stored = collection.get(include=["metadatas"])
+        stale = [
+            id_
+            for id_, metadata in zip(stored["ids"], stored["metadatas"])
+            if self._stale(metadata, snapshot)
+        ]
+        self._delete(stale, "invalidated")
+        if stale:
+            logger.info(f"Example store: {len(stale)} pairs invalidated by schema {snapshot.version}.")
+        self.swept_version = snapshot.version
+
+    @staticmethod
+    def _stale(metadata, snapshot):
+        tables = [name for name in (metadata.get("tables") or "").split(",") if name]
+        return tables_fingerprint(tables, snapshot) != metadata.get("fingerprint")
+
+    def retrieve(self, question, snapshot, embedding=None):
+        """
+        Returns `(examples, embedding)`: the `top_k` stored pairs closest to
+        the question, most similar first, and the question's embedding.
+        """
+        self.sweep(snapshot)
+        collection = self._get_collection()
+        size = collection.count()
+        if not size:
+            return [], embedding
+        if embedding is None:
+            embedding = encode([question])[0]
+        results = collection.query(
+            query_embeddings=[list(map(float, embedding))],
+            n_results=min(self.top_k * 2, size),
+            include=["metadatas", "distances"],
+        )
+        examples, stale = [], []
+        for id_, metadata, distance in zip(
+            results["ids"][0], results["metadatas"][0], results["distances"][0]
+        ):
+            similarity = 1.0 - distance
+            if similarity < self.min_similarity:
+                break
+            if self._stale(metadata, snapshot):
+                stale.append(id_)
+            elif len(examples) < self.top_k:
+                examples.append(Example(metadata["question"], metadata["sql"], similarity))
+        self._delete(stale, "invalidated")
+        self._count("retrieved", len(examples))
+        return examples, embedding
+
+    def add(self, question, sql, snapshot, embedding=None):
+        """
+        Stores a question with the SQL that answered it; returns False when
+        the pair was skipped.
+        """
+        if NOT_SQL_MARKER in sql:
+            return False
+        _, tables = normalize_sql(sql)
+        if tables is None:
+            return False
+        fingerprint = tables_fingerprint(tables, snapshot)
+        if fingerprint is None:
+            return False
+        if embedding is None:
+            embedding = encode([question])[0]
+        embedding = list(map(float, embedding))
+        id_ = hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()
+
+        collection = self._get_collection()
+        if collection.count():
+            nearest = collection.query(query_embeddings=[embedding], n_results=1, include=["distances"])
+            if nearest["ids"][0] and nearest["ids"][0][0] != id_:
+                if 1.0 - nearest["distances"][0][0] >= self.dedupe_similarity:
+                    self._count("deduplicated")
+                    return False
+
+        collection.upsert(
+            ids=[id_],
+            documents=[question],
+            embeddings=[embedding],
+            metadatas=[
+                {
+                    "question": question,
+                    "sql": sql,
+                    "tables": ",".join(tables),
+                    "fingerprint": fingerprint,
+                    "schema_version": snapshot.version,
+                    "created_at": time.time(),
+                }
+            ],
+        )
+        self._count("added")
+        self._evict(collection)
+        return True
+
+    def _evict(self, collection):
+        """
+        Deletes the oldest pairs once the store is over `max_size`, down to 90%
+        of it so the scan does not repeat on every insert.
+        """
+        size = collection.count()
+        if size <= self.max_size:
+            return
+        stored = collection.get(include=["metadatas"])
+        by_age = sorted(
+            zip(stored["ids"], stored["metadatas"]), key=lambda item: item[1].get("created_at", 0)
+        )
+        excess = size - int(self.max_size * 0.9)
+        self._delete([id_ for id_, _ in by_age[:excess]], "evicted")
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+        return {**counters, "size": self.collection.count() if self.collection is not None else 0}
+
+
+def get_example_store(database=None):
+    """
+    Returns the process-wide example store of a database; each database other
+    than the default one has its own collection.
+    """
+    store = _stores.get(database)
+    if store is None:
+        with _lock:
+            store = _stores.get(database)
+            if store is None:
+                name = EXAMPLES_COLLECTION_NAME
+                if database:
+                    name = f"{name}_{re.sub(r'[^A-Za-z0-9_-]', '_', database)}"[:63]
+                store = _stores[database] = ExampleStore(name)
+    return store
@@ -0,0 +1,218 @@
+import re
+import orjson
+from log import logger
+from config import (
+    GUARD_ACTION,
+    GUARD_DEFAULT_LIMIT,
+    GUARD_MAX_ESTIMATED_ROWS,
+    GUARD_MAX_EXECUTION_MS,
+    GUARD_MAX_FULL_SCAN_ROWS,
+)
+from db import get_engine, run_query
+from pagination import HINT_PATTERN, outer_clauses, strip_comments
+
+
+class QueryRejected(Exception):
+    """
+    Raised when a query plan is too expensive to run; the message is written
+    for the error reasoning agent so it can produce a cheaper query.
+    """
+
+
+# Statements generated SQL may start with: only queries can be explained,
+# paginated and run on a read replica
+READ_ONLY_STATEMENTS = {"select", "with"}
+# Writes that can hide inside a query (a data-modifying CTE); INSERT() and
+# REPLACE() are also string functions, so a following parenthesis is allowed
+WRITE_KEYWORDS = re.compile(
+    r"\b(?:(?:insert|update|delete|replace|drop|alter|create|truncate|grant|revoke)\b(?!\s*\()"
+    r"|into\s+(?:out|dump)file\b)",
+    re.IGNORECASE,
+)
+STRING_LITERALS = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\"|`[^`]*`")
+
+
+def ensure_read_only(sql_query):
+    """
+    Raises QueryRejected unless the SQL is a single SELECT (or WITH) query.
+    """
+    body = STRING_LITERALS.sub("''", strip_comments(sql_query)).strip().rstrip(";")
+    words = body.split(None, 1)
+    if ";" in body or not words or words[0].lower() not in READ_ONLY_STATEMENTS:
+        raise QueryRejected(
+            "Only a single read-only statement (SELECT) can be run. Rewrite the query as one SELECT."
+        )
+    write = WRITE_KEYWORDS.search(body)
+    if write:
+        raise QueryRejected(
+            f"The query must only read data, but it contains `{write.group(0)}`. Rewrite it as a plain SELECT."
+        )
+
+
+class PlanSummary:
+    def __init__(self):
+        self.tables = []
+        self.estimated_rows = 0
+        self.full_scans = []
+        self.cartesian = []
+
+    def __repr__(self):
+        return (
+            f"PlanSummary(estimated_rows={self.estimated_rows}, "
+            f"full_scans={self.full_scans}, cartesian={self.cartesian})"
+        )
+
+
+def _walk_tables(node):
+    """
+    Yields every `table` object of an EXPLAIN FORMAT=JSON plan, in join order.
+    """
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == "table" and isinstance(value, dict):
+                yield value
+            yield from _walk_tables(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _walk_tables(item)
+
+
+def summarize_plan(plan, max_full_scan_rows=GUARD_MAX_FULL_SCAN_ROWS):
+    """
+    Extracts row estimates, full scans and cartesian joins from a MySQL JSON plan.
+    """
+    summary = PlanSummary()
+    joined_rows = 1
+    for index, table in enumerate(_walk_tables(plan)):
+        name = table.get("table_name", "?")
+        examined = int(table.get("rows_examined_per_scan", 0) or 0)
+        produced = int(table.get("rows_produced_per_join", examined) or 0)
+        summary.tables.append(name)
+        joined_rows = max(joined_rows, produced)
+        if table.get("access_type") in ("ALL", "index") and examined > max_full_scan_rows:
+            summary.full_scans.append((name, examined))
+        # A joined table read with a join buffer and no condition at all is a cross join
+        if (
+            index > 0
+            and table.get("access_type") == "ALL"
+            and "using_join_buffer" in table
+            and "attached_condition" not in table
+        ):
+            summary.cartesian.append(name)
+    summary.estimated_rows = joined_rows
+    return summary
+
+
+def add_execution_time_hint(sql_query, max_execution_ms=GUARD_MAX_EXECUTION_MS):
+    """
+    Adds a MySQL `MAX_EXECUTION_TIME` optimizer hint to a top-level SELECT.
+    """
+    if not max_execution_ms or HINT_PATTERN.match(sql_query):
+        return sql_query
+    return re.sub(
+        r"^\s*select\b",
+        f"SELECT /*+ MAX_EXECUTION_TIME({int(max_execution_ms)}) */",
+        sql_query,
+        count=1,
+        flags=re.IGNORECASE,
+    )
+
+
+def add_limit(sql_query, limit=GUARD_DEFAULT_LIMIT):
+    """
+    Appends a LIMIT to a query whose outer level has none; a LIMIT inside a
+    subquery, a literal or a comment does not count.
+    """
+    if not limit or "limit" in outer_clauses(sql_query):
+        return sql_query
+    return f"{strip_comments(sql_query).rstrip(';').rstrip()} LIMIT {int(limit)}"
+
+
+def added_limit(original, checked):
+    """
+    Whether the guard capped the result of `original` by adding a LIMIT.
+    """
+    return "limit" in outer_clauses(checked) and "limit" not in outer_clauses(original)
+
+
+class QueryGuard:
+    """
+    Dry-runs generated SQL with EXPLAIN before it touches the data.
+
+    Syntax and unknown-identifier errors surface from EXPLAIN without executing
+    anything, and plans over the configured limits are either rejected or
+    rewritten with a LIMIT and a MAX_EXECUTION_TIME hint (GUARD_ACTION). A
+    rewrite cuts the result short, so callers that promise the full result
+    check with `rewrite=False`.
+    """
+
+    def __init__(
+        self,
+        max_estimated_rows=GUARD_MAX_ESTIMATED_ROWS,
+        max_full_scan_rows=GUARD_MAX_FULL_SCAN_ROWS,
+        action=GUARD_ACTION,
+        max_execution_ms=GUARD_MAX_EXECUTION_MS,
+        default_limit=GUARD_DEFAULT_LIMIT,
+        engine=None,
+    ):
+        self.max_estimated_rows = max_estimated_rows
+        self.max_full_scan_rows = max_full_scan_rows
+        self.action = action
+        self.max_execution_ms = max_execution_ms
+        self.default_limit = default_limit
+        self.engine = engine
+
+    async def explain(self, sql_query, engine=None):
+        """
+        Returns the parsed JSON plan on MySQL; on other dialects only checks
+        that the statement compiles.
+        """
+        engine = engine or self.engine or get_engine()
+        sql_query = sql_query.strip().rstrip(";")
+        if engine.dialect.name == "mysql":
+            _, rows = await run_query(f"EXPLAIN FORMAT=JSON {sql_query}", engine=engine)
+            return orjson.loads(rows[0][0])
+        if engine.dialect.name == "sqlite":
+            await run_query(f"EXPLAIN QUERY PLAN {sql_query}", engine=engine)
+        return None
+
+    async def check(self, sql_query, engine=None, rewrite=True):
+        """
+        Returns the SQL to execute (possibly rewritten, see `added_limit`).
+        Raises the database error for invalid SQL, or QueryRejected for plans
+        over the limits that are not rewritten.
+        """
+        plan = await self.explain(sql_query, engine)
+        if plan is None:
+            return sql_query
+
+        summary = summarize_plan(plan, self.max_full_scan_rows)
+        logger.debug(f"Plan for query: {summary}")
+        if summary.cartesian:
+            raise QueryRejected(
+                f"The query plan joins {', '.join(summary.cartesian)} without any join "
+                f"condition (cartesian product of ~{summary.estimated_rows} rows). "
+                f"Add the missing ON/WHERE join condition."
+            )
+
+        problems = []
+        if summary.estimated_rows > self.max_estimated_rows:
+            problems.append(
+                f"an estimated {summary.estimated_rows} rows exceeds the limit of {self.max_estimated_rows}"
+            )
+        for table, rows in summary.full_scans:
+            problems.append(f"a full scan of `{table}` reads ~{rows} rows")
+        if not problems:
+            return sql_query
+
+        if self.action == "reject" or not rewrite:
+            raise QueryRejected(
+                f"The query is too expensive to run: {'; '.join(problems)}. "
+                f"Filter on indexed columns, aggregate, or add a LIMIT."
+            )
+
+        rewritten = add_execution_time_hint(
+            add_limit(sql_query, self.default_limit), self.max_execution_ms
+        )
+        logger.warning(f"Expensive plan ({'; '.join(problems)}); running rewritten query: {rewritten}")
+        return rewritten
@@ -0,0 +1,366 @@
+import asyncio
+import threading
+import time
+import uuid
+
+import orjson
+
+from log import logger, request_id
+from config import (
+    JOB_BACKEND,
+    JOB_REDIS_URL,
+    JOB_QUEUE_NAME,
+    JOB_WORKERS,
+    JOB_MAX_QUEUED,
+    JOB_TIMEOUT_SECONDS,
+    JOB_RESULT_TTL_SECONDS,
+)
+from pagination import encode_page_token
+from serialization import dataframe_to_records, dumps, table_to_records
+
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "queued", "running", "succeeded", "failed", "cancelled"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+def new_job(query, page_size=None, tenant=None, database=None):
+    return {
+        "id": uuid.uuid4().hex,
+        "status": QUEUED,
+        "query": query,
+        "page_size": page_size,
+        "tenant": tenant,
+        "database": database,
+        "submitted_at": time.time(),
+        "started_at": None,
+        "finished_at": None,
+        "result": None,
+        "error": None,
+    }
+
+
+def result_payload(result, page_size):
+    """
+    The JSON body `/execute_query/` would have returned for a forward() result.
+    """
+    sql, table = result["final_sql"], result["arrow"]
+    if table is not None:
+        columns, rows = table_to_records(table)
+    else:
+        columns, rows = dataframe_to_records(result["result"])
+    has_more = result["has_more"]
+    return {
+        "sql": sql,
+        "columns": columns,
+        "data": rows,
+        "offset": 0,
+        "next_page_token": (
+            encode_page_token(sql, len(rows), page_size, result["database"]) if has_more else None
+        ),
+        "truncated": result["truncated"],
+    }
+
+
+async def run_job(sql_system, job, store):
+    """
+    Answers the question of `job` and stores its outcome. The status goes
+    queued -> running -> succeeded/failed; `result` is the first page.
+    """
+    # Records logged while the job runs carry its id as the request id
+    token = request_id.set(job["id"])
+    try:
+        job.update(status=RUNNING, started_at=time.time())
+        await store.save(job)
+        try:
+            result = await asyncio.wait_for(
+                # Nobody is waiting on a job, so it never settles for a truncated result
+                sql_system.forward_coalesced(
+                    job["query"], job["page_size"], job["tenant"], job.get("database"), truncate=False
+                ),
+                JOB_TIMEOUT_SECONDS,
+            )
+            if result["result"] is None:
+                job.update(status=FAILED, error=result["error"] or "No SQL query could be generated.")
+            else:
+                job.update(status=SUCCEEDED, result=result_payload(result, job["page_size"]))
+        except asyncio.CancelledError:
+            job.update(status=CANCELLED, finished_at=time.time())
+            await store.save(job)
+            raise
+        except asyncio.TimeoutError:
+            job.update(status=FAILED, error=f"Timed out after {JOB_TIMEOUT_SECONDS:.0f}s")
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {e}")
+            job.update(status=FAILED, error=str(e))
+        job["finished_at"] = time.time()
+        await store.save(job)
+        logger.info(f"Job {job['id']} {job['status']} in {job['finished_at'] - job['started_at']:.2f}s")
+        return job
+    finally:
+        request_id.reset(token)
+
+
+class MemoryJobStore:
+    """
+    Jobs kept in this worker's memory; each entry expires `ttl_seconds` after
+    its last update.
+    """
+
+    def __init__(self, ttl_seconds=JOB_RESULT_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.jobs = {}
+        self._lock = threading.Lock()
+
+    async def save(self, job):
+        payload = dumps(job)
+        with self._lock:
+            now = time.monotonic()
+            for job_id in [k for k, (_, expires_at) in self.jobs.items() if expires_at <= now]:
+                del self.jobs[job_id]
+            self.jobs[job["id"]] = (payload, now + self.ttl_seconds)
+
+    async def get(self, job_id):
+        with self._lock:
+            entry = self.jobs.get(job_id)
+        if entry is None or entry[1] <= time.monotonic():
+            return None
+        return orjson.loads(entry[0])
+
+
+class RedisJobStore:
+    """
+    Jobs stored as JSON strings in Redis with an expiry, readable by every
+    API worker and written by the rq workers.
+    """
+
+    def __init__(self, url=JOB_REDIS_URL, ttl_seconds=JOB_RESULT_TTL_SECONDS, prefix="query_to_sql:job:"):
+        import redis.asyncio as aioredis
+
+        self.client = aioredis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    async def save(self, job):
+        await self.client.set(self.prefix + job["id"], dumps(job), ex=self.ttl_seconds)
+
+    async def get(self, job_id):
+        payload = await self.client.get(self.prefix + job_id)
+        return orjson.loads(payload) if payload is not None else None
+
+
+class InProcessJobQueue:
+    """
+    Bounded queue served by `workers` background tasks of this process.
+
+    Only `workers` jobs run at once, so long questions cannot take every LLM
+    and database slot away from interactive requests; submissions beyond
+    `max_queued` waiting jobs are refused.
+    """
+
+    def __init__(self, sql_system, store=None, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED):
+        self.sql_system = sql_system
+        self.store = store or MemoryJobStore()
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=max_queued)
+        self.tasks = []
+        self.running = {}
+        self.cancelling = set()
+        self.counters = {"submitted": 0, "rejected": 0, "succeeded": 0, "failed": 0, "cancelled": 0}
+
+    def start(self):
+        self.tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    async def _work(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                current = await self.store.get(job["id"])
+                if current is not None and current["status"] == CANCELLED:
+                    continue
+                self.running[job["id"]] = asyncio.current_task()
+                try:
+                    job = await run_job(self.sql_system, job, self.store)
+                    self.counters[job["status"]] += 1
+                except asyncio.CancelledError:
+                    if job["id"] not in self.cancelling:
+                        raise
+                    # Only the job was cancelled, not this worker
+                    self.counters["cancelled"] += 1
+                    asyncio.current_task().uncancel()
+                finally:
+                    self.running.pop(job["id"], None)
+                    self.cancelling.discard(job["id"])
+            finally:
+                self.queue.task_done()
+
+    async def submit(self, query, page_size=None, tenant=None, database=None):
+        if self.queue.full():
+            self.counters["rejected"] += 1
+            raise JobQueueFull(f"{self.queue.qsize()} jobs are already waiting")
+        job = new_job(query, page_size, tenant, database)
+        await self.store.save(job)
+        self.queue.put_nowait(job)
+        self.counters["submitted"] += 1
+        return job
+
+    async def get(self, job_id):
+        return await self.store.get(job_id)
+
+    async def cancel(self, job_id):
+        """
+        Cancels a queued or running job; returns the job, or None if unknown.
+        """
+        job = await self.store.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+        task = self.running.get(job_id)
+        if task is not None:
+            self.cancelling.add(job_id)
+            task.cancel()
+            # run_job records the cancellation once the task unwinds
+            job["status"] = CANCELLED
+        else:
+            job.update(status=CANCELLED, finished_at=time.time())
+            await self.store.save(job)
+            self.counters["cancelled"] += 1
+        return job
+
+    def stats(self):
+        return {
+            **self.counters,
+            "backend": "memory",
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "running": len(self.running),
+        }
+
+
+class RQJobQueue:
+    """
+    Jobs enqueued on an rq/Redis queue and run by separate `rq worker`
+    processes (see `work`), so every API worker sees the same jobs and the
+    number of rq workers bounds how many long questions run at once.
+    """
+
+    def __init__(self, url=JOB_REDIS_URL, queue_name=JOB_QUEUE_NAME, max_queued=JOB_MAX_QUEUED):
+        from redis import Redis
+        from rq import Queue
+
+        self.store = RedisJobStore(url)
+        self.queue = Queue(queue_name, connection=Redis.from_url(url))
+        self.max_queued = max_queued
+        self.counters = {"submitted": 0, "rejected": 0}
+        # Last queue length read from Redis; `stats` must not block on it
+        self.queued = 0
+        self._counting = None
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        await self.store.client.aclose()
+
+    async def submit(self, query, page_size=None, tenant=None, database=None):
+        self.queued = await asyncio.to_thread(len, self.queue)
+        if self.queued >= self.max_queued:
+            self.counters["rejected"] += 1
+            raise JobQueueFull(f"{self.max_queued} jobs are already waiting")
+        job = new_job(query, page_size, tenant, database)
+        await self.store.save(job)
+        await asyncio.to_thread(
+            self.queue.enqueue,
+            work,
+            job,
+            job_id=job["id"],
+            # Our store holds the outcome; rq only needs the job while it runs
+            job_timeout=int(JOB_TIMEOUT_SECONDS) + 30,
+            result_ttl=0,
+            failure_ttl=JOB_RESULT_TTL_SECONDS,
+        )
+        self.counters["submitted"] += 1
+        return job
+
+    async def get(self, job_id):
+        return await self.store.get(job_id)
+
+    async def cancel(self, job_id):
+        from rq.command import send_stop_job_command
+        from rq.exceptions import InvalidJobOperation, NoSuchJobError
+        from rq.job import Job
+
+        job = await self.store.get(job_id)
+        if job is None or job["status"] in FINISHED:
+            return job
+
+        def _cancel():
+            try:
+                if job["status"] == RUNNING:
+                    send_stop_job_command(self.queue.connection, job_id)
+                else:
+                    Job.fetch(job_id, connection=self.queue.connection).cancel()
+            except (InvalidJobOperation, NoSuchJobError) as e:
+                logger.warning(f"Could not cancel rq job {job_id}: {e}")
+
+        await asyncio.to_thread(_cancel)
+        job.update(status=CANCELLED, finished_at=time.time())
+        await self.store.save(job)
+        return job
+
+    async def _count(self):
+        try:
+            self.queued = await asyncio.to_thread(len, self.queue)
+        except Exception as e:
+            logger.warning(f"Could not read the length of the job queue: {e}")
+
+    def stats(self):
+        """
+        Reports the last known queue length and refreshes it in a thread, as
+        `len(queue)` is a blocking Redis call and stats are read on the event loop.
+        """
+        if self._counting is None or self._counting.done():
+            try:
+                self._counting = asyncio.get_running_loop().create_task(self._count())
+            except RuntimeError:
+                pass
+        return {**self.counters, "backend": "rq", "queued": self.queued}
+
+
+# State of an rq worker process; kept across jobs by workers that do not fork
+# per job (`rq worker --worker-class rq.worker.SimpleWorker`)
+_worker_loop = None
+_worker_context = None
+
+
+def work(job):
+    """
+    rq entry point: answers one job with this process's own agent system.
+    """
+    global _worker_loop, _worker_context
+    if _worker_loop is None:
+        _worker_loop = asyncio.new_event_loop()
+    if _worker_context is None:
+        from app import AppContext
+
+        _worker_context = AppContext()
+        _worker_loop.run_until_complete(_worker_context.start())
+    store = RedisJobStore()
+    try:
+        _worker_loop.run_until_complete(run_job(_worker_context.sql_system, job, store))
+    finally:
+        _worker_loop.run_until_complete(store.client.aclose())
+
+
+def create_job_queue(sql_system):
+    if JOB_BACKEND == "rq":
+        logger.info(f"Background jobs go to the rq queue {JOB_QUEUE_NAME}.")
+        return RQJobQueue()
+    return InProcessJobQueue(sql_system)
@@ -10,32 +10,190 @@ parent_dir_path = os.path.dirname(current_dir_path)
 # Add the parent directory path to the sys.path
 sys.path.insert(0, parent_dir_path)
 
+import atexit
+import copy
+import json
 import logging
+import logging.handlers
+import queue
+import random
+import time
+from contextvars import ContextVar
+
+# Read here rather than in config.py, which logs through this module
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "-" logs to stdout; "{pid}" is replaced by the process id, so every worker
+# of a multi-process server writes (and rotates) its own file
+LOG_FILE = os.getenv("LOG_FILE", "./application.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # "json" or "text"
+# "size", "time", or "external": reopen the file when logrotate moves it, for a
+# file shared by several workers, which cannot safely rotate it themselves
+LOG_ROTATION = os.getenv("LOG_ROTATION", "size")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_WHEN = os.getenv("LOG_ROTATE_WHEN", "midnight")
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+# Longest message written; longer ones are cut with a note of how much was dropped
+LOG_MAX_MESSAGE_CHARS = int(os.getenv("LOG_MAX_MESSAGE_CHARS", "2000"))
+# Fraction of log_payload() calls that are written, and the size each value is cut to
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+LOG_MAX_PAYLOAD_CHARS = int(os.getenv("LOG_MAX_PAYLOAD_CHARS", "500"))
+
+# Id of the request being handled, added to every record logged while it runs
+request_id = ContextVar("request_id", default="-")
+
+_RECORD_FIELDS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "request_id"}
+
+
+def truncate(text, limit):
+    text = str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... ({len(text) - limit} more chars)"
+
+
+class RequestIdFilter(logging.Filter):
+    """
+    Stamps records with the current request id. Runs on the caller's thread,
+    before the record is queued, where the context variable is still set.
+    """
+
+    def filter(self, record):
+        record.request_id = request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, with `extra=` fields as top-level keys.
+    """
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": truncate(record.getMessage(), LOG_MAX_MESSAGE_CHARS),
+            "module": record.module,
+            "line": record.lineno,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc_info"] = record.exc_text
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+    def formatTime(self, record, datefmt=None):
+        return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}"
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        record.message_text = truncate(record.getMessage(), LOG_MAX_MESSAGE_CHARS)
+        if hasattr(record, "payload"):
+            record.message_text += f" {record.payload}"
+        return super().format(record)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records with their message merged and traceback rendered, like
+    the standard handler, but keeps the traceback out of the message so the
+    writer can format and truncate the two separately.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def summarize(value, limit=LOG_MAX_PAYLOAD_CHARS):
+    """
+    A short, cheap description of a value for logs: shapes instead of
+    DataFrame/Arrow contents, and truncated text for everything else.
+    """
+    if hasattr(value, "shape") and hasattr(value, "columns"):
+        return f"<DataFrame {value.shape[0]}x{value.shape[1]}>"
+    if hasattr(value, "num_rows") and hasattr(value, "column_names"):
+        return f"<Table {value.num_rows}x{len(value.column_names)}>"
+    if isinstance(value, dict):
+        return {key: summarize(item, limit) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [summarize(item, limit) for item in value[:10]]
+        if len(value) > 10:
+            items.append(f"... {len(value) - 10} more")
+        return items
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return truncate(value, limit)
+
+
+def log_payload(message, payload, level=logging.DEBUG, sample_rate=None):
+    """
+    Logs a large object (a result dict, a prompt, rows) at `level` for a
+    sample of calls only, summarized with `summarize`. Nothing is formatted
+    when the level is disabled or the call is not sampled.
+    """
+    if not logger.isEnabledFor(level):
+        return
+    rate = LOG_PAYLOAD_SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate < 1 and random.random() >= rate:
+        return
+    logger.log(level, message, extra={"payload": summarize(payload)}, stacklevel=2)
+
+
+def _file_handler(path=LOG_FILE, rotation=LOG_ROTATION):
+    path = path.replace("{pid}", str(os.getpid()))
+    if path == "-":
+        handler = logging.StreamHandler(sys.stdout)
+    elif rotation == "external":
+        handler = logging.handlers.WatchedFileHandler(path, encoding="utf-8")
+    elif rotation == "time":
+        handler = logging.handlers.TimedRotatingFileHandler(
+            path, when=LOG_ROTATE_WHEN, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(
+            TextFormatter("%(asctime)s - %(name)s - %(levelname)s - [%(request_id)s] %(message_text)s")
+        )
+    return handler
+
 
 # Create a logger
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
-
-#####################  local saving  #####################
-log_file_path = "./application.log"
-# Delete the log file if it already exists
-if os.path.exists(log_file_path):
-    os.remove(log_file_path)
+logger.setLevel(LOG_LEVEL)
 
-# Configure the logger
-logger2 = logging.getLogger(__name__)
-handler = logging.FileHandler(log_file_path, encoding="utf-8")
-handler.setLevel(logging.DEBUG)
+# Callers only put records on a queue; a background thread formats and writes
+# them, so no request waits on disk I/O
+_queue = queue.SimpleQueue()
+_queue_handler = _QueueHandler(_queue)
+_queue_handler.addFilter(RequestIdFilter())
+logger.addHandler(_queue_handler)
+_listener = logging.handlers.QueueListener(_queue, _file_handler(), respect_handler_level=True)
+_listener.start()
+_listening = True
 
-# Create a formatter
-formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-handler.setFormatter(formatter)
 
-logger2.addHandler(handler)
+def shutdown():
+    """
+    Writes out queued records and stops the writer thread.
+    """
+    global _listening
+    if _listening:
+        _listening = False
+        _listener.stop()
 
-# Optional: Set logger level
-logger2.setLevel(logging.DEBUG)
 
-# Example log messages
-logger2.info("This is an info message.")
-logger2.debug("This is a debug message.")
+atexit.register(shutdown)
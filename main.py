@@ -1,70 +1,85 @@
 import asyncio
-import time
 import os
-import json
-import pandas as pd
+import time
+import threading
 import dspy
-import groq
-import litellm
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import text
-from sqlalchemy.ext.declarative import declarative_base
-from dotenv import load_dotenv
+from functools import partial
 from log import logger
-from agents import SQLAgent, error_reasoning_agent, error_fix_agent
-from config import db_info
-
-
-# Load environment variables from .env file
-load_dotenv()
-
-# Database Configuration
-mysql_host = os.getenv("mysql_host", "localhost")
-mysql_port = int(os.getenv("mysql_port", "3306"))
-mysql_user = os.getenv("mysql_user", "root")
-mysql_password = os.getenv("mysql_password", "")
-mysql_database = os.getenv("mysql_database", "chatbot")
-
-# Database URL
-DATABASE_URL = f"mysql+pymysql://{mysql_user}:{mysql_password}@{mysql_host}:{mysql_port}/{mysql_database}"
-
-# SQLAlchemy Engine & Session
-engine = create_engine(DATABASE_URL, pool_pre_ping=True, pool_size=10, max_overflow=20)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+from agents import (
+    SQLAgent,
+    error_reasoning_agent,
+    error_fix_agent,
+    error_fix_fused_agent,
+)
+from config import (
+    db_info,
+    SCHEMA_INTROSPECTION_ENABLED,
+    RAG_ENABLED,
+    GUARD_ENABLED,
+    LOCAL_REPAIR_ENABLED,
+    LOCAL_REPAIR_MAX_ATTEMPTS,
+    FUSED_ERROR_FIX,
+    SPECULATIVE_ENABLED,
+    MODEL,
+    RATE_LIMIT_ENABLED,
+    RESULT_CACHE_ENABLED,
+    BATCH_CONCURRENCY,
+    DEFAULT_DATABASE,
+)
+from repair import repair_sql
+from guard import QueryGuard, added_limit, ensure_read_only
+from databases import Database, UnknownDatabase
+from schema import SchemaProvider, SchemaSnapshot
+from columnar import arrow_to_dataframe, fetch_arrow
+from pagination import needs_order, paginate_sql
+from speculation import SpeculationBudget, first_valid
+from routing import ModelRouter
+from ratelimit import estimate_tokens, get_rate_limiter
+from result_cache import ResultCache
+from cache import normalize_question
+from examples import NO_EXAMPLES, render_examples
+from streaming import stream_call
+from metrics import (
+    LLM_CALL_SECONDS,
+    REQUESTS,
+    RETRIES,
+    STAGE_SECONDS,
+    record_llm_usage,
+    stage,
+)
 
 
 class GroqLM(dspy.LM):
-    def __init__(self, model="groq/llama3-8b-8192", temperature=0.1):
-        super().__init__(model=model)
+    def __init__(self, model=MODEL, temperature=0.1):
+        # With the rate limiter on, it owns retries; litellm's own retries
+        # would sleep inside worker threads and ignore the shared quota
+        super().__init__(model=model, num_retries=0 if RATE_LIMIT_ENABLED else 8)
         self.model = model
         self.temperature = temperature
         self.api_key = os.getenv("GROQ_API_KEY")
 
-    async def generate(self, prompt, max_tokens=256):
-        """
-        Generate a response using the Groq API asynchronously for better performance.
-        """
-        try:
-            response = await asyncio.to_thread(
-                litellm.completion,
-                model=self.model,
-                messages=[{"role": "user", "content": prompt}],
-                api_key=self.api_key,
-                temperature=self.temperature,
-                max_tokens=max_tokens,
-            )
-            return response.choices[0].message.content.strip()
-        except litellm.BadRequestError as e:
-            logger.error(f"Bad request error: {str(e)}")
-            return None
-        except Exception as e:
-            logger.error(f"Unexpected error in Groq API call: {str(e)}")
-            return None
+    def update_global_history(self, entry):
+        # Runs in the calling thread right after each completion, inside the
+        # span of the agent call, so token usage lands on the right span
+        super().update_global_history(entry)
+        record_llm_usage(entry)
+
+
+_lm_configured = False
+_lm_lock = threading.Lock()
 
 
-# Update DSPy to use the async `GroqLM`
-dspy.configure(lm=GroqLM(model="groq/llama3-8b-8192"))
+def configure_lm():
+    """
+    Configures DSPy to use the async `GroqLM` once per process. This is the
+    default model; `ModelRouter` overrides it per agent call.
+    """
+    global _lm_configured
+    if not _lm_configured:
+        with _lm_lock:
+            if not _lm_configured:
+                dspy.configure(lm=GroqLM(model=MODEL))
+                _lm_configured = True
 
 
 def clean_llm_response(text):
@@ -82,102 +97,625 @@ class AgentSystem(dspy.Module):
     Handles the full workflow of generating, executing, and debugging SQL queries.
     """
 
-    def __init__(self, dataset_information, max_retry=3):
+    def __init__(
+        self,
+        dataset_information=db_info,
+        max_retry=3,
+        cache=None,
+        schema_provider=None,
+        schema_index=None,
+        guard=None,
+        local_repair=LOCAL_REPAIR_ENABLED,
+        fused_fix=FUSED_ERROR_FIX,
+        speculation=None,
+        router=None,
+        rate_limiter=None,
+        result_cache=None,
+        singleflight=None,
+        databases=None,
+        example_store=None,
+        summaries=None,
+    ):
+        configure_lm()
         self.max_retry = max_retry
         self.sql_agent = dspy.Predict(SQLAgent)
         self.error_reasoning_agent = dspy.Predict(error_reasoning_agent)
         self.error_fix_agent = dspy.ChainOfThought(error_fix_agent)
+        self.error_fix_fused_agent = dspy.Predict(error_fix_fused_agent)
+        self.local_repair = local_repair
+        self.fused_fix = fused_fix
         self.dataset_information = dataset_information
+        self.static_schema = SchemaSnapshot.static(dataset_information)
+        self.schema_provider = schema_provider
+        self.schema_index = schema_index
+        self.guard = guard
+        self.cache = cache
+        # SpeculationBudget; None keeps generation strictly serial
+        self.speculation = speculation
+        self.router = router or ModelRouter(GroqLM)
+        if rate_limiter is None and RATE_LIMIT_ENABLED:
+            rate_limiter = get_rate_limiter()
+        self.rate_limiter = rate_limiter
+        self.result_cache = result_cache
+        self.singleflight = singleflight
+        # DatabaseRouter; None runs everything on the process-wide engine
+        self.databases = databases
+        # Few-shot examples of the default database when there is no router
+        self.example_store = example_store
+        # SummaryManager of the default database when there is no router
+        self.summaries = summaries
+
+    def database(self, name=None, tenant=None):
+        """
+        Returns the `Database` a request runs against. Without a router, that
+        is the process-wide engine with this system's schema provider, schema
+        index, caches and summary tables.
+        """
+        if self.databases is not None:
+            return self.databases.resolve(name, tenant)
+        if name and name != DEFAULT_DATABASE:
+            raise UnknownDatabase(f"Unknown database '{name}'.")
+        db = Database(DEFAULT_DATABASE)
+        db.schema_provider = self.schema_provider
+        db.schema_index = self.schema_index
+        db.result_cache = self.result_cache
+        db.example_store = self.example_store
+        db.summaries = self.summaries
+        return db
+
+    async def get_schema(self, db=None):
+        """
+        Returns the schema snapshot for this request: the live, cached schema of
+        its database when a provider is configured, otherwise the static
+        `dataset_information`.
+        """
+        db = db or self.database()
+        if db.schema_provider is None:
+            return self.static_schema
+        return await db.schema_provider.get()
 
-    async def execute_query(self, sql_query, session):
+    async def get_schema_text(self, query, schema, db=None):
         """
-        Executes a SQL query safely, handling errors and transactions asynchronously.
+        Returns the schema description to put in the prompt for this question:
+        a top-k slice from the schema index when one is configured.
         """
+        schema_index = (db or self.database()).schema_index
+        if schema_index is None or not schema.tables:
+            return schema.text
         try:
-            result = await asyncio.to_thread(session.execute, text(sql_query))
-            df = pd.DataFrame(result.fetchall(), columns=[col for col in result.keys()])
-            return df
+            schema_slice = await asyncio.to_thread(schema_index.retrieve, query, schema)
+            return schema_slice.text
+        except Exception as e:
+            logger.error(f"Schema retrieval failed, sending the full schema: {e}")
+            return schema.text
+
+    async def get_examples(self, query, schema, db, embedding=None):
+        """
+        Returns `(examples, embedding)`: the verified question/SQL pairs of the
+        database closest to this question, rendered for the SQL agent.
+        """
+        if db.example_store is None:
+            return NO_EXAMPLES, embedding
+        try:
+            with stage("examples"):
+                examples, embedding = await asyncio.to_thread(
+                    db.example_store.retrieve, query, schema, embedding
+                )
+            return render_examples(examples), embedding
+        except Exception as e:
+            logger.error(f"Example retrieval failed, generating without examples: {e}")
+            return NO_EXAMPLES, embedding
+
+    async def execute_arrow(self, sql_query, page_size=None, offset=0, db=None):
+        """
+        Executes a SQL query on a read copy of the request's database and
+        returns a pyarrow Table.
+
+        With `page_size`, only `page_size + 1` rows starting at `offset` are
+        fetched; the extra row tells the caller whether another page exists.
+        Results are served from and stored in the database's result cache when
+        configured. Aggregates a fresh summary table can answer read the
+        summary instead, falling back to the query as written if that fails.
+        """
+        return (await self.execute_page(sql_query, page_size, offset, db))[0]
+
+    async def execute_page(self, sql_query, page_size=None, offset=0, db=None):
+        """
+        Like `execute_arrow`, returning `(table, source_sql)`: `source_sql` is
+        the unpaginated query the rows were read with (the query itself or its
+        summary rewrite), which later pages must continue from.
+
+        Later pages are ordered by every column so they never overlap (see
+        `paginate_sql`). A first page is not sorted unless it turns out that a
+        second page exists; it is then read again in that order.
+        """
+        db = db or self.database()
+        if db.summaries is not None and not offset:
+            # Every first page counts towards the workload summaries are mined from
+            db.summaries.observe(sql_query)
+        table, source = await self._execute(sql_query, page_size, offset, db, order=bool(offset))
+        if page_size and not offset and table.num_rows > page_size and needs_order(source):
+            table, source = await self._execute(sql_query, page_size, offset, db, order=True)
+        return table, source
+
+    async def _execute(self, sql_query, page_size, offset, db, order):
+        base_sql = sql_query
+        if page_size:
+            sql_query = paginate_sql(sql_query, page_size + 1, offset, order)
+        result_cache = db.result_cache
+        if result_cache is not None:
+            await result_cache.poll()
+            table = result_cache.get(sql_query)
+            if table is not None:
+                logger.debug("Result served from the result cache.")
+                return table, base_sql
+        table, engines = None, []
+
+        async def fetch(engine, query):
+            engines.append(engine)
+            return await fetch_arrow(query, engine=engine)
+
+        summaries = db.summaries
+        rewritten = await summaries.rewrite(base_sql) if summaries is not None else None
+        if rewritten is not None:
+            summary_sql, summary = rewritten
+            paged_summary_sql = summary_sql
+            if page_size:
+                paged_summary_sql = paginate_sql(summary_sql, page_size + 1, offset, order)
+            try:
+                with stage("execute"):
+                    table = await db.read(lambda engine: fetch(engine, paged_summary_sql))
+                # Not cached: the cache key is the base query, and later pages
+                # must know they continue from the summary
+                return table, summary_sql
+            except Exception as e:
+                summaries.fallback(summary, e)
+        try:
+            with stage("execute"):
+                table = await db.read(lambda engine: fetch(engine, sql_query))
         except Exception as e:
             logger.error(f"Query execution failed: {e}")
             raise
-        finally:
-            session.close()
+        # Entries are invalidated by the primary's UPDATE_TIME, so a result a
+        # lagging replica read may already be older than its last invalidation
+        if result_cache is not None:
+            if db.replica_lag(engines[-1]) > 0:
+                logger.debug("Result not cached: it was read from a lagging replica.")
+            else:
+                result_cache.put(sql_query, table)
+        return table, base_sql
+
+    async def execute_query(self, sql_query, page_size=None, db=None):
+        """
+        Executes a SQL query and returns an Arrow-backed DataFrame.
+        """
+        return arrow_to_dataframe(await self.execute_arrow(sql_query, page_size, db=db))
+
+    async def run_candidate(self, sql, page_size=None, db=None, truncate=True):
+        """
+        Validates and executes one SQL candidate.
+
+        Returns `(sql, df, table, source_sql)` where `sql` is the statement that
+        actually ran (unless `truncate` is off, the guard may add a LIMIT to it)
+        and `source_sql` what its rows were read with (see `execute_page`).
+        Raises on writes, plan errors, execution errors and empty results.
+        """
+        db = db or self.database()
+        ensure_read_only(sql)
+        if self.guard is not None:
+            # EXPLAIN first: invalid or runaway SQL fails here without executing
+            with stage("guard"):
+                sql = await db.read(lambda engine: self.guard.check(sql, engine, rewrite=truncate))
+        table, source = await self.execute_page(sql, page_size, db=db)
+        with stage("dataframe"):
+            df = arrow_to_dataframe(table)
+        if df.empty:
+            raise ValueError("Query returned an empty result set.")
+        return sql, df, table, source
+
+    async def call_agent(self, predictor, lm=None, on_token=None, **kwargs):
+        """
+        Calls a DSPy predictor in a worker thread, through the rate limiter of
+        its model when one is configured. With `on_token`, the completion is
+        streamed and the text of `generated_sql` is passed to it as it arrives.
+        """
+        if lm is not None:
+            kwargs["lm"] = lm
+        model = getattr(lm or dspy.settings.lm, "model", "default")
+        # ChainOfThought has no `signature` of its own; label by attribute name
+        agent = next(
+            (name for name, value in vars(self).items() if value is predictor),
+            type(predictor).__name__,
+        )
+        call = partial(predictor, **kwargs)
+        streamed = []
+        if on_token is None:
+            start = partial(asyncio.to_thread, call)
+        else:
+
+            def forward_token(text):
+                streamed.append(text)
+                on_token(text)
+
+            start = partial(stream_call, call, forward_token)
+        with stage("llm_call", LLM_CALL_SECONDS, agent=agent, model=model):
+            if self.rate_limiter is None:
+                return await start()
+            tokens = estimate_tokens(
+                [value for value in kwargs.values() if isinstance(value, str)],
+                getattr(lm or dspy.settings.lm, "kwargs", {}).get("max_tokens", 1000),
+            )
+            # Retrying after the client got tokens would send them twice
+            return await self.rate_limiter.run(model, tokens, start, retryable=lambda: not streamed)
+
+    async def generate_sql(
+        self, query, schema_text, temperature=None, lm=None, on_token=None, examples=NO_EXAMPLES
+    ):
+        """
+        Runs the SQL agent in a worker thread and returns `(sql, response)`.
+        """
+        kwargs = {}
+        if temperature is not None:
+            kwargs["config"] = {"temperature": temperature}
+        response = await self.call_agent(
+            self.sql_agent,
+            lm,
+            on_token,
+            user_query=query,
+            dataset_information=schema_text,
+            sql_dialect="MySQL",
+            examples=examples,
+            **kwargs,
+        )
+        return clean_llm_response(response.generated_sql), response
+
+    async def speculate(
+        self, query, schema_text, page_size=None, lm=None, db=None, examples=NO_EXAMPLES, truncate=True
+    ):
+        """
+        Generates `speculation.candidates` SQL candidates at different
+        temperatures and runs the distinct ones concurrently; the first one to
+        execute successfully wins and the others are cancelled.
+        """
+        budget = self.speculation
+        generators = [
+            self.generate_sql(query, schema_text, budget.temperature(index), lm, examples=examples)
+            for index in range(budget.candidates)
+        ]
+        return await first_valid(
+            generators, lambda sql: self.run_candidate(sql, page_size, db, truncate)
+        )
+
+    async def fix_with_llm(self, query, sql, error, schema_text, lm=None, on_token=None):
+        """
+        Asks the LLM agents for a corrected query.
+
+        Returns `(reasoning, response)`; in fused mode a single call produces
+        both the diagnosis and the corrected SQL.
+        """
+        information = f"User query: {query}\n{schema_text}"
+        if self.fused_fix:
+            response = await self.call_agent(
+                self.error_fix_fused_agent,
+                lm,
+                on_token,
+                error_message=str(error),
+                incorrect_sql=sql,
+                information=information,
+            )
+            return response.error_fix_reasoning, response
 
-    async def forward(self, query):
+        error_reason = await self.call_agent(
+            self.error_reasoning_agent,
+            lm,
+            error_message=str(error),
+            incorrect_sql=sql,
+            information=information,
+        )
+        if "NOT ASKING FOR SQL" in error_reason.error_fix_reasoning:
+            return error_reason.error_fix_reasoning, None
+        response = await self.call_agent(
+            self.error_fix_agent,
+            lm,
+            on_token,
+            instruction=error_reason.error_fix_reasoning,
+        )
+        return error_reason.error_fix_reasoning, response
+
+    @staticmethod
+    def _set_result(return_dict, sql, df, page_size, table=None, source=None):
+        return_dict["final_sql"] = sql
+        return_dict["source_sql"] = source or sql
+        return_dict["has_more"] = bool(page_size) and len(df) > page_size
+        return_dict["result"] = df.iloc[:page_size] if page_size else df
+        if table is not None:
+            return_dict["arrow"] = table.slice(0, page_size) if page_size else table
+        return_dict["error"] = None
+
+    @staticmethod
+    def cache_version(db, schema):
+        """
+        Semantic cache entries are per database: databases with the same
+        schema hold different rows.
+        """
+        return f"{db.name}:{schema.version}"
+
+    async def remember(self, query, db, schema, sql, df, page_size, embedding):
+        """
+        Keeps a verified answer: its SQL in the semantic cache, and the
+        question/SQL pair as a future few-shot example.
+        """
+        if self.cache is not None:
+            # A single page is not the full result, so only cache the SQL
+            await asyncio.to_thread(
+                self.cache.store,
+                query,
+                self.cache_version(db, schema),
+                sql,
+                df=None if page_size else df,
+                embedding=embedding,
+            )
+        if db.example_store is not None:
+            try:
+                await asyncio.to_thread(db.example_store.add, query, sql, schema, embedding)
+            except Exception as e:
+                logger.error(f"Could not store the verified example: {e}")
+
+    async def forward(
+        self, query, page_size=None, tenant=None, on_event=None, database=None, truncate=True
+    ):
         """
         Processes a user query, generates SQL, executes it, and handles errors asynchronously.
+
+        The returned dict carries the whole attempt history plus `final_sql` and
+        `result` (Arrow-backed DataFrame, also available as the `arrow` Table) of
+        the attempt that succeeded, so callers never need to execute the SQL a
+        second time. With `page_size`, `result` holds only
+        the first page and `has_more` tells whether the query has more rows.
+
+        The SQL runs against `database` (see `DatabaseRouter.resolve`; by
+        default the database named like `tenant`, else the default one), with
+        that database's schema and caches.
+
+        When a speculation budget is configured and `tenant` is allowed to use
+        it, the first attempt races several candidates instead of one; if none
+        of them works, the serial fix loop continues from the first failure.
+
+        With `truncate` (and GUARD_ACTION=rewrite), an expensive query may run
+        with a LIMIT added by the guard; `truncated` is then True. Callers that
+        promise the full result pass False, and such queries fail instead.
+
+        `on_event(event, data)` is called as the pipeline progresses: on a
+        `cache_hit`, on `generating`/`speculating`, for each `sql_token` of
+        streamed SQL, on `executing` each attempt, on every `retry` (with the
+        error) and with the fix `reasoning`.
         """
-        return_dict = {"response": [], "sql": [], "error_reason": [], "df": []}
-        session = SessionLocal()
+        emit = on_event or (lambda event, data: None)
+        on_token = (lambda text: emit("sql_token", {"text": text})) if on_event else None
+        return_dict = {
+            "response": [],
+            "sql": [],
+            "error_reason": [],
+            "df": [],
+            "cache": None,
+            "schema_version": None,
+            "final_sql": None,
+            "source_sql": None,
+            "result": None,
+            "arrow": None,
+            "has_more": False,
+            "truncated": False,
+            "error": None,
+            "speculative": None,
+            "model": None,
+            "database": None,
+        }
+        embedding = None
+        decision, attempt = None, 0
+        started = time.perf_counter()
 
         try:
-            # Wrap the prediction call in asyncio.to_thread to prevent blocking
-            response = await asyncio.to_thread(
-                self.sql_agent,
-                user_query=query,
-                dataset_information=self.dataset_information,
-                sql_dialect="MySQL",
-            )
-            return_dict["response"].append(response)
+            db = self.database(database, tenant)
+            return_dict["database"] = db.name
+            with stage("schema"):
+                schema = await self.get_schema(db)
+            return_dict["schema_version"] = schema.version
+
+            if self.cache is not None:
+                with stage("semantic_cache"):
+                    cached, embedding = await asyncio.to_thread(
+                        self.cache.lookup, query, self.cache_version(db, schema)
+                    )
+                if cached is not None:
+                    emit("cache_hit", {"sql": cached.sql})
+                    try:
+                        df, table, source = cached.df, None, None
+                        if df is None:
+                            table, source = await self.execute_page(cached.sql, page_size, db=db)
+                            df = arrow_to_dataframe(table)
+                        return_dict["sql"].append(cached.sql)
+                        return_dict["df"].append(df)
+                        self._set_result(return_dict, cached.sql, df, page_size, table, source)
+                        return_dict["cache"] = "hit"
+                        return return_dict
+                    except Exception as e:
+                        logger.warning(f"Cached SQL no longer executes, regenerating: {e}")
+                        self.cache.invalidate(cached)
+                return_dict["cache"] = "miss"
+
+            with stage("schema_slice"):
+                # The nearest examples are looked up while the schema is sliced
+                schema_text, (examples, embedding) = await asyncio.gather(
+                    self.get_schema_text(query, schema, db),
+                    self.get_examples(query, schema, db, embedding),
+                )
+            decision = self.router.route(query, schema_text)
+            first_lm = self.router.lm(decision.tier)
 
-            for attempt in range(self.max_retry):
-                sql = clean_llm_response(response.generated_sql)
-                return_dict["sql"].append(sql)
+            sql, pending_error = None, None
+            if self.speculation is not None and self.speculation.try_acquire(tenant):
+                emit("speculating", {"candidates": self.speculation.candidates, "model": decision.tier})
+                try:
+                    with stage("speculate"):
+                        winner, failures = await self.speculate(
+                            query, schema_text, page_size, first_lm, db, examples, truncate
+                        )
+                finally:
+                    self.speculation.release()
+                return_dict["speculative"] = {
+                    "candidates": self.speculation.candidates,
+                    "validated": len(failures) + (winner is not None),
+                    "winner": winner[0] if winner else None,
+                }
+                for failed_sql, response, error in failures:
+                    return_dict["response"].append(response)
+                    return_dict["sql"].append(failed_sql)
+                if winner is not None:
+                    _, candidate_sql, response, (sql, df, table, source) = winner
+                    return_dict["response"].append(response)
+                    return_dict["sql"].append(candidate_sql)
+                    return_dict["df"].append(df)
+                    self._set_result(return_dict, sql, df, page_size, table, source)
+                    return_dict["truncated"] = added_limit(candidate_sql, sql)
+                    if not return_dict["truncated"]:
+                        await self.remember(query, db, schema, sql, df, page_size, embedding)
+                    attempt = 1
+                    return return_dict
+                if failures:
+                    # Continue the serial loop from the first failed candidate
+                    sql, _, pending_error = failures[0]
 
+            if sql is None:
+                emit("generating", {"model": decision.tier})
+                sql, response = await self.generate_sql(
+                    query, schema_text, lm=first_lm, on_token=on_token, examples=examples
+                )
+                return_dict["response"].append(response)
+
+            attempt, local_repairs = 1, 0
+            while True:
                 try:
-                    df = await self.execute_query(sql, session)
+                    if pending_error is not None:
+                        error, pending_error = pending_error, None
+                        raise error
+                    return_dict["sql"].append(sql)
+                    emit("executing", {"sql": sql, "attempt": attempt})
+                    sql, df, table, source = await self.run_candidate(sql, page_size, db, truncate)
                     return_dict["df"].append(df)
-                    if df.empty:
-                        raise ValueError("Query returned an empty result set.")
+                    self._set_result(return_dict, sql, df, page_size, table, source)
+                    return_dict["truncated"] = added_limit(return_dict["sql"][-1], sql)
+                    # A locally repaired query ran, but nothing checked it answers the
+                    # question; a truncated one is not the answer either
+                    if not local_repairs and not return_dict["truncated"]:
+                        await self.remember(query, db, schema, sql, df, page_size, embedding)
                     break
 
                 except Exception as e:
                     logger.error(f"SQL Execution Error: {e}")
-                    error_reason = await asyncio.to_thread(
-                        self.error_reasoning_agent,
-                        error_message=str(e),
-                        incorrect_sql=sql,
-                        information=self.dataset_information,
-                    )
-                    return_dict["error_reason"].append(error_reason.error_fix_reasoning)
+                    return_dict["error"] = str(e)
+
+                    # Cheap deterministic fixes first; they don't use up LLM attempts
+                    if self.local_repair and local_repairs < LOCAL_REPAIR_MAX_ATTEMPTS:
+                        repaired = repair_sql(sql, e, schema.catalog())
+                        if repaired is not None:
+                            local_repairs += 1
+                            RETRIES.inc(kind="local_repair")
+                            sql, note = repaired
+                            return_dict["error_reason"].append(f"Local repair: {note}")
+                            emit("retry", {"kind": "local_repair", "error": str(e), "reason": note})
+                            continue
 
-                    if "NOT ASKING FOR SQL" in error_reason.error_fix_reasoning:
+                    # No point asking for a fix that will never be executed
+                    if attempt >= self.max_retry:
                         break
+                    attempt += 1
+                    RETRIES.inc(kind="llm_fix")
+                    emit("retry", {"kind": "llm_fix", "error": str(e), "attempt": attempt})
 
-                    response = await asyncio.to_thread(
-                        self.error_fix_agent,
-                        instruction=error_reason.error_fix_reasoning,
+                    reasoning, response = await self.fix_with_llm(
+                        query, sql, e, schema_text, self.router.fix_lm(decision), on_token
                     )
+                    return_dict["error_reason"].append(reasoning)
+                    emit("reasoning", {"text": reasoning})
+                    if "NOT ASKING FOR SQL" in reasoning:
+                        break
                     return_dict["response"].append(response)
+                    sql = clean_llm_response(response.generated_sql)
 
         except Exception as e:
             logger.error(f"Critical failure in query processing: {e}")
+            return_dict["error"] = str(e)
 
         finally:
-            session.close()
+            succeeded = return_dict["result"] is not None
+            if decision is not None:
+                return_dict["model"] = decision.as_dict()
+                self.router.record(decision, succeeded, attempt)
+            outcome = "ok" if succeeded else "error"
+            STAGE_SECONDS.observe(time.perf_counter() - started, stage="forward", outcome=outcome)
+            REQUESTS.inc(outcome=outcome, cache=return_dict["cache"] or "off")
 
         return return_dict
 
-    async def rate_limited_request(self, prompt):
+    async def forward_coalesced(self, query, page_size=None, tenant=None, database=None, truncate=True):
         """
-        Handles Groq rate limit error and retries with exponential backoff.
+        Runs `forward`, sharing one computation between concurrent callers that
+        ask the same (normalized) question of the same database and schema
+        version.
+
+        Every caller gets its own copy of the result dict; `coalesced` is True
+        for callers that attached to another caller's computation.
         """
-        backoff = 1
-        while True:
-            try:
-                return await self.lm.generate(prompt)
-            except litellm.RateLimitError:
-                logger.warning("Rate limit exceeded, retrying after backoff...")
-                time.sleep(backoff)
-                backoff *= 2  # Exponential backoff
-                if backoff > 60:  # Max backoff of 60 seconds
-                    logger.error("Max retries reached, aborting.")
-                    break
+        run = partial(
+            self.forward, query, page_size=page_size, tenant=tenant, database=database, truncate=truncate
+        )
+        if self.singleflight is None:
+            return await run()
+        db = self.database(database, tenant)
+        schema = await self.get_schema(db)
+        key = (normalize_question(query), db.name, schema.version, page_size, tenant, truncate)
+        result, shared = await self.singleflight.do(key, run)
+        return {**result, "coalesced": shared}
 
 
 if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Answer questions with the SQL agent system.")
+    parser.add_argument("--batch", help="JSONL file of questions to answer as one batch")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument("--page-size", type=int, default=None, help="Rows kept per answer")
+    parser.add_argument("--output", help="NDJSON results file (default: stdout)")
+    args = parser.parse_args()
+
     # Initialize the SQL Agent System
-    sql_system = AgentSystem(dataset_information=db_info, max_retry=3)
+    sql_system = AgentSystem(
+        dataset_information=db_info,
+        max_retry=3,
+        schema_provider=SchemaProvider() if SCHEMA_INTROSPECTION_ENABLED else None,
+        guard=QueryGuard() if GUARD_ENABLED else None,
+        speculation=SpeculationBudget() if SPECULATIVE_ENABLED else None,
+        result_cache=ResultCache() if RESULT_CACHE_ENABLED else None,
+    )
+    if RAG_ENABLED and sql_system.schema_provider is not None:
+        from rag import get_schema_index
+
+        sql_system.schema_index = get_schema_index()
+
+    if args.batch:
+        from batch import load_questions, write_batch
+
+        output = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            summary = asyncio.run(
+                write_batch(sql_system, load_questions(args.batch), output, args.concurrency, args.page_size)
+            )
+        finally:
+            if args.output:
+                output.close()
+        logger.info(f"Batch finished: {summary}")
+        sys.exit(1 if summary and summary["failed"] else 0)
 
     # Execute a test query asynchronously
     try:
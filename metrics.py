@@ -0,0 +1,263 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from log import logger
+from config import OTEL_ENABLED, OTEL_SERVICE_NAME
+
+try:
+    from opentelemetry import trace
+
+    # A no-op tracer until setup_tracing() installs an SDK provider
+    _tracer = trace.get_tracer("query_to_sql")
+except ImportError:
+    trace = None
+    _tracer = None
+
+
+PROMETHEUS_MEDIA_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# List receiving `(stage, seconds, outcome)` for every stage run in the current
+# context; set by collect_stages() so the benchmark can compute exact percentiles
+_stage_sink = ContextVar("stage_sink", default=None)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=None):
+    pairs = list(zip(names, values)) + list(extra or [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [bucket counts..., sum, count]
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            state = self.values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[index] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, state in sorted(self.values.items()):
+                for index, bound in enumerate(self.buckets):
+                    labels = _labels(self.labelnames, key, [("le", bound)])
+                    lines.append(f"{self.name}_bucket{labels} {state[index]}")
+                labels = _labels(self.labelnames, key, [("le", "+Inf")])
+                lines.append(f"{self.name}_bucket{labels} {state[-1]}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {state[-2]}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {state[-1]}")
+        return lines
+
+
+class Registry:
+    """
+    Metrics rendered in the Prometheus text exposition format.
+
+    Collectors are callables returning `(name, type, help, {label_tuple: value}, labelnames)`
+    and are evaluated at scrape time, for values owned by other objects such as
+    cache statistics. Both are keyed by name, so registering again (e.g. on
+    every app start in tests) replaces rather than duplicates.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = {}
+
+    def register(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def add_collector(self, name, collector):
+        self.collectors[name] = collector
+
+    def remove_collector(self, name):
+        self.collectors.pop(name, None)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        for collector in self.collectors.values():
+            try:
+                samples = list(collector())
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+                continue
+            for name, kind, documentation, values, labelnames in samples:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for key, value in values.items():
+                    lines.append(f"{name}{_labels(labelnames, key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(
+    Histogram("query_to_sql_stage_seconds", "Duration of pipeline stages.", ["stage", "outcome"])
+)
+LLM_CALL_SECONDS = REGISTRY.register(
+    Histogram("query_to_sql_llm_call_seconds", "Duration of LLM calls.", ["agent", "model", "outcome"])
+)
+LLM_TOKENS = REGISTRY.register(
+    Counter("query_to_sql_llm_tokens_total", "LLM tokens reported by the provider.", ["model", "kind"])
+)
+RETRIES = REGISTRY.register(
+    Counter("query_to_sql_retries_total", "Retries of failed SQL, by fix kind.", ["kind"])
+)
+REQUESTS = REGISTRY.register(
+    Counter("query_to_sql_requests_total", "Answered questions.", ["outcome", "cache"])
+)
+
+
+@contextmanager
+def stage(name, histogram=STAGE_SECONDS, **attributes):
+    """
+    Times a pipeline stage into `histogram` (labelled with `attributes` and
+    the outcome) and wraps it in an OpenTelemetry span when tracing is on.
+    """
+    started = time.perf_counter()
+    outcome = "ok"
+    span_context = _tracer.start_as_current_span(name) if _tracer is not None else None
+    span = span_context.__enter__() if span_context is not None else None
+    if span is not None:
+        for key, value in attributes.items():
+            span.set_attribute(f"query_to_sql.{key}", str(value))
+    try:
+        yield span
+    except BaseException as e:
+        outcome = "error"
+        if span_context is not None:
+            span_context.__exit__(type(e), e, e.__traceback__)
+            span_context = None
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        labels = {key: value for key, value in attributes.items() if key in histogram.labelnames}
+        if "stage" in histogram.labelnames:
+            labels["stage"] = name
+        histogram.observe(elapsed, outcome=outcome, **labels)
+        sink = _stage_sink.get()
+        if sink is not None:
+            sink.append((name, elapsed, outcome))
+        if span_context is not None:
+            span_context.__exit__(None, None, None)
+
+
+@contextmanager
+def collect_stages():
+    """
+    Collects the raw stage timings of everything run inside the block,
+    including work in threads started from it.
+    """
+    timings = []
+    token = _stage_sink.set(timings)
+    try:
+        yield timings
+    finally:
+        _stage_sink.reset(token)
+
+
+def record_llm_usage(entry):
+    """
+    Counts the tokens of one DSPy LM history entry and adds them to the
+    current span. Called from `GroqLM` in the thread that made the call.
+    """
+    usage = entry.get("usage") or {}
+    model = entry.get("model", "")
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
+    if trace is not None:
+        span = trace.get_current_span()
+        span.set_attribute("llm.model", model)
+        span.set_attribute("llm.prompt_tokens", prompt_tokens)
+        span.set_attribute("llm.completion_tokens", completion_tokens)
+
+
+def stats_collector(name, documentation, get_stats, keys, kind="gauge"):
+    """
+    Exposes numeric fields of a `stats()` dict as `<name>_<field>` samples.
+    """
+
+    def collect():
+        stats = get_stats()
+        if not stats:
+            return []
+        return [
+            (f"{name}_{key}", kind, f"{documentation} ({key}).", {(): stats[key]}, ())
+            for key in keys
+            if isinstance(stats.get(key), (int, float))
+        ]
+
+    return collect
+
+
+def setup_tracing(app=None):
+    """
+    Installs an OTLP-exporting tracer provider and instruments the FastAPI
+    app when OTEL_ENABLED; the exporter reads the standard OTEL_EXPORTER_OTLP_*
+    environment variables.
+    """
+    global _tracer
+    if not OTEL_ENABLED:
+        return
+    try:
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        logger.warning(f"OpenTelemetry SDK not available, tracing disabled: {e}")
+        return
+    provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("query_to_sql")
+    if app is not None:
+        try:
+            from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+
+            FastAPIInstrumentor.instrument_app(app, excluded_urls="metrics,health")
+        except ImportError as e:
+            logger.warning(f"FastAPI instrumentation not available: {e}")
+    logger.info(f"OpenTelemetry tracing enabled for {OTEL_SERVICE_NAME}.")
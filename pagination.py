@@ -0,0 +1,193 @@
+import base64
+import hashlib
+import hmac
+import re
+import secrets
+import time
+import orjson
+from log import logger
+from config import PAGE_TOKEN_SECRET, PAGE_TOKEN_TTL_SECONDS
+
+
+# MySQL has no "OFFSET without LIMIT"; a huge LIMIT means "all remaining rows"
+# (signed 64-bit max so SQLite, used for local runs, accepts it too)
+MAX_LIMIT = 9223372036854775807
+
+if PAGE_TOKEN_SECRET:
+    _secret = PAGE_TOKEN_SECRET.encode("utf-8")
+else:
+    # Tokens then only validate on the worker that issued them
+    _secret = secrets.token_bytes(32)
+    logger.warning("PAGE_TOKEN_SECRET is not set; page tokens are worker-local.")
+
+
+# Leading optimizer hint, e.g. `SELECT /*+ MAX_EXECUTION_TIME(1000) */ ...`
+HINT_PATTERN = re.compile(r"^\s*select\s+(/\*\+.*?\*/)\s*", re.IGNORECASE | re.DOTALL)
+
+
+# String literals and quoted identifiers, kept as they are; comments other
+# than optimizer hints, dropped
+QUOTED_OR_COMMENT_PATTERN = re.compile(
+    r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"|`(?:[^`]|``)*`)"
+    r"|(--(?:[ \t][^\n]*)?$|--[ \t][^\n]*|#[^\n]*|/\*(?!\+).*?\*/)",
+    re.DOTALL | re.MULTILINE,
+)
+OUTER_CLAUSE_PATTERN = re.compile(r"[()]|\b(?:limit|order\s+by)\b", re.IGNORECASE)
+SELECT_LIST_PATTERN = re.compile(r"\s*select\s+(?:/\*\+.*?\*/\s*)?", re.IGNORECASE | re.DOTALL)
+SELECT_LIST_TOKEN_PATTERN = re.compile(r"[(),]|\bfrom\b", re.IGNORECASE)
+
+
+class InvalidPageToken(ValueError):
+    pass
+
+
+def strip_comments(sql_query):
+    """
+    Removes comments, keeping optimizer hints, so clauses appended to the
+    query can never end up inside a trailing `-- comment`.
+    """
+    return QUOTED_OR_COMMENT_PATTERN.sub(
+        lambda m: m.group(1) if m.group(1) is not None else " ", sql_query
+    ).strip()
+
+
+def _mask(sql_query):
+    """
+    The query with comments removed and quoted text blanked, for keyword scans.
+    """
+    return QUOTED_OR_COMMENT_PATTERN.sub(
+        lambda m: "''" if m.group(1) is not None else " ", sql_query
+    )
+
+
+def outer_clauses(sql_query):
+    """
+    Returns which of `limit` and `order` the outer query has, ignoring
+    subqueries, quoted text and comments.
+    """
+    found, depth = set(), 0
+    for match in OUTER_CLAUSE_PATTERN.finditer(_mask(sql_query)):
+        token = match.group(0)
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            found.add(token.split()[0].lower())
+    return found
+
+
+def select_list_size(sql_query):
+    """
+    Returns the number of columns of a SELECT, or None when it cannot be
+    told from the text (`*`, CTEs).
+    """
+    masked = _mask(sql_query)
+    start = SELECT_LIST_PATTERN.match(masked)
+    if start is None:
+        return None
+    items, depth, begin = [], 0, start.end()
+    for match in SELECT_LIST_TOKEN_PATTERN.finditer(masked, begin):
+        token = match.group(0)
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            items.append(masked[begin:match.start()].strip())
+            if token != ",":
+                break
+            begin = match.end()
+    else:
+        items.append(masked[begin:].strip())
+    if any(item == "*" or item.endswith(".*") or item.lower().endswith(" *") for item in items):
+        return None
+    return len(items)
+
+
+def needs_order(sql_query):
+    """
+    Returns whether `paginate_sql` orders the query by its columns, i.e. it
+    has no ORDER BY of its own and its columns can be counted.
+    """
+    return "order" not in outer_clauses(sql_query) and bool(select_list_size(sql_query))
+
+
+def paginate_sql(sql_query, limit=None, offset=0, order=True):
+    """
+    Restricts a SELECT to one page of rows.
+
+    Queries without their own LIMIT get LIMIT/OFFSET appended directly, which
+    keeps their ORDER BY and duplicate column names intact; queries that
+    already limit themselves are wrapped in a derived table. With `order`, a
+    query without ORDER BY is ordered by all its columns so pages never
+    overlap or skip rows; `SELECT *` without ORDER BY cannot be, and pages in
+    whatever order the database returns. A first page that may turn out to be
+    the only one can skip the sort with `order=False`.
+    """
+    sql_query = strip_comments(sql_query).rstrip(";").strip()
+    limit = MAX_LIMIT if limit is None else int(limit)
+    offset = int(offset)
+    clauses = outer_clauses(sql_query)
+    order_by = ""
+    if order and needs_order(sql_query):
+        size = select_list_size(sql_query)
+        order_by = " ORDER BY " + ", ".join(str(column) for column in range(1, size + 1))
+    if "limit" in clauses:
+        # MySQL ignores optimizer hints inside derived tables, so move it outside
+        hint = HINT_PATTERN.match(sql_query)
+        if hint:
+            sql_query = "SELECT " + sql_query[hint.end():]
+            return f"SELECT {hint.group(1)} * FROM ({sql_query}) AS _page{order_by} LIMIT {limit} OFFSET {offset}"
+        return f"SELECT * FROM ({sql_query}) AS _page{order_by} LIMIT {limit} OFFSET {offset}"
+    return f"{sql_query}{order_by} LIMIT {limit} OFFSET {offset}"
+
+
+def _sign(payload):
+    return hmac.new(_secret, payload, hashlib.sha256).digest()
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def encode_page_token(sql_query, offset, page_size, database=None):
+    """
+    Returns an opaque, signed token for fetching the next page of a validated query.
+
+    The token carries the SQL itself, so the signature is what stops clients
+    from submitting arbitrary statements through the paging endpoint. It also
+    names the database the query ran against.
+    """
+    payload = orjson.dumps(
+        {
+            "sql": sql_query,
+            "offset": int(offset),
+            "page_size": int(page_size),
+            "database": database,
+            "exp": time.time() + PAGE_TOKEN_TTL_SECONDS,
+        }
+    )
+    return f"{_b64(payload)}.{_b64(_sign(payload))}"
+
+
+def decode_page_token(token):
+    """
+    Verifies a page token and returns `(sql, offset, page_size, database)`.
+    """
+    try:
+        payload_text, signature_text = token.split(".", 1)
+        payload = _unb64(payload_text)
+        signature = _unb64(signature_text)
+    except Exception:
+        raise InvalidPageToken("Malformed page token.")
+    if not hmac.compare_digest(signature, _sign(payload)):
+        raise InvalidPageToken("Invalid page token signature.")
+    data = orjson.loads(payload)
+    if data["exp"] < time.time():
+        raise InvalidPageToken("Page token has expired.")
+    return data["sql"], data["offset"], data["page_size"], data.get("database")
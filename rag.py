@@ -1,155 +1,265 @@
-import chromadb
-from chromadb.config import Settings
-from sentence_transformers import SentenceTransformer
+import re
+import threading
 from log import logger
+from config import (
+    RAG_PERSIST_DIR,
+    RAG_TOP_K,
+    RAG_TOKEN_BUDGET,
+    RAG_FK_EXPANSION,
+)
+from embeddings import get_embedding_service
 
 
+# ChromaDB client, embedding model and collection are created on first use so
+# that importing this module does not load chromadb or the embedding model.
+SCHEMA_COLLECTION_NAME = "schema_tables"
 
-# Initialize ChromaDB client and embedding model
-client = chromadb.Client()
+_client = None
+_schema_indexes = {}
+_tokenizer = None
+_lock = threading.RLock()
+
+
+def get_client():
+    """
+    Returns the ChromaDB client, persisted under RAG_PERSIST_DIR so the index
+    survives restarts and only changed tables are re-embedded.
+    """
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                import chromadb
+
+                _client = chromadb.PersistentClient(path=RAG_PERSIST_DIR)
+    return _client
 
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
 
 # Define a class to wrap the embedding function
 class ChromaEmbeddingFunction:
     def __call__(self, input):
         try:
             # Ensure the input is a list of strings and encode it
-            return embedding_model.encode(input)
+            return get_embedding_service().encode(list(input))
         except Exception as e:
             logger.error(f"Error in encoding input: {e}")
             raise
 
-# Create an instance of the embedding function class
-embedding_function = ChromaEmbeddingFunction()
 
-# Create ChromaDB collection for schema metadata
-try:
-    schema_collection = client.create_collection(
-        name="schema_metadata",
-        embedding_function=embedding_function,  # Pass the embedding function class
+def encode(texts):
+    """
+    Encodes a list of texts into unit-length embeddings with the shared
+    embedding service.
+    """
+    return get_embedding_service().encode(texts)
+
+
+def count_tokens(text):
+    """
+    Counts prompt tokens with tiktoken, or estimates four characters per token.
+    """
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except Exception:
+            _tokenizer = False
+    if _tokenizer:
+        return len(_tokenizer.encode(text))
+    return len(text) // 4 + 1
+
+
+def describe_table(table):
+    """
+    Builds the document embedded for a table: the compact definition plus its
+    identifiers split into words, which matches natural-language questions better.
+    """
+    words = " ".join(
+        re.sub(r"[_\W]+", " ", name) for name in [table.name, *table.column_names]
     )
-    logger.info("ChromaDB collection created successfully.")
-except Exception as e:
-    logger.error(f"Error creating ChromaDB collection: {e}")
-    raise
+    text = f"{table.render()}\n{words}"
+    if table.comment:
+        text += f"\n{table.comment}"
+    return text
 
-def store_schema_in_chromadb(schema_data):
-    try:
-        # Prepare schema data for ChromaDB
-        for schema in schema_data:
+
+class SchemaSlice:
+    def __init__(self, tables, text, tokens, retrieved):
+        # Table names included in the slice, most relevant first
+        self.tables = tables
+        self.text = text
+        self.tokens = tokens
+        # False when the whole schema fitted the budget and no retrieval was needed
+        self.retrieved = retrieved
+
+
+class SchemaIndex:
+    """
+    Vector index with one document per table, used to send each question only
+    the part of the schema it needs.
+    """
+
+    def __init__(self, collection_name=SCHEMA_COLLECTION_NAME):
+        self.collection_name = collection_name
+        self.collection = None
+        self.synced_version = None
+        self._sync_lock = threading.Lock()
+
+    def _get_collection(self):
+        if self.collection is None:
             try:
-                # Generate embedding for schema description
-                schema_embedding = embedding_model.encode([schema['description']])[0]
-                logger.info(f"Generated embedding for schema {schema['id']}: {schema_embedding}")  # Log the generated embedding
-
-                metadata = {
-                    'columns': 'id, name, email, age',  # Use a single string that describes the columns
-                    'table': 'users'  # Add table name to match later
-                }
-
-                schema_collection.add(
-                    documents=[schema['description']],  # Schema description or relevant info
-                    metadatas=[metadata],  # Correct metadata format
-                    ids=[str(schema['id'])],  # Unique ID for each record
-                    embeddings=[schema_embedding]  # Use the actual generated embedding
+                self.collection = get_client().get_or_create_collection(
+                    name=self.collection_name,
+                    embedding_function=ChromaEmbeddingFunction(),
+                    metadata={"hnsw:space": "cosine"},
                 )
-                logger.info(f"Schema {schema['id']} stored successfully.")
+                logger.info("ChromaDB collection created successfully.")
             except Exception as e:
-                logger.error(f"Error processing schema {schema['id']}: {e}")
-    except Exception as e:
-        logger.error(f"Error storing schema in ChromaDB: {e}")
-        raise
+                logger.error(f"Error creating ChromaDB collection: {e}")
+                raise
+        return self.collection
 
+    def sync(self, snapshot):
+        """
+        Brings the index in line with a schema snapshot, re-embedding only tables
+        whose fingerprint changed (in one batch) and deleting dropped tables.
+        """
+        if self.synced_version == snapshot.version:
+            return
+        with self._sync_lock:
+            if self.synced_version == snapshot.version:
+                return
+            collection = self._get_collection()
+            stored = collection.get(include=["metadatas"])
+            indexed = {
+                id_: (metadata or {}).get("fingerprint")
+                for id_, metadata in zip(stored["ids"], stored["metadatas"])
+            }
+            changed = [
+                table
+                for name, table in snapshot.tables.items()
+                if indexed.get(name) != table.fingerprint
+            ]
+            removed = [name for name in indexed if name not in snapshot.tables]
 
-# Example schema data (the descriptions will be used to generate the embeddings)
-schema_data = [
-    {
-        'id': 1,
-        'column_name': 'id',
-        'data_type': 'INTEGER',
-        'description': 'Unique identifier for each row',
-    },
-    {
-        'id': 2,
-        'column_name': 'name',
-        'data_type': 'VARCHAR',
-        'description': 'Name of the user',
-    },
-    # Add more schema entries as needed
-]
+            if changed:
+                documents = [describe_table(table) for table in changed]
+                embeddings = encode(documents)
+                collection.upsert(
+                    ids=[table.name for table in changed],
+                    documents=documents,
+                    embeddings=[list(map(float, e)) for e in embeddings],
+                    metadatas=[
+                        {"table": table.name, "fingerprint": table.fingerprint}
+                        for table in changed
+                    ],
+                )
+            if removed:
+                collection.delete(ids=removed)
+            logger.info(
+                f"Schema index synced to {snapshot.version}: "
+                f"{len(changed)} tables embedded, {len(removed)} removed."
+            )
+            self.synced_version = snapshot.version
 
-store_schema_in_chromadb(schema_data)
+    def retrieve(self, question, snapshot, top_k=RAG_TOP_K, token_budget=RAG_TOKEN_BUDGET):
+        """
+        Returns the schema slice for a question.
 
+        The nearest `top_k` tables are expanded with their foreign-key neighbours
+        (tables they reference or that reference them) and rendered in order of
+        relevance until `token_budget` is reached.
+        """
+        full_tokens = count_tokens(snapshot.text)
+        if not snapshot.tables or full_tokens <= token_budget:
+            return SchemaSlice(list(snapshot.tables), snapshot.text, full_tokens, False)
 
-# Function to retrieve schema based on query
-def retrieve_schema_from_chromadb(query):
-    try:
-        query_embedding = embedding_model.encode([query])[0]
-        results = schema_collection.query(
-            query_embeddings=[query_embedding],
-            n_results=1
+        self.sync(snapshot)
+        collection = self._get_collection()
+        query_embedding = encode([question])[0]
+        results = collection.query(
+            query_embeddings=[list(map(float, query_embedding))],
+            n_results=min(top_k, len(snapshot.tables)),
         )
-        return results['metadatas'][0]
-    except Exception as e:
-        logger.error(f"Error retrieving schema for query '{query}': {e}")
-        raise
-
+        hits = [name for name in results["ids"][0] if name in snapshot.tables]
 
-def generate_sql_from_query(query, params=None):
-    schema_info = schema_collection.get()
+        ordered = list(hits)
+        if RAG_FK_EXPANSION:
+            for name in hits:
+                for neighbour in self._neighbours(name, snapshot):
+                    if neighbour not in ordered:
+                        ordered.append(neighbour)
 
-    for metadata in schema_info['metadatas']:
-        if isinstance(metadata, dict):
-            if 'table' in metadata and 'users' in metadata['table']:
-                # Split columns into a list
-                columns = metadata['columns'].split(", ")
-                
-                # Initialize where clause as an empty list
-                where_clause = []
-                
-                # Loop through the query to handle conditions dynamically
-                if "over 30" in query:
-                    where_clause.append(f"age > ?")
-                else:
-                    # Add a condition for each column
-                    where_clause = [f"{col} = ?" for col in columns]
-                
-                # Join conditions with 'AND'
-                where_clause = " AND ".join(where_clause)
+        selected, lines, used = [], [], 0
+        for name in ordered:
+            line = snapshot.tables[name].render()
+            tokens = count_tokens(line)
+            if selected and used + tokens > token_budget:
+                continue
+            selected.append(name)
+            lines.append(line)
+            used += tokens
+        logger.debug(f"Schema slice for '{question}': {selected} ({used} tokens)")
+        return SchemaSlice(selected, "\n".join(lines), used, True)
 
-                # Construct the SQL query
-                sql_query = f"SELECT * FROM {metadata['table']} WHERE {where_clause}"
+    @staticmethod
+    def _neighbours(name, snapshot):
+        table = snapshot.tables[name]
+        neighbours = [ref_table for _, ref_table, _ in table.foreign_keys]
+        for other in snapshot.tables.values():
+            if any(ref_table == name for _, ref_table, _ in other.foreign_keys):
+                neighbours.append(other.name)
+        return [n for n in neighbours if n in snapshot.tables and n != name]
 
-                # Replace placeholders with params
-                if params:
-                    sql_query = sql_query.replace("?", "%s")  # For PostgreSQL-style placeholders
-                    return sql_query, params  # Return SQL with params for execution
 
-    return None, None  # Return None if no matching schema is found
+def get_schema_index(database=None):
+    """
+    Returns the process-wide schema index of a database; each database other
+    than the default one has its own collection.
+    """
+    index = _schema_indexes.get(database)
+    if index is None:
+        with _lock:
+            index = _schema_indexes.get(database)
+            if index is None:
+                name = SCHEMA_COLLECTION_NAME
+                if database:
+                    name = f"{name}_{re.sub(r'[^A-Za-z0-9_-]', '_', database)}"[:63]
+                index = _schema_indexes[database] = SchemaIndex(name)
+    return index
 
 
+def store_schema_in_chromadb(snapshot):
+    try:
+        get_schema_index().sync(snapshot)
+    except Exception as e:
+        logger.error(f"Error storing schema in ChromaDB: {e}")
+        raise
 
-def generate_dynamic_sql(query, params=None):
-    sql_query = generate_sql_from_query(query, params)
-    if sql_query:
-        return sql_query
-    else:
-        return "Query could not be generated"
-
-def handle_user_query(query, params=None):
-    sql_query = generate_dynamic_sql(query, params)
-    return sql_query
 
+# Function to retrieve schema based on query
+def retrieve_schema_from_chromadb(query, snapshot):
+    try:
+        return get_schema_index().retrieve(query, snapshot)
+    except Exception as e:
+        logger.error(f"Error retrieving schema for query '{query}': {e}")
+        raise
 
 
 if __name__ == "__main__":
-    # Example usage:
+    # Example usage: index the live schema and print the slice for a question
+    import asyncio
+    import sys
+    from schema import SchemaProvider
+
     try:
-        query = "Show me all employees and their departments"
-        params = [30]  # Add actual values here for placeholders
-        sql, final_params = handle_user_query(query, params)
-        print("Generated SQL:", sql)
-        print("With parameters:", final_params)
+        query = " ".join(sys.argv[1:]) or "Show me all employees and their departments"
+        snapshot = asyncio.run(SchemaProvider().refresh())
+        store_schema_in_chromadb(snapshot)
+        schema_slice = retrieve_schema_from_chromadb(query, snapshot)
+        print(f"Tables: {schema_slice.tables} ({schema_slice.tokens} tokens)")
+        print(schema_slice.text)
     except Exception as e:
         logger.error(f"Error during execution: {e}")
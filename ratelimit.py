@@ -0,0 +1,313 @@
+import asyncio
+import random
+import threading
+import time
+from log import logger
+from config import (
+    RATE_LIMIT_BACKEND,
+    RATE_LIMIT_REDIS_URL,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_TOKENS_PER_MINUTE,
+    RATE_LIMIT_MAX_CONCURRENCY,
+    RATE_LIMIT_MIN_CONCURRENCY,
+    RATE_LIMIT_MAX_RETRIES,
+    RATE_LIMIT_BACKOFF_SECONDS,
+    RATE_LIMIT_MAX_BACKOFF_SECONDS,
+)
+
+
+_rate_limiter = None
+_lock = threading.Lock()
+
+
+class InProcessBackend:
+    """
+    Token buckets held in this process. Every process gets the full quota, so
+    with several workers use the redis backend, or divide the quotas by the
+    number of workers.
+    """
+
+    def __init__(self):
+        self.buckets = {}
+        self.blocked_until = {}
+        self._lock = threading.Lock()
+
+    async def take(self, key, limits):
+        """
+        Takes `amount` from every `(capacity, per_second, amount)` bucket of
+        `key` when all of them have enough. Returns 0 on success, otherwise the
+        seconds to wait before trying again (nothing is taken).
+        """
+        with self._lock:
+            now = time.monotonic()
+            blocked = self.blocked_until.get(key, 0.0) - now
+            if blocked > 0:
+                return blocked
+            levels, wait = [], 0.0
+            for index, (capacity, per_second, amount) in enumerate(limits):
+                level, stamp = self.buckets.get((key, index), (capacity, now))
+                level = min(capacity, level + (now - stamp) * per_second)
+                levels.append(level)
+                if level < amount:
+                    wait = max(wait, (amount - level) / per_second)
+            if wait > 0:
+                return wait
+            for index, (_, _, amount) in enumerate(limits):
+                self.buckets[(key, index)] = (levels[index] - amount, now)
+            return 0.0
+
+    async def block(self, key, seconds):
+        """
+        Stops every caller of `key` until `seconds` from now (a Retry-After).
+        """
+        with self._lock:
+            until = time.monotonic() + seconds
+            self.blocked_until[key] = max(self.blocked_until.get(key, 0.0), until)
+
+
+# Buckets live in one hash per key; the server clock is used so that workers
+# on different hosts agree on refill times.
+TAKE_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local blocked = tonumber(redis.call('HGET', KEYS[1], 'blocked_until') or '0')
+if blocked > now then return tostring(blocked - now) end
+local count = tonumber(ARGV[1])
+local levels = {}
+local wait = 0
+for i = 1, count do
+  local capacity = tonumber(ARGV[i * 3 - 1])
+  local per_second = tonumber(ARGV[i * 3])
+  local amount = tonumber(ARGV[i * 3 + 1])
+  local level = tonumber(redis.call('HGET', KEYS[1], 'level' .. i) or capacity)
+  local stamp = tonumber(redis.call('HGET', KEYS[1], 'stamp' .. i) or now)
+  level = math.min(capacity, level + (now - stamp) * per_second)
+  levels[i] = level
+  if level < amount then wait = math.max(wait, (amount - level) / per_second) end
+end
+if wait > 0 then return tostring(wait) end
+for i = 1, count do
+  redis.call('HSET', KEYS[1], 'level' .. i, levels[i] - tonumber(ARGV[i * 3 + 1]), 'stamp' .. i, now)
+end
+redis.call('EXPIRE', KEYS[1], 300)
+return '0'
+"""
+
+BLOCK_SCRIPT = """
+local t = redis.call('TIME')
+local until_ = tonumber(t[1]) + tonumber(t[2]) / 1000000 + tonumber(ARGV[1])
+local current = tonumber(redis.call('HGET', KEYS[1], 'blocked_until') or '0')
+if until_ > current then redis.call('HSET', KEYS[1], 'blocked_until', until_) end
+redis.call('EXPIRE', KEYS[1], 300)
+return 1
+"""
+
+
+class RedisBackend:
+    """
+    Token buckets in Redis, updated atomically by Lua scripts, so that every
+    gunicorn worker draws from the same per-model quota.
+    """
+
+    def __init__(self, url=RATE_LIMIT_REDIS_URL, prefix="query_to_sql:ratelimit:"):
+        import redis.asyncio as aioredis
+
+        self.client = aioredis.from_url(url)
+        self.prefix = prefix
+        self._take = self.client.register_script(TAKE_SCRIPT)
+        self._block = self.client.register_script(BLOCK_SCRIPT)
+
+    async def take(self, key, limits):
+        args = [len(limits)]
+        for capacity, per_second, amount in limits:
+            args += [capacity, per_second, amount]
+        return float(await self._take(keys=[self.prefix + key], args=args))
+
+    async def block(self, key, seconds):
+        await self._block(keys=[self.prefix + key], args=[seconds])
+
+
+class AdaptiveConcurrency:
+    """
+    AIMD cap on concurrent calls: +1/limit per success, halved on a rate-limit
+    error, so the worker settles just below the point where the API throttles.
+    """
+
+    def __init__(self, max_limit=RATE_LIMIT_MAX_CONCURRENCY, min_limit=RATE_LIMIT_MIN_CONCURRENCY):
+        self.max_limit = max_limit
+        self.min_limit = max(1, min_limit)
+        self.limit = float(max_limit)
+        self.inflight = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.inflight < int(self.limit))
+            self.inflight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.inflight -= 1
+            self._condition.notify_all()
+
+    def on_success(self):
+        self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+    def on_throttled(self):
+        self.limit = max(self.min_limit, self.limit / 2)
+
+
+def is_rate_limit_error(error):
+    import litellm
+
+    return isinstance(error, litellm.RateLimitError) or getattr(error, "status_code", None) == 429
+
+
+def retry_after_seconds(error):
+    """
+    Reads the Retry-After header of a rate-limit error, if the API sent one.
+    """
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or getattr(error, "litellm_response_headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return max(0.0, float(value)) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def estimate_tokens(texts, max_tokens=1000):
+    """
+    Conservative token cost of a call: prompt text at ~4 characters per token
+    plus the completion budget.
+    """
+    return sum(len(str(text)) for text in texts) // 4 + max_tokens
+
+
+class RateLimiter:
+    """
+    Runs blocking LLM calls in a thread under per-model limits.
+
+    Before a call, requests/minute and tokens/minute buckets are drawn from
+    (waiting with `asyncio.sleep` when empty), then a slot of the adaptive
+    concurrency cap is taken. Rate-limit errors block the model for the
+    Retry-After time, or an exponential backoff with full jitter, on every
+    worker sharing the backend, and the call is retried.
+    """
+
+    def __init__(
+        self,
+        backend=None,
+        requests_per_minute=LLM_REQUESTS_PER_MINUTE,
+        tokens_per_minute=LLM_TOKENS_PER_MINUTE,
+        max_retries=RATE_LIMIT_MAX_RETRIES,
+        backoff_seconds=RATE_LIMIT_BACKOFF_SECONDS,
+        max_backoff_seconds=RATE_LIMIT_MAX_BACKOFF_SECONDS,
+    ):
+        self.backend = backend or InProcessBackend()
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.concurrency = {}
+        self.counters = {"calls": 0, "throttled": 0, "waited_seconds": 0.0}
+
+    def _limits(self, tokens):
+        limits = []
+        if self.requests_per_minute > 0:
+            limits.append((self.requests_per_minute, self.requests_per_minute / 60, 1))
+        if self.tokens_per_minute > 0:
+            # A call larger than the whole bucket would otherwise never fit
+            amount = min(tokens, self.tokens_per_minute)
+            limits.append((self.tokens_per_minute, self.tokens_per_minute / 60, amount))
+        return limits
+
+    async def acquire(self, key, tokens):
+        """
+        Waits until the buckets of `key` allow a call costing `tokens`.
+        """
+        limits = self._limits(tokens)
+        if not limits:
+            return
+        while True:
+            wait = await self.backend.take(key, limits)
+            if wait <= 0:
+                return
+            self.counters["waited_seconds"] += wait
+            await asyncio.sleep(wait + random.uniform(0, 0.05))
+
+    def _concurrency(self, key):
+        if key not in self.concurrency:
+            self.concurrency[key] = AdaptiveConcurrency()
+        return self.concurrency[key]
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.max_backoff_seconds, self.backoff_seconds * 2 ** attempt))
+
+    async def call(self, key, tokens, func, *args, **kwargs):
+        """
+        Runs `func(*args, **kwargs)` in a worker thread once the limits of
+        `key` (the model name) allow it.
+        """
+        return await self.run(key, tokens, lambda: asyncio.to_thread(func, *args, **kwargs))
+
+    async def run(self, key, tokens, start, retryable=None):
+        """
+        Like `call`, for a call that is already async: `start()` returns a new
+        awaitable for each attempt. A failed attempt is only retried while
+        `retryable()` (when given) is true, e.g. before a streamed call has
+        sent its first chunk.
+        """
+        concurrency = self._concurrency(key)
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(key, tokens)
+            async with concurrency:
+                try:
+                    self.counters["calls"] += 1
+                    result = await start()
+                except Exception as e:
+                    if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                        raise
+                    if retryable is not None and not retryable():
+                        raise
+                    error = e
+                else:
+                    concurrency.on_success()
+                    return result
+            self.counters["throttled"] += 1
+            concurrency.on_throttled()
+            delay = retry_after_seconds(error)
+            # Jitter spreads the retries of all waiting callers
+            delay = delay + random.uniform(0, 1) if delay is not None else self.backoff(attempt)
+            logger.warning(
+                f"Rate limited by {key}; retrying in {delay:.1f}s "
+                f"(concurrency cap {concurrency.limit:.1f})"
+            )
+            await self.backend.block(key, delay)
+
+    def stats(self):
+        return {
+            **self.counters,
+            "requests_per_minute": self.requests_per_minute,
+            "tokens_per_minute": self.tokens_per_minute,
+            "concurrency": {
+                key: {"limit": round(c.limit, 2), "inflight": c.inflight}
+                for key, c in self.concurrency.items()
+            },
+        }
+
+
+def get_rate_limiter():
+    """
+    Returns the process-wide rate limiter on the configured backend.
+    """
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _lock:
+            if _rate_limiter is None:
+                backend = RedisBackend() if RATE_LIMIT_BACKEND == "redis" else InProcessBackend()
+                _rate_limiter = RateLimiter(backend)
+                logger.info(f"LLM rate limiter using the {RATE_LIMIT_BACKEND} backend.")
+    return _rate_limiter
@@ -0,0 +1,173 @@
+import re
+from log import logger
+from config import LOCAL_REPAIR_MAX_EDITS
+
+
+# MySQL server error codes handled locally
+ER_BAD_FIELD_ERROR = 1054
+ER_NO_SUCH_TABLE = 1146
+
+UNKNOWN_COLUMN_PATTERNS = [
+    re.compile(r"Unknown column '([^']+)'"),
+    re.compile(r"no such column: ([\w.]+)"),
+]
+UNKNOWN_TABLE_PATTERNS = [
+    re.compile(r"Table '([^']+)' doesn't exist"),
+    re.compile(r"no such table: ([\w.]+)"),
+]
+
+# Quoted string literals, which must never be rewritten
+LITERAL_PATTERN = re.compile(r"('(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.)*\")")
+TABLE_REFERENCE_PATTERN = re.compile(
+    r"\b(?:from|join)\s+`?(\w+)`?(?:\s+(?:as\s+)?`?(?!(?:on|where|join|left|right|inner|outer|cross|group|order|limit|using)\b)(\w+)`?)?",
+    re.IGNORECASE,
+)
+
+
+def mysql_error_code(error):
+    """
+    Returns the MySQL error code of a (SQLAlchemy-wrapped) driver exception.
+    """
+    orig = getattr(error, "orig", error)
+    args = getattr(orig, "args", ())
+    if args and isinstance(args[0], int):
+        return args[0]
+    return None
+
+
+def _match(patterns, message):
+    for pattern in patterns:
+        found = pattern.search(message)
+        if found:
+            return found.group(1)
+    return None
+
+
+def table_aliases(sql_query):
+    """
+    Returns `{alias_or_name: table}` for the tables referenced in FROM/JOIN.
+    """
+    aliases = {}
+    for table, alias in TABLE_REFERENCE_PATTERN.findall(sql_query):
+        aliases[table] = table
+        if alias:
+            aliases[alias] = table
+    return aliases
+
+
+def replace_identifier(sql_query, old, new):
+    """
+    Replaces an identifier (optionally back-quoted) outside string literals.
+    """
+    pattern = re.compile(rf"(?<![\w.])`?{re.escape(old)}`?(?!\w)")
+    parts = LITERAL_PATTERN.split(sql_query)
+    for index in range(0, len(parts), 2):
+        parts[index] = pattern.sub(new, parts[index])
+    return "".join(parts)
+
+
+def edit_distance(a, b):
+    """
+    Levenshtein distance between two strings.
+    """
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def _is_typo(words, other, max_edits):
+    """
+    Whether `other` is `words` with at most `max_edits` typing errors in one
+    word; short words allow fewer, since they are all a few edits apart.
+    """
+    if len(words) != len(other):
+        return False
+    different = [(a, b) for a, b in zip(words, other) if a != b]
+    if len(different) != 1:
+        return False
+    word, candidate = different[0]
+    return edit_distance(word, candidate) <= min(max_edits, len(word) // 3)
+
+
+def closest(name, candidates, max_edits=LOCAL_REPAIR_MAX_EDITS):
+    """
+    Returns the candidate `name` unambiguously means, or None.
+
+    Accepted are, in order: a case-only difference; the only candidate with
+    the same `_`-separated words but for a typing error in one of them
+    (`employe_name` -> `employee_name`); the only candidate that is a leading
+    or trailing part of a snake_case name (`product_sales` -> `sales`).
+    Anything looser (`employee_name` vs `employee_id`) is left to the LLM: a
+    wrong column that runs returns wrong data without an error.
+    """
+    lowered = {candidate.lower(): candidate for candidate in candidates}
+    name = name.lower()
+    if name in lowered:
+        return lowered[name]
+    words = name.split("_")
+    typos = [candidate for key, candidate in lowered.items() if _is_typo(words, key.split("_"), max_edits)]
+    if len(typos) == 1:
+        return typos[0]
+    if typos:
+        return None
+    parts = name.split("_")
+    affixes = {"_".join(parts[i:]) for i in range(1, len(parts))}
+    affixes |= {"_".join(parts[:i]) for i in range(1, len(parts))}
+    contained = [lowered[a] for a in affixes if a in lowered]
+    return contained[0] if len(contained) == 1 else None
+
+
+def _repair_column(sql_query, identifier, catalog):
+    qualifier, _, column = identifier.rpartition(".")
+    aliases = table_aliases(sql_query)
+    if qualifier:
+        table = aliases.get(qualifier)
+        candidates = catalog.get(table, [])
+    else:
+        candidates = [
+            col for table in set(aliases.values()) for col in catalog.get(table, [])
+        ]
+    match = closest(column, candidates)
+    if match is None or match == column:
+        return None
+    old = identifier if qualifier else column
+    new = f"{qualifier}.{match}" if qualifier else match
+    return replace_identifier(sql_query, old, new), f"column `{old}` -> `{new}`"
+
+
+def _repair_table(sql_query, identifier, catalog):
+    table = identifier.rpartition(".")[2]
+    match = closest(table, catalog.keys())
+    if match is None or match == table:
+        return None
+    return replace_identifier(sql_query, table, match), f"table `{table}` -> `{match}`"
+
+
+def repair_sql(sql_query, error, catalog):
+    """
+    Tries to fix an unknown table or column by matching it against the schema
+    catalog (`{table: [columns]}`); see `closest` for what counts as a match.
+
+    Returns `(fixed_sql, description)`, or None when the error is not one the
+    local fixer understands or no confident match exists; the caller then falls
+    back to the LLM error agents.
+    """
+    if not catalog:
+        return None
+    message = str(error)
+    code = mysql_error_code(error)
+    repaired = None
+    column = _match(UNKNOWN_COLUMN_PATTERNS, message)
+    if column and code in (None, ER_BAD_FIELD_ERROR):
+        repaired = _repair_column(sql_query, column, catalog)
+    table = _match(UNKNOWN_TABLE_PATTERNS, message)
+    if repaired is None and table and code in (None, ER_NO_SUCH_TABLE):
+        repaired = _repair_table(sql_query, table, catalog)
+    if repaired is not None and repaired[0] != sql_query:
+        logger.info(f"Locally repaired SQL: {repaired[1]}")
+        return repaired
+    return None
@@ -0,0 +1,284 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import pyarrow as pa
+from sqlalchemy import text
+
+from log import logger
+from config import (
+    RESULT_CACHE_MAX_BYTES,
+    RESULT_CACHE_MAX_ENTRY_BYTES,
+    RESULT_CACHE_TTL_SECONDS,
+    RESULT_CACHE_TABLE_TTLS,
+    RESULT_CACHE_POLL_SECONDS,
+)
+from columnar import table_to_ipc
+from db import get_engine
+from repair import LITERAL_PATTERN, replace_identifier
+
+
+# MySQL 8 caches INFORMATION_SCHEMA table statistics for a day by default
+STATS_EXPIRY_SQL = text("SET SESSION information_schema_stats_expiry = 0")
+UPDATE_TIMES_SQL = text(
+    """
+    SELECT TABLE_NAME, UPDATE_TIME
+    FROM INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_SCHEMA = DATABASE()
+    """
+)
+
+
+# A table name, optionally schema-qualified (`db.sales`); captures the table
+TABLE_NAME = r"`?(?:\w+`?\.`?)?(\w+)`?"
+ALIAS = r"(?:\s+(?:as\s+)?`?(?!(?:on|where|join|left|right|inner|outer|cross|group|order|limit|using|having|union|window)\b)(\w+)`?)?"
+# The first FROM/JOIN table, and a further table of a comma-separated FROM
+# list (`FROM a x, b y`)
+TABLE_REFERENCE_PATTERN = re.compile(r"\b(?:from|join)\s+" + TABLE_NAME + ALIAS, re.IGNORECASE)
+COMMA_REFERENCE_PATTERN = re.compile(r"\s*,\s*" + TABLE_NAME + ALIAS, re.IGNORECASE)
+# Keywords and common functions the key folds to lower case; every other word
+# is an identifier and keeps its case (`Sales` and `sales` may be two tables)
+SQL_KEYWORDS = frozenset(
+    """
+    select distinct from where and or not in is null like between exists as on join
+    inner left right full outer cross natural using group by having order asc desc
+    limit offset union all intersect except with recursive case when then else end
+    over partition rows range preceding following current row unbounded interval
+    true false count sum avg min max coalesce ifnull nullif cast convert concat
+    lower upper trim substring round floor ceil abs date year month day extract
+    date_format now current_date rank dense_rank row_number lag lead if signed
+    unsigned decimal char varchar
+    """.split()
+)
+WORD_PATTERN = re.compile(r"\b[a-z_]\w*\b", re.IGNORECASE)
+
+
+def table_references(sql_query):
+    """
+    Returns `{alias_or_name: table}` for FROM/JOIN tables, comma-separated FROM
+    lists included (the table of `db.sales` is `sales`), or None when a FROM
+    list has a member that is not a plain table (`FROM a, (SELECT ...) b`) and
+    the tables cannot all be named.
+    """
+    aliases = {}
+    masked = LITERAL_PATTERN.sub(lambda m: "''", sql_query)
+    for match in TABLE_REFERENCE_PATTERN.finditer(masked):
+        references = [match]
+        while True:
+            match = COMMA_REFERENCE_PATTERN.match(masked, match.end())
+            if match is None:
+                break
+            references.append(match)
+        if re.match(r"\s*,", masked[references[-1].end():]):
+            return None
+        for reference in references:
+            table, alias = reference.groups()
+            aliases[table] = table
+            if alias:
+                aliases[alias] = table
+    return aliases
+
+
+def normalize_sql(sql_query):
+    """
+    Returns `(key, tables)` for a query.
+
+    The key ignores keyword case, whitespace, back-quotes, `AS` before table
+    aliases and the alias names themselves (renamed `_t0`, `_t1`, ... in order
+    of appearance); identifiers keep their case and string and number literals
+    are kept as written, so queries with different filters never share a key.
+    `tables` are the lower-cased tables the query reads, or None when they
+    cannot all be resolved and the result must not be cached.
+    """
+    sql_query = sql_query.strip().rstrip(";").strip()
+    aliases = table_references(sql_query)
+    if aliases is None:
+        return sql_query, None
+    tables = sorted({table.lower() for table in aliases.values()})
+    renamed = [alias for alias, table in aliases.items() if alias != table]
+    for index, alias in enumerate(renamed):
+        sql_query = replace_identifier(sql_query, alias, f"_t{index}")
+    sql_query = re.sub(
+        r"(\bfrom|\bjoin|,)(\s*[`\w.]+)\s+as\s+(_t\d+)\b", r"\1\2 \3", sql_query, flags=re.IGNORECASE
+    )
+
+    parts = LITERAL_PATTERN.split(sql_query)
+    for index in range(0, len(parts), 2):
+        part = WORD_PATTERN.sub(
+            lambda m: m.group(0).lower() if m.group(0).lower() in SQL_KEYWORDS else m.group(0),
+            parts[index].replace("`", ""),
+        )
+        part = re.sub(r"\s+", " ", part)
+        parts[index] = re.sub(r"\s*([,()=<>+*/-])\s*", r"\1", part)
+    return "".join(parts).strip(), tables
+
+
+class CachedResult:
+    def __init__(self, key, payload, tables, expires_at, num_rows):
+        self.key = key
+        # Arrow IPC stream bytes
+        self.payload = payload
+        self.tables = tables
+        self.expires_at = expires_at
+        self.num_rows = num_rows
+
+    @property
+    def size(self):
+        return len(self.payload)
+
+
+class ResultCache:
+    """
+    Size-bounded LRU cache of query results, stored as Arrow IPC bytes.
+
+    Entries expire after their TTL (the smallest of the per-table TTLs of the
+    tables they read), and on MySQL every entry reading a table is dropped as
+    soon as polling sees that table's `UPDATE_TIME` change.
+    """
+
+    def __init__(
+        self,
+        engine=None,
+        max_bytes=RESULT_CACHE_MAX_BYTES,
+        max_entry_bytes=RESULT_CACHE_MAX_ENTRY_BYTES,
+        ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+        table_ttls=RESULT_CACHE_TABLE_TTLS,
+        poll_seconds=RESULT_CACHE_POLL_SECONDS,
+    ):
+        self.engine = engine
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl_seconds = ttl_seconds
+        self.table_ttls = {name.lower(): float(ttl) for name, ttl in table_ttls.items()}
+        self.poll_seconds = poll_seconds
+        self.entries = OrderedDict()
+        self.by_table = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.update_times = {}
+        self.last_polled = 0.0
+        self._polling = False
+        self.lock = threading.Lock()
+
+    def _ttl(self, tables):
+        return min((self.table_ttls.get(t, self.ttl_seconds) for t in tables), default=self.ttl_seconds)
+
+    def _remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.bytes -= entry.size
+        for table in entry.tables:
+            keys = self.by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_table[table]
+
+    def get(self, sql_query):
+        """
+        Returns the cached `pyarrow.Table` of a query, or None.
+        """
+        key, _ = normalize_sql(sql_query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry.expires_at <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        return pa.ipc.open_stream(entry.payload).read_all()
+
+    def put(self, sql_query, table):
+        """
+        Stores a result unless it is larger than `max_entry_bytes` or the
+        tables it reads (and so its invalidation) cannot be resolved.
+        """
+        key, tables = normalize_sql(sql_query)
+        if tables is None:
+            logger.debug("Result not cached: its tables could not all be resolved.")
+            return
+        payload = table_to_ipc(table)
+        if len(payload) > self.max_entry_bytes:
+            logger.debug(f"Result of {len(payload)} bytes is too large to cache.")
+            return
+        entry = CachedResult(
+            key, payload, tables, time.monotonic() + self._ttl(tables), table.num_rows
+        )
+        with self.lock:
+            self._remove(key)
+            self.entries[key] = entry
+            self.bytes += entry.size
+            for name in tables:
+                self.by_table.setdefault(name, set()).add(key)
+            while self.bytes > self.max_bytes and self.entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def invalidate_table(self, table_name):
+        """
+        Drops every entry that reads `table_name`; returns how many were dropped.
+        """
+        with self.lock:
+            keys = list(self.by_table.get(table_name.lower(), ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+        if keys:
+            logger.info(f"Result cache: {len(keys)} entries invalidated by a change to {table_name}.")
+        return len(keys)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.by_table.clear()
+            self.bytes = 0
+
+    async def poll(self):
+        """
+        Invalidates tables whose `UPDATE_TIME` changed since the last poll.
+
+        Runs at most every `poll_seconds` and only on MySQL; concurrent callers
+        do not wait for a poll that is already running.
+        """
+        if not self.poll_seconds or self._polling:
+            return
+        if time.monotonic() - self.last_polled < self.poll_seconds:
+            return
+        engine = self.engine or get_engine()
+        if engine.dialect.name != "mysql":
+            return
+        self._polling = True
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(STATS_EXPIRY_SQL)
+                rows = (await conn.execute(UPDATE_TIMES_SQL)).fetchall()
+            for name, update_time in rows:
+                name = name.lower()
+                if name in self.update_times and self.update_times[name] != update_time:
+                    self.invalidate_table(name)
+                self.update_times[name] = update_time
+        except Exception as e:
+            logger.warning(f"Result cache could not poll table update times: {e}")
+        finally:
+            self.last_polled = time.monotonic()
+            self._polling = False
+
+    def stats(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
@@ -0,0 +1,163 @@
+import re
+import threading
+from log import logger
+from config import (
+    MODEL,
+    ESCALATION_MODEL,
+    ROUTING_COMPLEXITY_THRESHOLD,
+    ROUTING_ESCALATE_FIXES,
+)
+
+
+SMALL = "small"
+LARGE = "large"
+
+# Wording that usually means aggregation, ranking or comparisons
+ANALYTIC_WORDS = {
+    "average", "avg", "compare", "comparison", "cumulative", "growth", "median",
+    "percent", "percentage", "rank", "ranking", "ratio", "running", "share",
+    "top", "trend", "versus", "vs", "each", "per", "both", "except",
+}
+TEMPORAL_WORDS = {
+    "year", "years", "month", "months", "quarter", "week", "daily", "monthly",
+    "yearly", "since", "between", "last", "previous", "before", "after",
+}
+
+
+def complexity_features(question, schema_text):
+    """
+    Cheap features of a question and its schema slice used to pick a model.
+    """
+    words = re.findall(r"[a-z0-9_]+", question.lower())
+    schema_lines = [line for line in schema_text.splitlines() if line.strip()]
+    table_names = {
+        match.group(1).lower()
+        for match in (re.match(r"\W*(\w+)\s*\(", line) for line in schema_lines)
+        if match
+    }
+    stems = {word.rstrip("s") for word in words}
+    mentioned = {name for name in table_names if name in stems or name.rstrip("s") in stems}
+    return {
+        "words": len(words),
+        "analytic": sum(word in ANALYTIC_WORDS for word in words),
+        "temporal": sum(word in TEMPORAL_WORDS for word in words),
+        "tables_in_schema": len(table_names),
+        "tables_mentioned": len(mentioned),
+        "schema_chars": len(schema_text),
+    }
+
+
+def complexity_score(features):
+    """
+    Turns the features into one score; ROUTING_COMPLEXITY_THRESHOLD is tuned
+    against this with the statistics collected by `ModelRouter`.
+    """
+    score = min(features["analytic"], 3)
+    score += 0.5 * min(features["temporal"], 2)
+    if features["words"] > 25:
+        score += 1
+    if features["tables_mentioned"] >= 2:
+        score += features["tables_mentioned"] - 1
+    if features["tables_in_schema"] > 6:
+        score += 1
+    return float(score)
+
+
+class RouteDecision:
+    def __init__(self, tier, score, features):
+        self.tier = tier
+        self.score = score
+        self.features = features
+        # Set once a later call had to use the large model
+        self.escalated = tier == LARGE
+
+    def as_dict(self):
+        return {"tier": self.tier, "score": self.score, "escalated": self.escalated}
+
+
+class ModelRouter:
+    """
+    Chooses the model for each agent call.
+
+    The first SQL generation goes to the small model unless the question looks
+    complex; error reasoning and fixes (i.e. every later attempt) escalate to
+    the large model. Outcomes are counted per complexity score so the
+    threshold can be tuned: a score whose small-model first attempts mostly
+    fail should be routed to the large model directly.
+    """
+
+    def __init__(
+        self,
+        lm_factory,
+        small_model=MODEL,
+        large_model=ESCALATION_MODEL,
+        threshold=ROUTING_COMPLEXITY_THRESHOLD,
+        escalate_fixes=ROUTING_ESCALATE_FIXES,
+    ):
+        self.lm_factory = lm_factory
+        self.models = {SMALL: small_model, LARGE: large_model or small_model}
+        self.threshold = threshold
+        self.escalate_fixes = escalate_fixes and bool(large_model)
+        self._lms = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.models[LARGE] != self.models[SMALL]
+
+    def lm(self, tier):
+        """
+        Returns the (shared) LM instance of a tier.
+        """
+        if tier not in self._lms:
+            with self._lock:
+                if tier not in self._lms:
+                    self._lms[tier] = self.lm_factory(model=self.models[tier])
+        return self._lms[tier]
+
+    def route(self, question, schema_text):
+        """
+        Picks the tier of the first SQL generation for a question.
+        """
+        features = complexity_features(question, schema_text)
+        score = complexity_score(features)
+        tier = LARGE if self.enabled and score >= self.threshold else SMALL
+        logger.debug(f"Routing question to {self.models[tier]} (score {score}): {features}")
+        return RouteDecision(tier, score, features)
+
+    def fix_lm(self, decision):
+        """
+        Returns the LM for an error reasoning/fix call and marks the escalation.
+        """
+        if self.escalate_fixes:
+            if not decision.escalated:
+                logger.info(f"Escalating to {self.models[LARGE]} after a failed attempt.")
+            decision.escalated = True
+            return self.lm(LARGE)
+        return self.lm(decision.tier)
+
+    def record(self, decision, success, llm_attempts):
+        """
+        Counts the outcome of a routed question for threshold tuning.
+        """
+        key = f"{decision.tier}:{decision.score:g}"
+        if not success:
+            outcome = "failed"
+        elif llm_attempts <= 1:
+            outcome = "first_attempt"
+        else:
+            outcome = "escalated" if decision.escalated and decision.tier == SMALL else "retried"
+        with self._lock:
+            counts = self._stats.setdefault(key, {})
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    def stats(self):
+        with self._lock:
+            by_score = {key: dict(counts) for key, counts in sorted(self._stats.items())}
+        return {
+            "models": dict(self.models),
+            "threshold": self.threshold,
+            "escalate_fixes": self.escalate_fixes,
+            "by_tier_and_score": by_score,
+        }
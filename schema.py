@@ -0,0 +1,302 @@
+import asyncio
+import copy
+import hashlib
+import time
+from sqlalchemy import bindparam, inspect, text
+from log import logger
+from config import db_info, SCHEMA_REFRESH_SECONDS, SCHEMA_STATS_REFRESH_SECONDS, SUMMARY_TABLE_PREFIX
+from db import get_engine
+
+
+COLUMNS_SQL = text(
+    """
+    SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+    ORDER BY TABLE_NAME, ORDINAL_POSITION
+    """
+)
+
+INDEXES_SQL = text(
+    """
+    SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME
+    FROM INFORMATION_SCHEMA.STATISTICS
+    WHERE TABLE_SCHEMA = DATABASE()
+    ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX
+    """
+)
+
+TABLES_SQL = text(
+    """
+    SELECT TABLE_NAME, TABLE_ROWS, TABLE_COMMENT
+    FROM INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN :names
+    """
+).bindparams(bindparam("names", expanding=True))
+
+ALL_TABLES_SQL = text(
+    """
+    SELECT TABLE_NAME, TABLE_ROWS, TABLE_COMMENT
+    FROM INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_SCHEMA = DATABASE()
+    """
+)
+
+FOREIGN_KEYS_SQL = text(
+    """
+    SELECT TABLE_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME
+    FROM INFORMATION_SCHEMA.KEY_COLUMN_USAGE
+    WHERE TABLE_SCHEMA = DATABASE()
+      AND REFERENCED_TABLE_NAME IS NOT NULL
+      AND TABLE_NAME IN :names
+    """
+).bindparams(bindparam("names", expanding=True))
+
+
+class TableInfo:
+    def __init__(self, name, columns, indexes, fingerprint):
+        self.name = name
+        # [(column_name, column_type, nullable, key)]
+        self.columns = columns
+        # {index_name: (unique, [column_names])}
+        self.indexes = indexes
+        self.fingerprint = fingerprint
+        # [(column_name, referenced_table, referenced_column)]
+        self.foreign_keys = []
+        self.row_estimate = None
+        self.comment = ""
+
+    @property
+    def column_names(self):
+        return [col[0] for col in self.columns]
+
+    def render(self):
+        """
+        Renders the table as one compact line for the LLM prompt, e.g.
+        `sales(sale_id int PK, employee_id int FK->employee.employee_id) ~1200 rows`.
+        """
+        references = {col: f"{table}.{ref}" for col, table, ref in self.foreign_keys}
+        parts = []
+        for name, column_type, nullable, key in self.columns:
+            part = f"{name} {column_type}"
+            if key == "PRI":
+                part += " PK"
+            if name in references:
+                part += f" FK->{references[name]}"
+            parts.append(part)
+        line = f"{self.name}({', '.join(parts)})"
+        secondary = [
+            ("unique " if unique else "") + ",".join(cols)
+            for index_name, (unique, cols) in self.indexes.items()
+            if index_name != "PRIMARY"
+        ]
+        if secondary:
+            line += f" idx[{'; '.join(secondary)}]"
+        if self.row_estimate is not None:
+            line += f" ~{self.row_estimate} rows"
+        if self.comment:
+            line += f" -- {self.comment}"
+        return line
+
+
+class SchemaSnapshot:
+    """
+    Immutable view of the database schema at one point in time.
+    """
+
+    def __init__(self, tables, text_override=None):
+        self.tables = tables
+        digest = hashlib.sha256()
+        for name in sorted(tables):
+            digest.update(f"{name}:{tables[name].fingerprint};".encode("utf-8"))
+        if text_override is not None:
+            digest.update(text_override.encode("utf-8"))
+        self.version = digest.hexdigest()[:16]
+        self.text = text_override if text_override is not None else self.render()
+        self.created_at = time.time()
+
+    @classmethod
+    def static(cls, description=db_info):
+        """
+        Snapshot backed by the hand-written description in `config.db_info`.
+        """
+        return cls({}, text_override=description)
+
+    def render(self, table_names=None):
+        names = sorted(self.tables) if table_names is None else table_names
+        return "\n".join(self.tables[name].render() for name in names)
+
+    def catalog(self):
+        """
+        Returns `{table_name: [column_names]}`.
+        """
+        return {name: table.column_names for name, table in self.tables.items()}
+
+
+def _fingerprint(columns, indexes):
+    payload = repr((columns, sorted(indexes.items())))
+    return hashlib.md5(payload.encode("utf-8")).hexdigest()
+
+
+class SchemaProvider:
+    """
+    Introspects the live database and caches a compact, versioned schema.
+
+    Every SCHEMA_REFRESH_SECONDS the provider re-reads column and index
+    definitions (two cheap INFORMATION_SCHEMA queries) and fingerprints each
+    table. Only tables whose fingerprint changed are introspected again for
+    foreign keys, row estimates and comments, so steady-state refreshes cost
+    almost nothing. Row estimates and comments drift without DDL, so they are
+    re-read for every table every `stats_refresh_seconds`.
+
+    Only the first load is awaited. After that a due refresh runs as a single
+    background task while requests keep getting the current snapshot.
+    """
+
+    def __init__(
+        self,
+        engine=None,
+        refresh_seconds=SCHEMA_REFRESH_SECONDS,
+        fallback=db_info,
+        stats_refresh_seconds=SCHEMA_STATS_REFRESH_SECONDS,
+    ):
+        self.engine = engine
+        self.refresh_seconds = refresh_seconds
+        self.stats_refresh_seconds = stats_refresh_seconds
+        self.fallback = fallback
+        self.snapshot = None
+        self.last_checked = 0.0
+        self.stats_checked = time.monotonic()
+        self._lock = asyncio.Lock()
+        self._refreshing = None
+
+    async def get(self):
+        """
+        Returns the current snapshot. The first call loads it; later calls start
+        a background refresh when one is due and return the snapshot they have.
+        """
+        if self.snapshot is None:
+            async with self._lock:
+                # Another request may have loaded it while we waited for the lock
+                if self.snapshot is None:
+                    await self.refresh()
+        elif time.monotonic() - self.last_checked >= self.refresh_seconds and (
+            self._refreshing is None or self._refreshing.done()
+        ):
+            self._refreshing = asyncio.create_task(self._refresh_in_background())
+        return self.snapshot
+
+    async def _refresh_in_background(self):
+        async with self._lock:
+            if time.monotonic() - self.last_checked >= self.refresh_seconds:
+                await self.refresh()
+
+    async def refresh(self):
+        """
+        Detects DDL changes and re-introspects only the affected tables.
+        """
+        self.last_checked = time.monotonic()
+        try:
+            engine = self.engine or get_engine()
+            async with engine.connect() as conn:
+                if engine.dialect.name == "mysql":
+                    tables = await self._load_mysql(conn)
+                else:
+                    tables = await conn.run_sync(self._load_generic)
+        except Exception as e:
+            logger.error(f"Schema introspection failed: {e}")
+            if self.snapshot is None:
+                logger.warning("Falling back to the static schema description.")
+                self.snapshot = SchemaSnapshot.static(self.fallback)
+            return self.snapshot
+
+        if not tables:
+            logger.warning("No tables found by introspection; using the static schema.")
+            tables = None
+        snapshot = SchemaSnapshot(tables) if tables else SchemaSnapshot.static(self.fallback)
+        if self.snapshot is None or snapshot.version != self.snapshot.version:
+            logger.info(f"Schema version {snapshot.version} loaded ({len(snapshot.tables)} tables).")
+        self.snapshot = snapshot
+        return snapshot
+
+    def _previous_tables(self):
+        return self.snapshot.tables if self.snapshot is not None else {}
+
+    async def _load_mysql(self, conn):
+        columns, indexes = {}, {}
+        for row in (await conn.execute(COLUMNS_SQL)).fetchall():
+            columns.setdefault(row[0], []).append(
+                (row[1], row[2], row[3] == "YES", row[4])
+            )
+        for row in (await conn.execute(INDEXES_SQL)).fetchall():
+            table_indexes = indexes.setdefault(row[0], {})
+            unique, cols = table_indexes.setdefault(row[1], (not row[2], []))
+            cols.append(row[3])
+
+        previous = self._previous_tables()
+        tables, changed = {}, []
+        for name, table_columns in columns.items():
+            # Summary tables are used through query rewriting, never by the LLM
+            if name.startswith(SUMMARY_TABLE_PREFIX):
+                continue
+            table_indexes = indexes.get(name, {})
+            fingerprint = _fingerprint(table_columns, table_indexes)
+            old = previous.get(name)
+            if old is not None and old.fingerprint == fingerprint:
+                tables[name] = old
+            else:
+                tables[name] = TableInfo(name, table_columns, table_indexes, fingerprint)
+                changed.append(name)
+
+        if time.monotonic() - self.stats_checked >= self.stats_refresh_seconds:
+            self.stats_checked = time.monotonic()
+            for row in (await conn.execute(ALL_TABLES_SQL)).fetchall():
+                table = tables.get(row[0])
+                if table is None or table.name in changed:
+                    continue
+                if (table.row_estimate, table.comment) != (row[1], row[2] or ""):
+                    # Copied so the previous snapshot stays unchanged
+                    table = tables[row[0]] = copy.copy(table)
+                    table.row_estimate, table.comment = row[1], row[2] or ""
+
+        if changed:
+            if previous:
+                logger.info(f"Schema change detected in: {', '.join(changed)}")
+            for row in (await conn.execute(TABLES_SQL, {"names": changed})).fetchall():
+                tables[row[0]].row_estimate = row[1]
+                tables[row[0]].comment = row[2] or ""
+            for row in (await conn.execute(FOREIGN_KEYS_SQL, {"names": changed})).fetchall():
+                tables[row[0]].foreign_keys.append((row[1], row[2], row[3]))
+        return tables
+
+    def _load_generic(self, sync_conn):
+        """
+        Dialect-independent introspection through the SQLAlchemy inspector, used
+        for local SQLite databases.
+        """
+        inspector = inspect(sync_conn)
+        previous = self._previous_tables()
+        tables = {}
+        for name in inspector.get_table_names():
+            if name.startswith(SUMMARY_TABLE_PREFIX):
+                continue
+            primary = set(inspector.get_pk_constraint(name).get("constrained_columns") or [])
+            table_columns = [
+                (col["name"], str(col["type"]).lower(), bool(col["nullable"]), "PRI" if col["name"] in primary else "")
+                for col in inspector.get_columns(name)
+            ]
+            table_indexes = {
+                index["name"]: (bool(index["unique"]), list(index["column_names"]))
+                for index in inspector.get_indexes(name)
+            }
+            fingerprint = _fingerprint(table_columns, table_indexes)
+            old = previous.get(name)
+            if old is not None and old.fingerprint == fingerprint:
+                tables[name] = old
+                continue
+            table = TableInfo(name, table_columns, table_indexes, fingerprint)
+            for fk in inspector.get_foreign_keys(name):
+                for col, ref in zip(fk["constrained_columns"], fk["referred_columns"]):
+                    table.foreign_keys.append((col, fk["referred_table"], ref))
+            tables[name] = table
+        return tables
@@ -0,0 +1,96 @@
+import base64
+import datetime
+import decimal
+import orjson
+from fastapi.responses import Response
+
+
+def json_default(value):
+    """
+    orjson fallback for the types MySQL drivers and pandas hand back.
+    """
+    # pandas.NA / pandas.NaT (NaT also subclasses datetime)
+    if type(value).__name__ in ("NAType", "NaTType"):
+        return None
+    if isinstance(value, decimal.Decimal):
+        if not value.is_finite():
+            return None
+        # Integral decimals (e.g. SUM over an INT column) stay exact as ints
+        if value == value.to_integral_value():
+            return int(value)
+        return float(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        # pandas Timestamp subclasses datetime but is not handled natively
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        raw = bytes(value)
+        try:
+            return raw.decode("utf-8")
+        except UnicodeDecodeError:
+            return base64.b64encode(raw).decode("ascii")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if hasattr(value, "item"):
+        # numpy scalars that OPT_SERIALIZE_NUMPY does not cover
+        return value.item()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(obj):
+    """
+    Serializes an object to JSON bytes with orjson.
+    """
+    return orjson.dumps(
+        obj,
+        default=json_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+    )
+
+
+def unique_columns(columns):
+    """
+    Suffixes repeated column names (`SELECT a.id, b.id` -> `id`, `id_1`) so
+    they survive as separate dict keys.
+    """
+    seen = set()
+    result = []
+    for column in map(str, columns):
+        name, suffix = column, 1
+        while name in seen:
+            name = f"{column}_{suffix}"
+            suffix += 1
+        seen.add(name)
+        result.append(name)
+    return result
+
+
+def dataframe_to_records(df):
+    """
+    Converts a DataFrame into `(columns, rows)` where rows is a list of dicts.
+    """
+    columns = unique_columns(df.columns)
+    rows = [dict(zip(columns, row)) for row in df.itertuples(index=False, name=None)]
+    return columns, rows
+
+
+def table_to_records(table):
+    """
+    Converts an Arrow table into `(columns, rows)` where rows is a list of dicts.
+    """
+    columns = unique_columns(table.column_names)
+    if columns != table.column_names:
+        table = table.rename_columns(columns)
+    return columns, table.to_pylist()
+
+
+class ORJSONResultResponse(Response):
+    """
+    JSON response rendered with orjson and the type-aware `json_default`.
+    """
+
+    media_type = "application/json"
+
+    def render(self, content):
+        return dumps(content)
@@ -0,0 +1,63 @@
+import asyncio
+from log import logger
+
+
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one computation.
+
+    The first caller starts the computation as its own task; callers arriving
+    while it runs attach to it. Each caller awaits it through `asyncio.shield`,
+    so one caller being cancelled (e.g. its HTTP client disconnected) does not
+    cancel the work the others are waiting for. The computation is cancelled
+    only when its last waiter goes away.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.started = 0
+        self.coalesced = 0
+
+    async def do(self, key, func):
+        """
+        Returns `(result, shared)` where `shared` is True when this caller
+        attached to a computation another caller had already started.
+        """
+        call = self.calls.get(key)
+        shared = call is not None
+        if call is None:
+            call = _Call(asyncio.ensure_future(func()))
+            self.calls[key] = call
+            self.started += 1
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
+            logger.debug(f"Joined the in-flight computation for {key}")
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task), shared
+        finally:
+            call.waiters -= 1
+            if call.waiters == 0 and not call.task.done():
+                logger.info(f"All callers left; cancelling the computation for {key}")
+                call.task.cancel()
+                self._forget(key, call)
+
+    def _forget(self, key, call):
+        # A newer computation may already be registered under the same key
+        if self.calls.get(key) is call:
+            del self.calls[key]
+
+    def stats(self):
+        return {
+            "in_flight": len(self.calls),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
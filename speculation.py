@@ -0,0 +1,127 @@
+import asyncio
+import re
+import threading
+from log import logger
+from config import (
+    SPECULATIVE_CANDIDATES,
+    SPECULATIVE_TEMPERATURES,
+    SPECULATIVE_TENANTS,
+    SPECULATIVE_MAX_INFLIGHT,
+)
+
+
+class SpeculationBudget:
+    """
+    Decides which requests may generate several SQL candidates in parallel.
+
+    Only tenants in the allowlist (all tenants when it is empty) speculate, and
+    at most `max_inflight` speculative requests run at once per worker; requests
+    over the budget fall back to the serial generate/fix loop instead of waiting.
+    """
+
+    def __init__(
+        self,
+        candidates=SPECULATIVE_CANDIDATES,
+        temperatures=SPECULATIVE_TEMPERATURES,
+        tenants=SPECULATIVE_TENANTS,
+        max_inflight=SPECULATIVE_MAX_INFLIGHT,
+    ):
+        self.candidates = max(1, candidates)
+        self.temperatures = temperatures or [None]
+        self.tenants = set(tenants)
+        self.max_inflight = max_inflight
+        self.inflight = 0
+        self.granted = 0
+        self.denied = 0
+        self._lock = threading.Lock()
+
+    def temperature(self, index):
+        return self.temperatures[index % len(self.temperatures)]
+
+    def try_acquire(self, tenant=None):
+        """
+        Returns True and reserves a slot when `tenant` may speculate right now.
+        """
+        if self.candidates < 2 or (self.tenants and tenant not in self.tenants):
+            return False
+        with self._lock:
+            if self.inflight >= self.max_inflight:
+                self.denied += 1
+                return False
+            self.inflight += 1
+            self.granted += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.inflight -= 1
+
+    def stats(self):
+        return {
+            "inflight": self.inflight,
+            "max_inflight": self.max_inflight,
+            "granted": self.granted,
+            "denied": self.denied,
+        }
+
+
+def sql_key(sql):
+    """
+    Key used to drop duplicate candidates: case and whitespace are ignored.
+    """
+    return re.sub(r"\s+", " ", sql.strip().rstrip(";")).lower()
+
+
+async def first_valid(generators, validate):
+    """
+    Runs candidate generators concurrently and validates each distinct SQL as
+    soon as it arrives.
+
+    `generators` are coroutines returning `(sql, response)`; `validate(sql)` is
+    awaited for every unique SQL and must raise when the candidate is unusable.
+    Returns `(winner, failures)`: `winner` is `(index, sql, response, result)`
+    of the first candidate that validated, or None, and `failures` lists
+    `(sql, response, error)` in completion order. Every task still running when
+    a winner is found is cancelled, which also kills its database query.
+    """
+    generation = {asyncio.ensure_future(gen): index for index, gen in enumerate(generators)}
+    validation = {}
+    pending = set(generation)
+    seen = set()
+    failures = []
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task in generation:
+                    index = generation[task]
+                    try:
+                        sql, response = task.result()
+                    except Exception as e:
+                        logger.warning(f"Speculative candidate {index} failed to generate: {e}")
+                        continue
+                    key = sql_key(sql)
+                    if key in seen:
+                        logger.debug(f"Speculative candidate {index} duplicates an earlier one.")
+                        continue
+                    seen.add(key)
+                    check = asyncio.ensure_future(validate(sql))
+                    validation[check] = (index, sql, response)
+                    pending.add(check)
+                else:
+                    index, sql, response = validation[task]
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        failures.append((sql, response, e))
+                        continue
+                    logger.info(
+                        f"Speculative candidate {index} won ({len(seen)} unique of {len(generation)})."
+                    )
+                    return (index, sql, response, result), failures
+        return None, failures
+    finally:
+        # Losers are cancelled without waiting, so their cleanup (KILL QUERY)
+        # never delays the winner's response
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,58 @@
+import anyio
+import dspy
+
+
+class FieldStream:
+    """
+    Stand-in for the stream DSPy sends litellm chunks to while
+    `dspy.settings.send_stream` is set. Forwards only the text of one output
+    field (`[[ ## field ## ]]` in the chat adapter format) to `on_text`, as
+    it arrives. `send` runs on the event loop.
+    """
+
+    def __init__(self, field, on_text):
+        self.marker = f"[[ ## {field} ## ]]"
+        self.on_text = on_text
+        self.text = ""
+        self.sent = 0
+
+    async def send(self, chunk):
+        try:
+            delta = chunk.choices[0].delta.content or ""
+        except (AttributeError, IndexError):
+            return
+        self.feed(delta)
+
+    def feed(self, delta):
+        self.text += delta
+        start = self.text.find(self.marker)
+        if start < 0:
+            return
+        body = self.text[start + len(self.marker):].lstrip("\n")
+        end = body.find("[[")
+        if end >= 0:
+            body = body[:end]
+        elif body.endswith("["):
+            # Possibly the start of the next field marker
+            body = body[:-1]
+        if len(body) > self.sent:
+            self.on_text(body[self.sent:])
+            self.sent = len(body)
+
+
+async def stream_call(func, on_text, field="generated_sql"):
+    """
+    Runs a DSPy predictor call (`func()`) in a worker thread with litellm
+    streaming on, passing the text of `field` to `on_text` token by token.
+
+    DSPy drives the streamed completion on the event loop through
+    `anyio.from_thread`, so the call needs an AnyIO worker thread rather than
+    `asyncio.to_thread`.
+    """
+    stream = FieldStream(field, on_text)
+
+    def run():
+        with dspy.settings.context(send_stream=stream):
+            return func()
+
+    return await anyio.to_thread.run_sync(run, abandon_on_cancel=True)
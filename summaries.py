@@ -0,0 +1,844 @@
+import asyncio
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from sqlalchemy import inspect, text
+from log import logger
+from config import (
+    SUMMARY_TABLE_PREFIX,
+    SUMMARY_MIN_QUERIES,
+    SUMMARY_HISTORY_SIZE,
+    SUMMARY_MAX_TABLES,
+    SUMMARY_MIN_ROWS,
+    SUMMARY_MIN_REDUCTION,
+    SUMMARY_REFRESH_SECONDS,
+    SUMMARY_MAINTAINER,
+    SUMMARY_REBUILD_SECONDS,
+    SUMMARY_MAX_STALENESS_SECONDS,
+    SUMMARY_WATERMARK_COLUMNS,
+)
+from repair import LITERAL_PATTERN, TABLE_REFERENCE_PATTERN, table_aliases
+from result_cache import STATS_EXPIRY_SQL
+
+
+AGGREGATE_PATTERN = re.compile(r"\b(sum|count|min|max|avg)\s*\(", re.IGNORECASE)
+# Aggregates a summary can answer: over `*` or one plain, optionally qualified, column
+SIMPLE_AGGREGATE_PATTERN = re.compile(
+    r"\b(sum|count|min|max|avg)\s*\(\s*(?:(\*)|(?:`?([A-Za-z_]\w*)`?\s*\.\s*)?`?([A-Za-z_]\w*)`?)\s*\)",
+    re.IGNORECASE,
+)
+# Shapes whose result would change when rows are pre-aggregated; outer joins
+# keep unmatched rows, which a summary row cannot count
+UNSUPPORTED_PATTERN = re.compile(
+    r"\b(union|intersect|except|with|over|distinct|left|right|full|outer|cross|natural)\b"
+    r"|\bselect\b[\s\S]*\bselect\b|(?:\bselect|,|\.)\s*\*",
+    re.IGNORECASE,
+)
+QUALIFIED_PATTERN = re.compile(r"\b([A-Za-z_]\w*)\s*\.\s*(\w+)")
+IDENTIFIER_PATTERN = re.compile(r"\b[A-Za-z_]\w*\b")
+SELECT_PATTERN = re.compile(r"\s*select\b(?:\s*/\*.*?\*/)?", re.IGNORECASE | re.DOTALL)
+SELECT_TOKEN_PATTERN = re.compile(r"[(),]|\bfrom\b", re.IGNORECASE)
+ALIAS_PATTERN = re.compile(r"(\bas\s+\S+|\)\s+`?\w+`?)$", re.IGNORECASE)
+
+ROW_COUNT = "_row_count"
+UPDATE_TIME_SQL = text(
+    """
+    SELECT UPDATE_TIME
+    FROM INFORMATION_SCHEMA.TABLES
+    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table
+    """
+)
+# Columns of the state table, shared by every process using the database
+STATE_COLUMNS = (
+    "name", "definition", "watermark", "summary_rows", "rows_at_build", "base_rows",
+    "refreshed_at", "built_at", "update_time",
+)
+
+
+def _mask_literals(sql_query):
+    """
+    Blanks out string literals, keeping their quotes and length, so patterns
+    never match inside them and offsets still point into the original SQL.
+    """
+    return LITERAL_PATTERN.sub(
+        lambda m: m.group(0)[0] + " " * (len(m.group(0)) - 2) + m.group(0)[-1], sql_query
+    )
+
+
+def _select_items(masked):
+    """
+    Returns the `(start, end)` spans of the items of the outer SELECT list.
+    """
+    start = SELECT_PATTERN.match(masked).end()
+    items, depth = [], 0
+    for match in SELECT_TOKEN_PATTERN.finditer(masked, start):
+        token = match.group(0)
+        if token == "(":
+            depth += 1
+        elif token == ")":
+            depth -= 1
+        elif depth == 0:
+            items.append((start, match.start()))
+            if token != ",":
+                return items
+            start = match.end()
+    return []
+
+
+class AggregateQuery:
+    """
+    An aggregate over one fact table, joined at most to tables it is not
+    aggregated over: the shape a summary table can answer.
+
+    `groups` are the fact columns read outside aggregates (grouping, filters,
+    join keys), `measures` the `(function, column)` pairs the aggregates need.
+    """
+
+    def __init__(self, sql, masked, fact, ref, groups, measures, calls):
+        self.sql = sql
+        self.masked = masked
+        self.fact = fact
+        # Name the fact table is referred to by in the query: its alias or itself
+        self.ref = ref
+        self.groups = groups
+        self.measures = measures
+        # [(start, end, function, column or None for `*`)]
+        self.calls = calls
+
+    @property
+    def key(self):
+        return self.fact, self.groups
+
+
+def parse_aggregate(sql_query, catalog):
+    """
+    Returns the `AggregateQuery` of a statement, or None when it has any
+    construct a summary cannot answer exactly. `catalog` is the schema's
+    `{table: [columns]}`; every table the query reads must be in it.
+    """
+    sql_query = sql_query.strip().rstrip(";").strip()
+    masked = _mask_literals(sql_query)
+    if not SELECT_PATTERN.match(masked) or UNSUPPORTED_PATTERN.search(masked):
+        return None
+    columns = {table.lower(): {col.lower(): col for col in cols} for table, cols in catalog.items()}
+    names = {table.lower(): table for table in catalog}
+    aliases = {alias.lower(): table.lower() for alias, table in table_aliases(masked).items()}
+    if not aliases or any(table not in columns for table in aliases.values()):
+        return None
+
+    matches = list(SIMPLE_AGGREGATE_PATTERN.finditer(masked))
+    if not matches or len(matches) != len(AGGREGATE_PATTERN.findall(masked)):
+        return None
+    facts, calls, measures = set(), [], set()
+    for match in matches:
+        function, star, qualifier, column = match.groups()
+        function = function.lower()
+        if star:
+            if function != "count":
+                return None
+            calls.append((match.start(), match.end(), function, None))
+            continue
+        if qualifier:
+            owners = [aliases.get(qualifier.lower())]
+        else:
+            owners = [table for table in set(aliases.values()) if column.lower() in columns[table]]
+        if len(owners) != 1 or owners[0] is None or column.lower() not in columns[owners[0]]:
+            return None
+        column = columns[owners[0]][column.lower()]
+        facts.add(owners[0])
+        calls.append((match.start(), match.end(), function, column))
+        if function == "avg":
+            measures |= {("sum", column), ("count", column)}
+        else:
+            measures.add((function, column))
+    if not facts and len(set(aliases.values())) == 1:
+        facts = set(aliases.values())
+    if len(facts) != 1:
+        return None
+    fact = facts.pop()
+    references = [
+        (table, alias)
+        for table, alias in TABLE_REFERENCE_PATTERN.findall(masked)
+        if table.lower() == fact
+    ]
+    if len(references) != 1:
+        # A self-join reads the fact table twice
+        return None
+    fact_names = {alias for alias, table in aliases.items() if table == fact}
+
+    rest = SIMPLE_AGGREGATE_PATTERN.sub(" ", masked).replace("`", " ")
+    groups = set()
+    for qualifier, column in QUALIFIED_PATTERN.findall(rest):
+        if qualifier.lower() not in aliases:
+            return None
+        if qualifier.lower() in fact_names:
+            if column.lower() not in columns[fact]:
+                return None
+            groups.add(columns[fact][column.lower()])
+    # An unqualified name that is also a fact column may just be an output
+    # alias; grouping by it anyway only makes the summary finer
+    for word in IDENTIFIER_PATTERN.findall(QUALIFIED_PATTERN.sub(" ", rest)):
+        if word.lower() in columns[fact]:
+            groups.add(columns[fact][word.lower()])
+    table, alias = references[0]
+    return AggregateQuery(
+        sql_query, masked, names[fact], alias or table, frozenset(groups), frozenset(measures), calls
+    )
+
+
+class Summary:
+    """
+    A table of `_row_count` and the measures of `fact`, grouped by `groups`.
+
+    With a watermark column (an ever-increasing key) it is refreshed by
+    appending the aggregates of rows past the last watermark; queries always
+    re-aggregate, so a group may span several rows. Full rebuilds compact it
+    and pick up updated or deleted rows; a refresh that finds rows deleted,
+    or updated without new rows, rebuilds it too.
+    """
+
+    def __init__(self, fact, groups, measures, watermark_column=None, prefix=SUMMARY_TABLE_PREFIX):
+        self.fact = fact
+        self.groups = frozenset(groups)
+        self.measures = frozenset(measures)
+        self.watermark_column = watermark_column
+        digest = hashlib.md5(
+            repr((fact, sorted(self.groups), sorted(self.measures))).encode("utf-8")
+        ).hexdigest()[:8]
+        self.name = f"{prefix}{fact}"[:48] + f"_{digest}"
+        self.ready = False
+        self.watermark = None
+        # Time the data it holds was read; None until the first build
+        self.refreshed_at = None
+        self.built_at = None
+        # MySQL UPDATE_TIME of the fact table when it was read
+        self.update_time = None
+        self.rows = 0
+        self.rows_at_build = 0
+        self.base_rows = 0
+        self.hits = 0
+        self.fallbacks = 0
+        self.failures = 0
+        self.error = None
+
+    def definition(self):
+        return json.dumps(
+            {
+                "fact": self.fact,
+                "groups": sorted(self.groups),
+                "measures": sorted(self.measures, key=repr),
+                "watermark_column": self.watermark_column,
+            }
+        )
+
+    @classmethod
+    def from_definition(cls, definition, prefix=SUMMARY_TABLE_PREFIX):
+        definition = json.loads(definition)
+        return cls(
+            definition["fact"],
+            definition["groups"],
+            [tuple(measure) for measure in definition["measures"]],
+            definition["watermark_column"],
+            prefix,
+        )
+
+    def state(self):
+        """
+        The row of the state table describing this summary.
+        """
+        return {
+            "name": self.name,
+            "definition": self.definition(),
+            "watermark": self.watermark,
+            "summary_rows": self.rows,
+            "rows_at_build": self.rows_at_build,
+            "base_rows": self.base_rows,
+            "refreshed_at": self.refreshed_at,
+            "built_at": self.built_at,
+            "update_time": self.update_time,
+        }
+
+    def load_state(self, row):
+        """
+        Takes over the state another process (or this one) stored.
+        """
+        if row["built_at"] != self.built_at:
+            # Rebuilt since this process last looked: usable again
+            self.ready, self.failures, self.error = True, 0, None
+        self.watermark = row["watermark"]
+        self.rows = int(row["summary_rows"])
+        self.rows_at_build = int(row["rows_at_build"])
+        self.base_rows = int(row["base_rows"])
+        self.refreshed_at = row["refreshed_at"]
+        self.built_at = row["built_at"]
+        self.update_time = row["update_time"]
+
+    def covers(self, query):
+        return (
+            query.fact == self.fact
+            and query.groups <= self.groups
+            and query.measures <= self.measures
+        )
+
+    def columns(self):
+        """
+        Returns `[(column, aggregate)]` of the summary table.
+        """
+        columns = [(group, None) for group in sorted(self.groups)]
+        columns.append((ROW_COUNT, ("count", None)))
+        columns += [(f"{function}_{column}", (function, column)) for function, column in sorted(self.measures)]
+        return columns
+
+    def select_sql(self, quote, where=""):
+        """
+        The aggregation over the fact table the summary holds.
+        """
+        items = []
+        for name, aggregate in self.columns():
+            if aggregate is None:
+                items.append(quote(name))
+            else:
+                function, column = aggregate
+                argument = "*" if column is None else quote(column)
+                items.append(f"{function.upper()}({argument}) AS {quote(name)}")
+        sql = f"SELECT {', '.join(items)} FROM {quote(self.fact)}{where}"
+        if self.groups:
+            sql += " GROUP BY " + ", ".join(quote(group) for group in sorted(self.groups))
+        return sql
+
+    def stats(self):
+        return {
+            "table": self.name,
+            "fact": self.fact,
+            "groups": sorted(self.groups),
+            "measures": [f"{function}({column})" for function, column in sorted(self.measures)],
+            "ready": self.ready,
+            "rows": self.rows,
+            "base_rows": self.base_rows,
+            "watermark": self.watermark,
+            "refreshed_at": self.refreshed_at,
+            "hits": self.hits,
+            "fallbacks": self.fallbacks,
+            "error": self.error,
+        }
+
+
+def rewrite_aggregate(query, summary, dialect):
+    """
+    Returns the SQL of `query` reading `summary` instead of its fact table.
+
+    Aggregates become re-aggregations of the stored measures (`COUNT(*)` ->
+    `SUM(_row_count)`, `AVG(x)` -> `SUM(sum_x) / SUM(count_x)`), and select
+    items without an alias get their original text as one, so the result keeps
+    its column names.
+    """
+    quote = dialect.identifier_preparer.quote
+    integer = "SIGNED" if dialect.name == "mysql" else "BIGINT"
+    ref = query.ref
+
+    def measure(function, column):
+        return f"{ref}.{quote(f'{function}_{column}')}"
+
+    edits = []
+    for start, end, function, column in query.calls:
+        if column is None:
+            expression = f"CAST(COALESCE(SUM({ref}.{ROW_COUNT}), 0) AS {integer})"
+        elif function == "count":
+            expression = f"CAST(COALESCE(SUM({measure('count', column)}), 0) AS {integer})"
+        elif function == "avg":
+            expression = f"(SUM({measure('sum', column)}) * 1.0 / NULLIF(SUM({measure('count', column)}), 0))"
+        else:
+            expression = f"{function.upper()}({measure(function, column)})"
+        edits.append((start, end, expression))
+    for match in TABLE_REFERENCE_PATTERN.finditer(query.masked):
+        if match.group(1).lower() == query.fact.lower():
+            # FROM and JOIN are both four letters long
+            keyword = query.masked[match.start():match.start() + 4]
+            edits.append((match.start(), match.end(), f"{keyword} {quote(summary.name)} {ref}"))
+    for start, end in _select_items(query.masked):
+        item = query.masked[start:end].rstrip()
+        has_call = any(start <= call[0] < end for call in query.calls)
+        if has_call and not ALIAS_PATTERN.search(item):
+            original = query.sql[start:start + len(item)].strip()
+            alias = dialect.identifier_preparer.quote_identifier(original)
+            edits.append((start + len(item), start + len(item), f" AS {alias}"))
+
+    sql_query = query.sql
+    for start, end, replacement in sorted(edits, key=lambda edit: edit[0], reverse=True):
+        sql_query = sql_query[:start] + replacement + sql_query[end:]
+    return sql_query
+
+
+def _text(value):
+    # Watermarks are kept as text in the state table, whatever the column type
+    return None if value is None else str(value)
+
+
+def _literal(value):
+    # Numbers are inlined: some drivers refuse parameters in CREATE TABLE AS
+    if isinstance(value, (int, float)):
+        return str(value), {}
+    return ":watermark", {"watermark": value}
+
+
+class SummaryManager:
+    """
+    Summary tables of one database, chosen from the SQL it executes.
+
+    Every aggregate executed is recorded by shape (fact table and fact columns
+    used outside aggregates); shapes seen `min_queries` times in the last
+    `history_size` queries are materialized on the primary, unless an existing
+    summary already covers them. Summaries that are not `min_reduction` times
+    smaller than their fact table, or that summarize fewer than `min_rows`
+    rows, are dropped again.
+
+    Queries are rewritten to the smallest covering summary refreshed within
+    `max_staleness` seconds, or older on MySQL when its fact table's
+    `UPDATE_TIME` has not changed since; otherwise, and when the rewritten
+    query fails, the base query runs.
+
+    Definitions, watermarks and row counts live in a state table, so every
+    worker rewrites to the summaries any of them built. Only one process at a
+    time maintains them: the holder of a MySQL `GET_LOCK`, or on other
+    databases the processes started with `maintainer` on.
+    """
+
+    def __init__(
+        self,
+        db,
+        min_queries=SUMMARY_MIN_QUERIES,
+        history_size=SUMMARY_HISTORY_SIZE,
+        max_tables=SUMMARY_MAX_TABLES,
+        min_rows=SUMMARY_MIN_ROWS,
+        min_reduction=SUMMARY_MIN_REDUCTION,
+        refresh_seconds=SUMMARY_REFRESH_SECONDS,
+        rebuild_seconds=SUMMARY_REBUILD_SECONDS,
+        max_staleness=SUMMARY_MAX_STALENESS_SECONDS,
+        watermark_columns=SUMMARY_WATERMARK_COLUMNS,
+        maintainer=SUMMARY_MAINTAINER,
+        prefix=SUMMARY_TABLE_PREFIX,
+    ):
+        self.db = db
+        self.maintainer = maintainer
+        self.prefix = prefix
+        self.state_table = f"{prefix}state"
+        self.min_queries = min_queries
+        self.max_tables = max_tables
+        self.min_rows = min_rows
+        self.min_reduction = min_reduction
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_seconds = rebuild_seconds
+        self.max_staleness = max_staleness
+        self.watermark_columns = {table.lower(): column for table, column in watermark_columns.items()}
+        self.history = deque(maxlen=history_size)
+        self.counts = Counter()
+        self.measures = {}
+        self.summaries = {}
+        # Summaries dropped for too little reduction; not built again
+        self.rejected = set()
+        self.counters = {"observed": 0, "rewritten": 0, "fallbacks": 0, "stale": 0}
+        self.lock = threading.Lock()
+        self._state_ready = False
+        self._task = None
+
+    def _catalog(self):
+        provider = self.db.schema_provider
+        if provider is None or provider.snapshot is None:
+            return {}
+        return provider.snapshot.catalog()
+
+    def observe(self, sql_query):
+        """
+        Records an executed query in the history mined for summaries.
+        """
+        query = parse_aggregate(sql_query, self._catalog())
+        if query is None:
+            return
+        with self.lock:
+            if len(self.history) == self.history.maxlen:
+                oldest = self.history[0]
+                self.counts[oldest] -= 1
+                if not self.counts[oldest]:
+                    del self.counts[oldest]
+                    del self.measures[oldest]
+            self.history.append(query.key)
+            self.counts[query.key] += 1
+            self.measures[query.key] = self.measures.get(query.key, frozenset()) | query.measures
+            self.counters["observed"] += 1
+
+    async def _fresh(self, summary):
+        if time.time() - summary.refreshed_at <= self.max_staleness:
+            return True
+        # A newer row past the watermark is not the only change: without a
+        # modification time, updates and deletes cannot be ruled out
+        if summary.update_time is None:
+            return False
+        # UPDATE_TIME is per server, so it is compared on the primary it was read from
+        async with self.db.engine.connect() as conn:
+            return await self._update_time(conn, summary.fact) == summary.update_time
+
+    async def rewrite(self, sql_query):
+        """
+        Returns `(sql, summary)` with the query rewritten to read a fresh
+        summary, or None when no summary can answer it.
+        """
+        summaries = [summary for summary in self.summaries.values() if summary.ready]
+        if not summaries:
+            return None
+        query = parse_aggregate(sql_query, self._catalog())
+        if query is None:
+            return None
+        for summary in sorted((s for s in summaries if s.covers(query)), key=lambda s: s.rows):
+            try:
+                fresh = await self._fresh(summary)
+            except Exception as e:
+                logger.warning(f"Could not check the freshness of summary {summary.name}: {e}")
+                fresh = False
+            if fresh:
+                summary.hits += 1
+                with self.lock:
+                    self.counters["rewritten"] += 1
+                return rewrite_aggregate(query, summary, self.db.engine.dialect), summary
+            with self.lock:
+                self.counters["stale"] += 1
+        return None
+
+    def fallback(self, summary, error):
+        """
+        Notes that a rewritten query failed; the summary is rebuilt before it
+        is used again.
+        """
+        logger.warning(f"Summary {summary.name} failed, running the base query: {error}")
+        summary.fallbacks += 1
+        summary.ready = False
+        summary.error = str(error)
+        with self.lock:
+            self.counters["fallbacks"] += 1
+
+    def _watermark_column(self, fact):
+        column = self.watermark_columns.get(fact.lower())
+        if column is not None:
+            return column
+        snapshot = self.db.schema_provider.snapshot if self.db.schema_provider is not None else None
+        table = snapshot.tables.get(fact) if snapshot is not None else None
+        if table is None:
+            return None
+        primary = [(name, column_type) for name, column_type, _, key in table.columns if key == "PRI"]
+        if len(primary) == 1 and "int" in primary[0][1].lower():
+            return primary[0][0]
+        return None
+
+    async def _update_time(self, conn, fact):
+        """
+        The fact table's `UPDATE_TIME` as text on MySQL, else None.
+        """
+        if self.db.engine.dialect.name != "mysql":
+            return None
+        await conn.execute(STATS_EXPIRY_SQL)
+        return _text((await conn.execute(UPDATE_TIME_SQL, {"table": fact})).scalar())
+
+    async def _ensure_state_table(self):
+        if self._state_ready:
+            return
+        quote = self.db.engine.dialect.identifier_preparer.quote
+        async with self.db.engine.begin() as conn:
+            await conn.execute(
+                text(
+                    f"CREATE TABLE IF NOT EXISTS {quote(self.state_table)} ("
+                    "name VARCHAR(64) NOT NULL PRIMARY KEY, definition TEXT NOT NULL, "
+                    "watermark VARCHAR(255) NULL, summary_rows BIGINT NOT NULL, "
+                    "rows_at_build BIGINT NOT NULL, base_rows BIGINT NOT NULL, "
+                    "refreshed_at DOUBLE PRECISION NULL, built_at DOUBLE PRECISION NULL, "
+                    "update_time VARCHAR(64) NULL)"
+                )
+            )
+        self._state_ready = True
+
+    async def _save_state(self, conn, summary):
+        state = self.db.engine.dialect.identifier_preparer.quote(self.state_table)
+        await conn.execute(text(f"DELETE FROM {state} WHERE name = :name"), {"name": summary.name})
+        await conn.execute(
+            text(
+                f"INSERT INTO {state} ({', '.join(STATE_COLUMNS)}) "
+                f"VALUES ({', '.join(':' + column for column in STATE_COLUMNS)})"
+            ),
+            summary.state(),
+        )
+
+    async def _stored_state(self, conn, name=None):
+        """
+        Returns the rows of the state table, or only the row of summary `name`.
+        """
+        state = self.db.engine.dialect.identifier_preparer.quote(self.state_table)
+        sql_query = f"SELECT {', '.join(STATE_COLUMNS)} FROM {state}"
+        params = {}
+        if name is not None:
+            sql_query += " WHERE name = :name"
+            params["name"] = name
+        return [dict(row._mapping) for row in (await conn.execute(text(sql_query), params))]
+
+    async def _load_state(self):
+        """
+        Syncs the summaries with the state table: picks up summaries other
+        processes built, refreshed or dropped.
+        """
+        async with self.db.engine.connect() as conn:
+            rows = await self._stored_state(conn)
+        stored = {}
+        for row in rows:
+            summary = self.summaries.get(row["name"])
+            if summary is None:
+                summary = Summary.from_definition(row["definition"], self.prefix)
+            summary.load_state(row)
+            stored[summary.name] = summary
+        self.summaries = stored
+
+    @asynccontextmanager
+    async def _maintenance_lock(self):
+        """
+        Yields whether this process may maintain the summaries now. On MySQL
+        that is the holder of a server lock named after the database, held on
+        its own connection for the whole pass.
+        """
+        engine = self.db.engine
+        if not self.maintainer or engine.dialect.name != "mysql":
+            yield self.maintainer
+            return
+        name = "CONCAT(DATABASE(), '.', :name)"
+        params = {"name": self.state_table}
+        async with engine.connect() as conn:
+            held = (await conn.execute(text(f"SELECT GET_LOCK({name}, 0)"), params)).scalar() == 1
+            try:
+                yield held
+            finally:
+                if held:
+                    await conn.execute(text(f"SELECT RELEASE_LOCK({name})"), params)
+
+    async def _build(self, summary):
+        """
+        Creates the summary under a temporary name and swaps it in.
+        """
+        engine = self.db.engine
+        quote = engine.dialect.identifier_preparer.quote
+        started = time.time()
+        where, params = "", {}
+        async with engine.begin() as conn:
+            # Read first: a write during the build then shows as a change
+            update_time = await self._update_time(conn, summary.fact)
+            if summary.watermark_column is not None:
+                column = quote(summary.watermark_column)
+                watermark = (
+                    await conn.execute(text(f"SELECT MAX({column}) FROM {quote(summary.fact)}"))
+                ).scalar()
+                if watermark is not None:
+                    value, params = _literal(watermark)
+                    where = f" WHERE {column} <= {value}"
+            else:
+                watermark = None
+            build, old = quote(f"{summary.name}_build"), quote(f"{summary.name}_old")
+            await conn.execute(text(f"DROP TABLE IF EXISTS {build}"))
+            await conn.execute(text(f"CREATE TABLE {build} AS {summary.select_sql(quote, where)}"), params)
+            exists = await conn.run_sync(lambda sync_conn: inspect(sync_conn).has_table(summary.name))
+            name = quote(summary.name)
+            if engine.dialect.name == "mysql" and exists:
+                # DDL is not transactional in MySQL, but a multi-table rename is atomic
+                await conn.execute(text(f"RENAME TABLE {name} TO {old}, {build} TO {name}"))
+                await conn.execute(text(f"DROP TABLE {old}"))
+            else:
+                if exists:
+                    await conn.execute(text(f"DROP TABLE {name}"))
+                await conn.execute(text(f"ALTER TABLE {build} RENAME TO {name}"))
+            rows, base_rows = (
+                await conn.execute(text(f"SELECT COUNT(*), SUM({ROW_COUNT}) FROM {name}"))
+            ).one()
+            summary.rows = summary.rows_at_build = int(rows)
+            summary.base_rows = int(base_rows or 0)
+            summary.watermark = _text(watermark)
+            summary.refreshed_at = summary.built_at = started
+            summary.update_time = update_time
+            summary.ready, summary.failures, summary.error = True, 0, None
+            await self._save_state(conn, summary)
+        logger.info(
+            f"Summary {summary.name} built: {summary.rows} rows for {summary.base_rows} "
+            f"rows of {summary.fact} in {time.time() - started:.2f}s."
+        )
+
+    async def _append(self, summary):
+        """
+        Adds the aggregates of the rows past the watermark. The watermark is
+        read from the state table and moved in the same transaction as the
+        insert, so rows are never appended twice.
+
+        Returns False, appending nothing, when the rows up to the watermark
+        changed: their count differs from the rows summarized (deletes), or
+        on MySQL the table was written without any new row (updates).
+        """
+        engine = self.db.engine
+        quote = engine.dialect.identifier_preparer.quote
+        column, fact = quote(summary.watermark_column), quote(summary.fact)
+        started = time.time()
+        async with engine.begin() as conn:
+            stored = await self._stored_state(conn, summary.name)
+            if not stored:
+                raise RuntimeError(f"Summary {summary.name} is missing from {self.state_table}.")
+            summary.load_state(stored[0])
+            update_time = await self._update_time(conn, summary.fact)
+            watermark, total = (await conn.execute(text(f"SELECT MAX({column}), COUNT(*) FROM {fact}"))).one()
+            past = total
+            if summary.watermark is not None:
+                past = (
+                    await conn.execute(
+                        text(f"SELECT COUNT(*) FROM {fact} WHERE {column} > :low"), {"low": summary.watermark}
+                    )
+                ).scalar()
+            updated = _text(watermark) == summary.watermark and update_time != summary.update_time
+            if total - past != summary.base_rows or updated:
+                logger.info(f"Summary {summary.name}: {summary.fact} changed below the watermark, rebuilding.")
+                return False
+            added = 0
+            if watermark is not None and _text(watermark) != summary.watermark:
+                where = f" WHERE {column} <= :high"
+                params = {"high": watermark}
+                if summary.watermark is not None:
+                    where += f" AND {column} > :low"
+                    params["low"] = summary.watermark
+                names = ", ".join(quote(name) for name, _ in summary.columns())
+                result = await conn.execute(
+                    text(f"INSERT INTO {quote(summary.name)} ({names}) {summary.select_sql(quote, where)}"),
+                    params,
+                )
+                added = max(result.rowcount, 0)
+            summary.rows += added
+            summary.base_rows = total
+            summary.watermark = _text(watermark)
+            summary.refreshed_at = started
+            summary.update_time = update_time
+            await self._save_state(conn, summary)
+        if added:
+            logger.debug(f"Summary {summary.name}: {added} rows appended up to {watermark}.")
+        return True
+
+    async def _drop(self, summary):
+        quote = self.db.engine.dialect.identifier_preparer.quote
+        async with self.db.engine.begin() as conn:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {quote(summary.name)}"))
+            await conn.execute(
+                text(f"DELETE FROM {quote(self.state_table)} WHERE name = :name"), {"name": summary.name}
+            )
+
+    def _candidates(self):
+        """
+        Returns new summaries for hot shapes no summary covers, most frequent
+        first. A summary with the same grouping is replaced by one holding
+        the measures of both.
+        """
+        with self.lock:
+            hot = [(key, self.measures[key]) for key, count in self.counts.most_common() if count >= self.min_queries]
+        candidates = []
+        for (fact, groups), measures in hot:
+            query = AggregateQuery(None, None, fact, None, groups, measures, [])
+            existing = list(self.summaries.values()) + candidates
+            if any(summary.covers(query) for summary in existing):
+                continue
+            for summary in existing:
+                if summary.fact == fact and summary.groups == groups:
+                    measures = measures | summary.measures
+            candidate = Summary(fact, groups, measures, self._watermark_column(fact))
+            if candidate.name not in self.rejected:
+                candidates.append(candidate)
+        return candidates
+
+    async def _materialize(self, summary):
+        if len(self.summaries) >= self.max_tables:
+            logger.debug(f"Not building {summary.name}: {self.max_tables} summaries already exist.")
+            return
+        await self._build(summary)
+        if summary.base_rows < self.min_rows or summary.rows * self.min_reduction > summary.base_rows:
+            logger.info(
+                f"Dropping summary {summary.name}: {summary.rows} rows for "
+                f"{summary.base_rows} base rows is not worth keeping."
+            )
+            self.rejected.add(summary.name)
+            await self._drop(summary)
+            return
+        for name, replaced in list(self.summaries.items()):
+            if replaced.fact == summary.fact and replaced.groups == summary.groups:
+                del self.summaries[name]
+                await self._drop(replaced)
+        self.summaries[summary.name] = summary
+
+    async def maintain(self):
+        """
+        One maintenance pass: refreshes or rebuilds every summary, then
+        materializes the shapes that became hot. Processes that do not get to
+        maintain only pick up the state the maintainer stored.
+        """
+        await self._ensure_state_table()
+        async with self._maintenance_lock() as held:
+            # Read under the lock, so a maintainer works from the last pass's state
+            await self._load_state()
+            if held:
+                await self._maintain()
+
+    async def _maintain(self):
+        now = time.time()
+        for summary in list(self.summaries.values()):
+            try:
+                compact = summary.rows > 2 * max(summary.rows_at_build, 1)
+                if not summary.ready or compact or now - summary.built_at >= self.rebuild_seconds:
+                    await self._build(summary)
+                elif summary.watermark_column is not None and not await self._append(summary):
+                    await self._build(summary)
+            except Exception as e:
+                summary.failures += 1
+                summary.error = str(e)
+                logger.error(f"Summary {summary.name} refresh failed: {e}")
+                if summary.failures >= 3:
+                    summary.ready = False
+                    del self.summaries[summary.name]
+                    self.rejected.add(summary.name)
+                    try:
+                        await self._drop(summary)
+                    except Exception as e:
+                        logger.error(f"Summary {summary.name} could not be dropped: {e}")
+        for summary in self._candidates():
+            try:
+                await self._materialize(summary)
+            except Exception as e:
+                self.rejected.add(summary.name)
+                logger.error(f"Summary {summary.name} could not be built: {e}")
+
+    async def _maintain_forever(self):
+        while True:
+            await asyncio.sleep(self.refresh_seconds)
+            try:
+                await self.maintain()
+            except Exception as e:
+                logger.error(f"Summary maintenance failed: {e}")
+
+    def start(self):
+        if self.refresh_seconds and self._task is None:
+            self._task = asyncio.create_task(self._maintain_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters)
+            hot = [
+                {"fact": fact, "groups": sorted(groups), "count": count}
+                for (fact, groups), count in self.counts.most_common(10)
+            ]
+        return {
+            **counters,
+            "summaries": [summary.stats() for summary in self.summaries.values()],
+            "hot_shapes": hot,
+            "rejected": sorted(self.rejected),
+        }
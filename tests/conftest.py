@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# config.py reads the environment at import time, so point it at throwaway
+# files before any module of the application is imported
+_tmp = tempfile.mkdtemp(prefix="query_to_sql_tests_")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_tmp}/test.db")
+os.environ.setdefault("LOG_FILE", os.path.join(_tmp, "application.log"))
+os.environ.setdefault("SEMANTIC_CACHE_ENABLED", "false")
+os.environ.setdefault("RAG_PERSIST_DIR", os.path.join(_tmp, "chroma"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import pyarrow as pa
+import pytest
+from fastapi.testclient import TestClient
+
+from columnar import ARROW_STREAM_MEDIA_TYPE
+from pagination import decode_page_token
+
+SQL = "SELECT n FROM numbers"
+
+
+class FakeSystem:
+    """
+    forward() answers with three rows; later pages come from execute_arrow,
+    which counts how often the SQL is executed.
+    """
+
+    def __init__(self):
+        self.executed = []
+
+    def database(self, name=None, tenant=None):
+        return name
+
+    async def forward_coalesced(self, query, page_size=None, tenant=None, database=None, truncate=True):
+        table = pa.table({"n": [1, 2, 3]})
+        return {
+            "final_sql": SQL,
+            "source_sql": SQL,
+            "arrow": table.slice(0, page_size),
+            "result": table.slice(0, page_size).to_pandas(),
+            "has_more": True,
+            "database": database,
+            "truncated": False,
+        }
+
+    async def execute_arrow(self, sql_query, page_size=None, offset=0, db=None):
+        self.executed.append((sql_query, page_size, offset))
+        return pa.table({"n": [3]})
+
+
+@pytest.fixture
+def client(monkeypatch):
+    import app
+
+    system = FakeSystem()
+    monkeypatch.setattr(app.app.state, "context", SimpleNamespace(sql_system=system), raising=False)
+    # Without `with`, the application's lifespan (and its real context) never starts
+    return TestClient(app.app), system
+
+
+def test_execute_query_returns_forwards_result_without_running_the_sql_again(client):
+    client, system = client
+    response = client.post("/execute_query/", json={"query": "numbers", "page_size": 2})
+    body = response.json()
+    assert response.status_code == 200
+    assert (body["sql"], body["columns"], body["data"], body["offset"]) == (SQL, ["n"], [{"n": 1}, {"n": 2}], 0)
+    assert system.executed == []
+    assert decode_page_token(body["next_page_token"])[:3] == (SQL, 2, 2)
+
+    page = client.post("/execute_query/page", json={"page_token": body["next_page_token"]}).json()
+    assert page["data"] == [{"n": 3}] and page["offset"] == 2 and page["next_page_token"] is None
+    assert system.executed == [(SQL, 2, 2)]
+
+
+def test_execute_query_serves_arrow_to_clients_that_ask_for_it(client):
+    client, _ = client
+    response = client.post(
+        "/execute_query/", json={"query": "numbers", "page_size": 2}, headers={"Accept": ARROW_STREAM_MEDIA_TYPE}
+    )
+    assert response.headers["content-type"].startswith(ARROW_STREAM_MEDIA_TYPE)
+    table = pa.ipc.open_stream(response.content).read_all()
+    assert table.column("n").to_pylist() == [1, 2]
+    assert table.schema.metadata[b"sql"] == SQL.encode()
+    assert table.schema.metadata[b"next_page_token"]
+
+
+def test_invalid_page_token_is_a_bad_request(client):
+    client, system = client
+    response = client.post("/execute_query/page", json={"page_token": "forged.token"})
+    assert response.status_code == 400
+    assert system.executed == []
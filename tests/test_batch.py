@@ -0,0 +1,97 @@
+import asyncio
+
+import pyarrow as pa
+import pytest
+
+from batch import dedupe, parse_questions, run_batch
+
+
+class FakeSystem:
+    """
+    Answers questions without an LLM: "broken" questions raise, "empty" ones
+    produce no SQL, and `delays` holds questions back to test ordering.
+    """
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.asked = []
+        self.running = 0
+        self.max_running = 0
+
+    def database(self, name=None, tenant=None):
+        return name
+
+    async def get_schema(self, db):
+        return None
+
+    async def forward_coalesced(self, question, page_size=None, tenant=None, database=None):
+        self.asked.append(question)
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        try:
+            await asyncio.sleep(self.delays.get(question, 0.01))
+        finally:
+            self.running -= 1
+        if "broken" in question:
+            raise RuntimeError("database unavailable")
+        if "empty" in question:
+            return {"result": None, "error": "no valid SQL"}
+        table = pa.table({"n": [len(question)]})
+        return {
+            "final_sql": f"SELECT {len(question)} AS n",
+            "arrow": table,
+            "result": table.to_pandas(),
+            "has_more": False,
+            "database": database,
+            "truncated": False,
+        }
+
+
+async def collect(records):
+    return [record async for record in records]
+
+
+def test_parse_questions_numbers_items_and_rejects_empty_ones():
+    assert parse_questions(["a?", {"id": "x", "question": " b "}, {"query": "c"}]) == [
+        ("1", "a?"),
+        ("x", "b"),
+        ("3", "c"),
+    ]
+    with pytest.raises(ValueError, match="Question 2 is empty"):
+        parse_questions(["a", "  "])
+
+
+def test_dedupe_groups_questions_by_normalized_text():
+    assert dedupe([("1", "Total sales?"), ("2", "total  sales"), ("3", "Top seller")]) == [
+        ("Total sales?", ["1", "2"]),
+        ("Top seller", ["3"]),
+    ]
+
+
+def test_a_failing_question_does_not_affect_the_others():
+    system = FakeSystem()
+    questions = [("1", "total sales"), ("2", "broken question"), ("3", "empty answer")]
+    records = asyncio.run(collect(run_batch(system, questions, concurrency=3)))
+    results = {record["id"]: record for record in records if record["type"] == "result"}
+    assert results["1"]["status"] == "ok" and results["1"]["data"] == [{"n": 11}]
+    assert (results["2"]["status"], results["2"]["error"]) == ("error", "database unavailable")
+    assert results["3"]["error"] == "no valid SQL"
+    summary = records[-1]
+    assert summary["type"] == "summary"
+    assert (summary["succeeded"], summary["failed"]) == (1, 2)
+
+
+def test_duplicates_are_answered_once_and_results_stream_in_completion_order():
+    system = FakeSystem(delays={"slow question": 0.2})
+    questions = [("a", "slow question"), ("b", "fast question"), ("c", "Fast question?")]
+    records = asyncio.run(collect(run_batch(system, questions, concurrency=2)))
+    assert sorted(system.asked) == ["fast question", "slow question"]
+    assert [(r["id"], r["deduplicated"]) for r in records[:-1]] == [("b", False), ("c", True), ("a", False)]
+    assert records[-1]["unique"] == 2
+
+
+def test_concurrency_bounds_the_questions_in_flight():
+    system = FakeSystem()
+    questions = [(str(index), f"question {index}") for index in range(6)]
+    asyncio.run(collect(run_batch(system, questions, concurrency=2)))
+    assert system.max_running == 2
@@ -0,0 +1,72 @@
+import asyncio
+import os
+
+import orjson
+
+import benchmark
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_load_corpus_accepts_alternate_field_names(tmp_path):
+    path = tmp_path / "corpus.jsonl"
+    path.write_bytes(
+        orjson.dumps({"id": "a", "question": "How many?", "gold_sql": "SELECT 1"}) + b"\n\n"
+        + orjson.dumps({"query": "Who?", "sql": "SELECT 2"}) + b"\n"
+    )
+    corpus = benchmark.load_corpus(path)
+    assert [(q.id, q.question, q.gold_sql) for q in corpus] == [
+        ("a", "How many?", "SELECT 1"),
+        ("3", "Who?", "SELECT 2"),
+    ]
+
+
+def test_rows_match_ignores_order_unless_the_gold_query_sorts():
+    actual = [("b", 2.00001), ("a", 1)]
+    gold = [("a", 1.0), ("b", 2.0)]
+    assert benchmark.rows_match(actual, gold, ordered=False)
+    assert not benchmark.rows_match(actual, gold, ordered=True)
+
+
+def test_percentile_uses_nearest_rank():
+    values = list(range(1, 101))
+    assert benchmark.percentile(values, 50) == 50
+    assert benchmark.percentile(values, 99) == 99
+    assert benchmark.percentile([], 50) is None
+
+
+def test_diff_reports_flags_regressions_beyond_tolerance():
+    baseline = {"summary": {"latency_p95": 1.0, "accuracy": 1.0, "error_rate": 0.0}, "stages": {}}
+    current = {
+        "summary": {"latency_p95": 1.05, "accuracy": 0.8, "error_rate": 0.2},
+        "stages": {"llm_call": {"p95": 0.5}},
+    }
+    rows, regressions = benchmark.diff_reports(current, baseline, tolerance=0.1)
+    assert set(regressions) == {"accuracy", "error_rate"}
+    # Stages missing from the baseline are not compared
+    assert "stage.llm_call.p95" not in {row[0] for row in rows}
+
+
+def test_tiny_inprocess_run_answers_every_question(tmp_path):
+    corpus = tmp_path / "corpus.jsonl"
+    with open(os.path.join(ROOT, "benchmarks", "questions.jsonl"), "rb") as f:
+        corpus.write_bytes(b"".join(f.readlines()[:3]))
+    args = benchmark.parse_args([
+        "--corpus", str(corpus),
+        "--schema", os.path.join(ROOT, "benchmarks", "schema.sql"),
+        "--database", f"sqlite+aiosqlite:///{tmp_path / 'bench.db'}",
+        "--rows", "20",
+        "--iterations", "1",
+        "--concurrency", "2",
+        "--llm-latency", "0",
+        "--llm-jitter", "0",
+        "--typo-rate", "0",
+        "--syntax-rate", "0",
+    ])
+    report = asyncio.run(benchmark.run(args))
+    summary = report["summary"]
+    assert summary["questions"] == 3
+    assert summary["error_rate"] == 0.0
+    assert summary["accuracy"] == 1.0
+    assert report["llm"]["calls"] >= 3
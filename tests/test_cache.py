@@ -0,0 +1,70 @@
+import numpy as np
+
+from cache import SemanticQueryCache, normalize_question, question_literals
+
+
+def bag_of_words(texts):
+    """
+    Embeds a question by its words, ignoring digits, so questions that only
+    differ in a number are as similar as an embedding model makes them.
+    """
+    vocabulary = ["sales", "units", "employee", "top", "department", "in", "total"]
+    vectors = []
+    for text in texts:
+        words = normalize_question(text).split()
+        vectors.append(np.array([words.count(word) + 0.01 for word in vocabulary], dtype=np.float32))
+    return vectors
+
+
+def make_cache(**kwargs):
+    return SemanticQueryCache(threshold=0.9, embedder=bag_of_words, **kwargs)
+
+
+def test_question_literals_collects_numbers_and_quoted_values():
+    assert question_literals("Top 5 employees in 'Sales' for 2023") == ("'sales'", "2023", "5")
+    assert question_literals("total units sold") == ()
+
+
+def test_question_literals_collects_capitalized_names():
+    assert question_literals("Show employees in Sales") == ("sales",)
+    assert question_literals("HR headcount. Which of them joined in March?") == ("hr", "march")
+    assert question_literals("List employees in the iPhone team") == ("iphone",)
+    assert question_literals("Can I see total units? Show them") == ()
+
+
+def test_similar_question_is_a_hit():
+    cache = make_cache()
+    cache.store("total units in sales", "v1", "SELECT SUM(units_sold) FROM sales")
+    entry, _ = cache.lookup("Total units in sales?", "v1")
+    assert entry is not None
+    entry, _ = cache.lookup("total units sales in", "v1")
+    assert entry is not None and entry.sql == "SELECT SUM(units_sold) FROM sales"
+
+
+def test_questions_differing_in_a_number_do_not_share_sql():
+    cache = make_cache()
+    cache.store("total units in sales in 2023", "v1", "SELECT 2023")
+    cache.store("top 5 employee", "v1", "SELECT 5")
+    assert cache.lookup("total units in sales in 2024", "v1")[0] is None
+    assert cache.lookup("top 10 employee", "v1")[0] is None
+    assert cache.lookup("sales total units in 2023", "v1")[0].sql == "SELECT 2023"
+
+
+def test_questions_differing_in_a_quoted_value_do_not_share_sql():
+    cache = make_cache()
+    cache.store("total units in department 'Sales'", "v1", "SELECT 'Sales'")
+    assert cache.lookup("total units in department 'HR'", "v1")[0] is None
+
+
+def test_questions_differing_in_an_unquoted_name_do_not_share_sql():
+    cache = make_cache()
+    cache.store("total units in department Sales", "v1", "SELECT 'Sales'")
+    assert cache.lookup("total units in department HR", "v1")[0] is None
+    assert cache.lookup("Total units in department Sales?", "v1")[0].sql == "SELECT 'Sales'"
+
+
+def test_other_schema_version_is_a_miss():
+    cache = make_cache()
+    cache.store("total units in sales", "v1", "SELECT 1")
+    assert cache.lookup("total units in sales", "v2")[0] is None
+    assert cache.stats()["misses"] == 1
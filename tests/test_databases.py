@@ -0,0 +1,118 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from columnar import fetch_arrow
+from databases import Database, DatabaseRouter, NoReplicaAvailable, UnknownDatabase
+
+
+def sqlite_copy(tmp_path, name, value):
+    path = tmp_path / f"{name}.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE copy (name TEXT)")
+        conn.execute("INSERT INTO copy VALUES (?)", (value,))
+    return f"sqlite+aiosqlite:///{path}"
+
+
+# A copy that cannot be reached: its directory does not exist
+UNREACHABLE = "sqlite+aiosqlite:////nonexistent/query_to_sql/replica.db"
+
+
+async def read_copy(db):
+    table = await db.read(lambda engine: fetch_arrow("SELECT name FROM copy", engine=engine))
+    return table.column("name").to_pylist()[0]
+
+
+def test_reads_prefer_the_least_busy_fresh_replica(tmp_path):
+    db = Database(
+        "test",
+        sqlite_copy(tmp_path, "primary", "primary"),
+        [sqlite_copy(tmp_path, "a", "a"), sqlite_copy(tmp_path, "b", "b"), sqlite_copy(tmp_path, "c", "c")],
+        max_lag_seconds=10,
+        primary_fallback=True,
+    )
+    a, b, c = db.replicas
+    a.inflight, b.inflight = 2, 1
+    c.lag = 30
+    assert db.read_order() == [b, a, None]
+    b.healthy = False
+    assert asyncio.run(read_copy(db)) == "a"
+
+    db.primary_fallback = False
+    a.healthy = False
+    # Without the primary fallback, a lagging replica is better than nothing
+    assert db.read_order() == [c]
+    c.healthy = False
+    with pytest.raises(NoReplicaAvailable):
+        db.read_engine()
+    asyncio.run(db.dispose())
+
+
+def test_unreachable_replica_is_marked_down_and_reads_fail_over(tmp_path):
+    db = Database(
+        "test",
+        sqlite_copy(tmp_path, "primary", "primary"),
+        [UNREACHABLE, sqlite_copy(tmp_path, "b", "b")],
+        primary_fallback=True,
+    )
+    down, up = db.replicas
+    up.inflight = 1  # the unreachable replica is tried first
+    assert asyncio.run(read_copy(db)) == "b"
+    assert not down.healthy and down.failures == 1
+    assert up.inflight == 1
+    asyncio.run(db.dispose())
+
+
+def test_query_errors_on_a_healthy_replica_are_not_failed_over(tmp_path):
+    db = Database("test", sqlite_copy(tmp_path, "primary", "primary"), [sqlite_copy(tmp_path, "a", "a")])
+
+    async def scenario():
+        try:
+            await db.read(lambda engine: fetch_arrow("SELECT missing FROM copy", engine=engine))
+        finally:
+            await db.dispose()
+
+    with pytest.raises(Exception, match="missing"):
+        asyncio.run(scenario())
+    assert db.replicas[0].healthy
+
+
+def test_health_check_tracks_lag_and_recovery(tmp_path):
+    db = Database("test", sqlite_copy(tmp_path, "primary", "primary"), [sqlite_copy(tmp_path, "a", "a")])
+    replica = db.replicas[0]
+    lags = iter([None, 12, RuntimeError("connection refused"), 0])
+
+    async def read_lag():
+        lag = next(lags)
+        if isinstance(lag, Exception):
+            raise lag
+        return lag
+
+    replica._read_lag = read_lag
+
+    async def scenario():
+        states = []
+        for _ in range(4):
+            await replica.check()
+            states.append((replica.healthy, replica.lag))
+        await db.dispose()
+        return states
+
+    # Stopped replication marks the replica down until a check reads a lag again
+    assert asyncio.run(scenario()) == [(False, 0.0), (True, 12.0), (False, 12.0), (True, 0.0)]
+    assert replica.failures == 2
+
+
+def test_router_resolves_by_name_then_tenant_then_default(tmp_path):
+    router = DatabaseRouter.from_config(
+        {"eu": sqlite_copy(tmp_path, "eu", "eu"), "us": {"url": sqlite_copy(tmp_path, "us", "us")}},
+        default="main",
+        default_replicas=(),
+    )
+    assert router.resolve("eu").name == "eu"
+    assert router.resolve(tenant="us").name == "us"
+    assert router.resolve(tenant="acme").name == "main"
+    with pytest.raises(UnknownDatabase):
+        router.resolve("apac")
+    asyncio.run(router.stop())
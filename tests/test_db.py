@@ -0,0 +1,37 @@
+import asyncio
+
+import pytest
+from sqlalchemy.pool import NullPool
+
+import db
+from db import create_engine_for, kill_engine, run_query
+
+
+def test_kill_engine_is_unpooled_and_shared_per_database(tmp_path):
+    engine = create_engine_for(f"sqlite+aiosqlite:///{tmp_path}/kill.db")
+    killer = kill_engine(engine)
+    assert killer is not engine
+    assert isinstance(killer.pool, NullPool)
+    assert killer.url == engine.url
+    assert kill_engine(engine) is killer
+    asyncio.run(db.dispose_engine())
+    assert db._kill_engines == {}
+
+
+def test_run_query_times_out_and_discards_the_connection(tmp_path):
+    engine = create_engine_for(f"sqlite+aiosqlite:///{tmp_path}/slow.db")
+    slow = (
+        "WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 3000000) "
+        "SELECT COUNT(*) FROM n"
+    )
+
+    async def scenario():
+        try:
+            with pytest.raises(TimeoutError, match="execution timeout"):
+                await run_query(slow, timeout=0.05, engine=engine)
+            # The pool still hands out working connections afterwards
+            return await run_query("SELECT 1", engine=engine)
+        finally:
+            await engine.dispose()
+
+    assert asyncio.run(scenario()) == (["1"], [(1,)])
@@ -0,0 +1,97 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from embeddings import EmbeddingService, _Request
+
+
+class FakeBackend:
+    name = "fake"
+
+    def __init__(self, fail=False, delay=0.0):
+        self.calls = []
+        self.fail = fail
+        self.delay = delay
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("model crashed")
+        return np.array([[float(len(text)), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_encode_returns_one_vector_per_text_in_order():
+    service = EmbeddingService(FakeBackend(), max_wait_ms=1)
+    vectors = service.encode(["a", "bbb", "a"])
+    assert vectors.shape == (3, 2)
+    assert vectors[:, 0].tolist() == [1.0, 3.0, 1.0]
+
+
+def test_duplicates_and_cached_texts_are_encoded_once():
+    backend = FakeBackend()
+    service = EmbeddingService(backend, max_wait_ms=1)
+    service.encode(["x", "x", "yy"])
+    service.encode(["yy", "zzz"])
+    assert backend.calls == [["x", "yy"], ["zzz"]]
+    assert service.stats()["cache_hits"] == 1
+
+
+def test_concurrent_callers_are_batched():
+    backend = FakeBackend()
+    service = EmbeddingService(backend, max_wait_ms=100)
+    results = {}
+
+    def call(text):
+        results[text] = service.encode([text])
+
+    threads = [threading.Thread(target=call, args=(f"t{i}",)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert len(results) == 5
+    assert len(backend.calls) < 5
+    assert sorted(text for call in backend.calls for text in call) == [f"t{i}" for i in range(5)]
+
+
+def test_max_batch_size_splits_forward_passes():
+    backend = FakeBackend()
+    service = EmbeddingService(backend, max_batch_size=2, max_wait_ms=1)
+    service.encode(["a", "b", "c", "d", "e"])
+    assert [len(call) for call in backend.calls] == [2, 2, 1]
+
+
+def test_failed_batch_raises_and_worker_keeps_serving():
+    backend = FakeBackend(fail=True)
+    service = EmbeddingService(backend, max_wait_ms=1)
+    with pytest.raises(RuntimeError, match="model crashed"):
+        service.encode(["a"])
+    backend.fail = False
+    assert service.encode(["a"]).shape == (1, 2)
+    assert service.worker.is_alive()
+
+
+def test_cancelled_requests_are_skipped():
+    backend = FakeBackend()
+    service = EmbeddingService(backend, max_wait_ms=1)
+    cancelled = _Request(["gone"])
+    cancelled.future.cancel()
+    kept = _Request(["kept"])
+    service._run([cancelled, kept])
+    assert backend.calls == [["kept"]]
+    assert kept.future.result()["kept"].tolist() == [4.0, 1.0]
+
+
+def test_a_result_nobody_waits_for_does_not_kill_the_worker():
+    backend = FakeBackend(delay=0.05)
+    service = EmbeddingService(backend, max_wait_ms=1)
+    _, future = service._submit(["slow"])
+    time.sleep(0.01)
+    # Already running: cancelling fails, and the worker sets the result as usual
+    future.cancel()
+    assert future.result(2)["slow"].tolist() == [4.0, 1.0]
+    assert service.encode(["next"]).shape == (1, 2)
+    assert service.worker.is_alive()
@@ -0,0 +1,86 @@
+import uuid
+
+import numpy as np
+
+from examples import NOT_SQL_MARKER, NO_EXAMPLES, ExampleStore, render_examples
+from schema import SchemaSnapshot, TableInfo
+
+
+def snapshot(sales_fingerprint="s1"):
+    return SchemaSnapshot(
+        {
+            "sales": TableInfo("sales", [("amount", "int", False, "")], {}, sales_fingerprint),
+            "employee": TableInfo("employee", [("name", "text", False, "")], {}, "e1"),
+        }
+    )
+
+
+def vector(*values):
+    values = np.array(values, dtype=np.float32)
+    return values / np.linalg.norm(values)
+
+
+def make_store(**kwargs):
+    options = dict(top_k=2, min_similarity=0.5, dedupe_similarity=0.98, max_size=100)
+    options.update(kwargs)
+    # A fresh collection per test in the throwaway Chroma directory
+    return ExampleStore(f"examples_{uuid.uuid4().hex[:8]}", **options)
+
+
+def test_added_pairs_are_retrieved_most_similar_first():
+    store = make_store()
+    schema = snapshot()
+    assert store.add("total sales", "SELECT SUM(amount) FROM sales", schema, vector(1, 0, 0))
+    assert store.add("list employees", "SELECT name FROM employee", schema, vector(0, 1, 0))
+    examples, _ = store.retrieve("sum of sales", schema, vector(0.9, 0.3, 0))
+    # "list employees" is below min_similarity
+    assert [example.question for example in examples] == ["total sales"]
+    assert examples[0].sql == "SELECT SUM(amount) FROM sales"
+    assert render_examples(examples).startswith("Question: total sales\nSQL: SELECT SUM(amount) FROM sales")
+    assert render_examples([]) == NO_EXAMPLES
+
+
+def test_near_duplicate_questions_are_stored_once():
+    store = make_store()
+    schema = snapshot()
+    assert store.add("total sales", "SELECT SUM(amount) FROM sales", schema, vector(1, 0, 0))
+    # Another spelling of a stored question replaces it instead of adding one
+    assert store.add("Total sales?", "SELECT SUM(amount) AS total FROM sales", schema, vector(1, 0, 0))
+    assert not store.add("sales total", "SELECT SUM(amount) FROM sales", schema, vector(1, 0.01, 0))
+    stats = store.stats()
+    assert (stats["size"], stats["deduplicated"]) == (1, 1)
+    examples, _ = store.retrieve("total sales", schema, vector(1, 0, 0))
+    assert examples[0].sql == "SELECT SUM(amount) AS total FROM sales"
+
+
+def test_pairs_that_are_not_sql_or_read_unknown_tables_are_skipped():
+    store = make_store()
+    schema = snapshot()
+    assert not store.add("hello", NOT_SQL_MARKER, schema, vector(1, 0, 0))
+    assert not store.add("orders", "SELECT * FROM orders", schema, vector(1, 0, 0))
+    assert not store.add("odd", "SELECT * FROM sales s, (SELECT 1) x", schema, vector(1, 0, 0))
+    assert store.stats()["size"] == 0
+
+
+def test_schema_change_invalidates_pairs_reading_the_changed_table():
+    store = make_store()
+    store.add("total sales", "SELECT SUM(amount) FROM sales", snapshot(), vector(1, 0, 0))
+    store.add("list employees", "SELECT name FROM employee", snapshot(), vector(0, 1, 0))
+    changed = snapshot(sales_fingerprint="s2")
+    examples, _ = store.retrieve("total sales", changed, vector(1, 0, 0))
+    assert [example.question for example in examples] == []
+    stats = store.stats()
+    assert (stats["size"], stats["invalidated"]) == (1, 1)
+
+
+def test_oldest_pairs_are_evicted_beyond_max_size():
+    store = make_store(max_size=2)
+    schema = snapshot()
+    for index, question in enumerate(["first", "second", "third"]):
+        axis = [0.0, 0.0, 0.0]
+        axis[index] = 1.0
+        store.add(question, "SELECT SUM(amount) FROM sales", schema, vector(*axis))
+    stats = store.stats()
+    assert stats["evicted"] == 2 and stats["size"] == 1
+    examples, _ = store.retrieve("third", schema, vector(0, 0, 1))
+    assert [example.question for example in examples] == ["third"]
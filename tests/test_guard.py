@@ -0,0 +1,172 @@
+import asyncio
+
+import pytest
+
+from guard import (
+    QueryGuard,
+    QueryRejected,
+    add_limit,
+    added_limit,
+    ensure_read_only,
+    summarize_plan,
+)
+
+
+def mysql_plan(*tables):
+    return {"query_block": {"select_id": 1, "nested_loop": [{"table": table} for table in tables]}}
+
+
+SCAN = {
+    "table_name": "sales",
+    "access_type": "ALL",
+    "rows_examined_per_scan": 5_000_000,
+    "rows_produced_per_join": 5_000_000,
+}
+LOOKUP = {
+    "table_name": "customers",
+    "access_type": "eq_ref",
+    "rows_examined_per_scan": 1,
+    "rows_produced_per_join": 5_000_000,
+}
+CROSS = {
+    "table_name": "products",
+    "access_type": "ALL",
+    "rows_examined_per_scan": 200,
+    "rows_produced_per_join": 1_000_000,
+    "using_join_buffer": "hash join",
+}
+
+
+def canned_guard(plan, **kwargs):
+    guard = QueryGuard(max_estimated_rows=1_000_000, max_full_scan_rows=100_000, **kwargs)
+
+    async def explain(sql_query, engine=None):
+        return plan
+
+    guard.explain = explain
+    return guard
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT * FROM sales",
+        "with t as (select 1) select * from t;",
+        "SELECT 'drop table x' AS note",
+        "SELECT REPLACE(name, 'a', 'b') FROM customers",
+        "SELECT * FROM sales -- delete everything",
+    ],
+)
+def test_ensure_read_only_accepts_reads(sql):
+    ensure_read_only(sql)
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "DELETE FROM sales",
+        "SELECT 1; DROP TABLE sales",
+        "WITH t AS (SELECT 1) DELETE FROM sales",
+        "EXPLAIN ANALYZE UPDATE sales SET amount = 0",
+        "EXPLAIN ANALYZE DELETE FROM sales",
+        "DESCRIBE ANALYZE DELETE FROM sales",
+        "SHOW CREATE TABLE sales",
+        "SHOW PROCESSLIST",
+        "EXPLAIN SELECT * FROM sales",
+        "DESC sales",
+        "SELECT * FROM sales INTO OUTFILE '/tmp/x'",
+        "",
+    ],
+)
+def test_ensure_read_only_rejects_writes(sql):
+    with pytest.raises(QueryRejected):
+        ensure_read_only(sql)
+
+
+def test_add_limit_appends_to_unlimited_query():
+    assert add_limit("SELECT * FROM sales;", 100) == "SELECT * FROM sales LIMIT 100"
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT * FROM sales WHERE id IN (SELECT id FROM sales LIMIT 5)",
+        "SELECT `limit` FROM quotas",
+        "SELECT * FROM notes WHERE body = 'no limit'",
+        "SELECT * FROM sales -- limit 5",
+    ],
+)
+def test_add_limit_ignores_inner_limits(sql):
+    assert add_limit(sql, 100).endswith(" LIMIT 100")
+    assert "--" not in add_limit(sql, 100)
+
+
+def test_add_limit_keeps_outer_limit():
+    sql = "SELECT * FROM sales ORDER BY id LIMIT 10"
+    assert add_limit(sql, 100) == sql
+
+
+def test_added_limit_only_flags_guard_limits():
+    assert added_limit("SELECT * FROM sales", "SELECT * FROM sales LIMIT 50")
+    assert not added_limit("SELECT * FROM sales LIMIT 10", "SELECT * FROM sales LIMIT 10")
+    assert not added_limit("SELECT * FROM sales", "SELECT * FROM sales")
+
+
+def test_summarize_plan_finds_full_scans_and_cartesian_joins():
+    summary = summarize_plan(mysql_plan(SCAN, CROSS), max_full_scan_rows=100_000)
+    assert summary.tables == ["sales", "products"]
+    assert summary.full_scans == [("sales", 5_000_000)]
+    assert summary.cartesian == ["products"]
+    assert summary.estimated_rows == 5_000_000
+
+
+def test_check_passes_cheap_plan():
+    guard = canned_guard(mysql_plan(dict(SCAN, rows_examined_per_scan=10, rows_produced_per_join=10)))
+    assert asyncio.run(guard.check("SELECT * FROM sales")) == "SELECT * FROM sales"
+
+
+def test_check_rejects_expensive_plan():
+    guard = canned_guard(mysql_plan(SCAN, LOOKUP), action="reject")
+    with pytest.raises(QueryRejected, match="full scan of `sales`"):
+        asyncio.run(guard.check("SELECT * FROM sales JOIN customers USING (customer_id)"))
+
+
+def test_check_rewrites_expensive_plan():
+    guard = canned_guard(mysql_plan(SCAN), action="rewrite", max_execution_ms=2000, default_limit=50)
+    rewritten = asyncio.run(guard.check("SELECT * FROM sales"))
+    assert rewritten == "SELECT /*+ MAX_EXECUTION_TIME(2000) */ * FROM sales LIMIT 50"
+
+
+def test_check_rejects_instead_of_rewriting_when_truncation_is_not_allowed():
+    guard = canned_guard(mysql_plan(SCAN), action="rewrite")
+    with pytest.raises(QueryRejected, match="full scan of `sales`"):
+        asyncio.run(guard.check("SELECT * FROM sales", rewrite=False))
+
+
+def test_check_rejects_cartesian_join_even_when_rewriting():
+    guard = canned_guard(mysql_plan(SCAN, CROSS), action="rewrite")
+    with pytest.raises(QueryRejected, match="without any join condition"):
+        asyncio.run(guard.check("SELECT * FROM sales, products"))
+
+
+def test_app_context_guard_uses_default_engine(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, "GUARD_ENABLED", True)
+
+    async def start_and_stop():
+        context = app.AppContext()
+        await context.start()
+        try:
+            guard = context.sql_system.guard
+            assert guard.engine is context.engine
+            assert isinstance(guard.max_estimated_rows, int)
+            # The guard of the running app applies its thresholds to a MySQL plan
+            guard.explain = canned_guard(mysql_plan(SCAN)).explain
+            guard.action = "reject"
+            with pytest.raises(QueryRejected):
+                await guard.check("SELECT * FROM sales")
+        finally:
+            await context.stop()
+
+    asyncio.run(start_and_stop())
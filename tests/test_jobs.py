@@ -0,0 +1,31 @@
+import asyncio
+import threading
+
+from jobs import RQJobQueue
+
+
+class FakeQueue:
+    def __init__(self, length):
+        self.length = length
+        self.threads = []
+
+    def __len__(self):
+        self.threads.append(threading.current_thread())
+        return self.length
+
+
+def test_rq_stats_never_read_the_queue_length_on_the_event_loop():
+    async def scenario():
+        jobs = RQJobQueue("redis://localhost:6379/0")
+        jobs.queue = FakeQueue(3)
+        first = jobs.stats()["queued"]
+        await jobs._counting
+        second = jobs.stats()["queued"]
+        await jobs._counting
+        await jobs.stop()
+        return first, second, jobs.queue.threads
+
+    first, second, threads = asyncio.run(scenario())
+    # The first call reports the last known length and refreshes it in the background
+    assert (first, second) == (0, 3)
+    assert threads and threading.main_thread() not in threads
@@ -0,0 +1,30 @@
+import logging
+import logging.handlers
+import os
+
+import log
+
+
+def test_file_handler_substitutes_pid(tmp_path):
+    handler = log._file_handler(str(tmp_path / "app-{pid}.log"))
+    try:
+        assert handler.baseFilename == str(tmp_path / f"app-{os.getpid()}.log")
+    finally:
+        handler.close()
+
+
+def test_file_handler_logs_to_stdout():
+    handler = log._file_handler("-")
+    assert type(handler) is logging.StreamHandler
+
+
+def test_external_rotation_reopens_moved_file(tmp_path):
+    handler = log._file_handler(str(tmp_path / "app.log"), rotation="external")
+    try:
+        assert isinstance(handler, logging.handlers.WatchedFileHandler)
+    finally:
+        handler.close()
+
+
+def test_truncate_notes_dropped_chars():
+    assert log.truncate("abcdef", 3) == "abc... (3 more chars)"
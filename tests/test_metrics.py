@@ -0,0 +1,39 @@
+from metrics import Counter, Registry, stats_collector
+
+
+def test_register_is_idempotent_by_name():
+    registry = Registry()
+    first = registry.register(Counter("requests_total", "Requests."))
+    second = registry.register(Counter("requests_total", "Requests."))
+    assert second is first
+    first.inc()
+    assert registry.render().count("# TYPE requests_total counter") == 1
+
+
+def test_collectors_are_replaced_and_removed_by_name():
+    registry = Registry()
+    for hits in (1, 2):
+        registry.add_collector("cache", stats_collector("cache", "Cache", lambda h=hits: {"hits": h}, ["hits"]))
+    rendered = registry.render()
+    assert rendered.count("# TYPE cache_hits gauge") == 1
+    assert "cache_hits 2" in rendered
+    registry.remove_collector("cache")
+    assert "cache_hits" not in registry.render()
+
+
+def test_app_restart_does_not_duplicate_collectors(monkeypatch):
+    import asyncio
+
+    import app
+    from metrics import REGISTRY
+
+    monkeypatch.setattr(app, "SINGLEFLIGHT_ENABLED", True)
+
+    async def start_twice():
+        for _ in range(2):
+            context = app.AppContext()
+            await context.start()
+            await context.stop()
+
+    asyncio.run(start_twice())
+    assert REGISTRY.render().count("# TYPE query_to_sql_singleflight_started gauge") == 1
@@ -0,0 +1,133 @@
+import time
+
+import pytest
+
+import pagination
+from pagination import (
+    InvalidPageToken,
+    decode_page_token,
+    encode_page_token,
+    needs_order,
+    outer_clauses,
+    paginate_sql,
+    select_list_size,
+    strip_comments,
+)
+
+
+def test_appends_limit_and_orders_by_every_column():
+    assert paginate_sql("SELECT a, b FROM t", 11, 10) == "SELECT a, b FROM t ORDER BY 1, 2 LIMIT 11 OFFSET 10"
+
+
+def test_first_page_can_skip_the_sort():
+    assert paginate_sql("SELECT a, b FROM t", 11, 0, order=False) == "SELECT a, b FROM t LIMIT 11 OFFSET 0"
+    assert needs_order("SELECT a, b FROM t")
+    assert not needs_order("SELECT a FROM t ORDER BY a")
+    assert not needs_order("SELECT * FROM t")
+
+
+def test_keeps_the_query_order():
+    sql = "SELECT a, b FROM t ORDER BY b DESC"
+    assert paginate_sql(sql, 5) == f"{sql} LIMIT 5 OFFSET 0"
+
+
+def test_select_star_is_not_ordered():
+    assert paginate_sql("SELECT * FROM t", 5) == "SELECT * FROM t LIMIT 5 OFFSET 0"
+    assert select_list_size("SELECT e.*, s.units FROM e JOIN s") is None
+
+
+def test_trailing_comment_cannot_swallow_the_limit():
+    paged = paginate_sql("SELECT a FROM t -- every row;", 5)
+    assert paged.endswith("LIMIT 5 OFFSET 0")
+    assert "--" not in paged
+    assert strip_comments("SELECT a /* why */ FROM t # mysql") == "SELECT a   FROM t"
+
+
+def test_comment_markers_inside_literals_are_kept():
+    assert strip_comments("SELECT 'a -- b', \"#c\" FROM t") == "SELECT 'a -- b', \"#c\" FROM t"
+
+
+def test_doubled_quotes_do_not_end_a_literal():
+    sql = """SELECT "say ""hi"" -- no", 'it''s # fine', `odd``name` FROM t"""
+    assert strip_comments(sql + " -- comment") == sql
+    assert outer_clauses("""SELECT "a"" limit 5" FROM t""") == set()
+
+
+def test_only_an_outer_limit_wraps_the_query():
+    inner = "SELECT a FROM t WHERE a IN (SELECT b FROM u LIMIT 3)"
+    assert paginate_sql(inner, 5) == f"{inner} ORDER BY 1 LIMIT 5 OFFSET 0"
+    quoted = "SELECT `limit`, 'no limit' FROM t"
+    assert outer_clauses(quoted) == set()
+    limited = "SELECT a FROM t ORDER BY a LIMIT 3"
+    assert paginate_sql(limited, 5, 2) == f"SELECT * FROM ({limited}) AS _page LIMIT 5 OFFSET 2"
+
+
+def test_hint_moves_outside_the_derived_table():
+    sql = "SELECT /*+ MAX_EXECUTION_TIME(100) */ a FROM t LIMIT 3"
+    assert paginate_sql(sql, 5) == (
+        "SELECT /*+ MAX_EXECUTION_TIME(100) */ * FROM (SELECT a FROM t LIMIT 3) AS _page ORDER BY 1 LIMIT 5 OFFSET 0"
+    )
+
+
+def test_page_token_round_trip():
+    token = encode_page_token("SELECT a FROM t", 20, 10, database="eu")
+    assert decode_page_token(token) == ("SELECT a FROM t", 20, 10, "eu")
+
+
+def test_tampered_page_token_is_rejected():
+    token = encode_page_token("SELECT a FROM t", 20, 10)
+    payload, signature = token.split(".")
+    forged = pagination._b64(
+        pagination._unb64(payload).replace(b"SELECT a FROM t", b"SELECT b FROM t")
+    )
+    with pytest.raises(InvalidPageToken, match="signature"):
+        decode_page_token(f"{forged}.{signature}")
+    with pytest.raises(InvalidPageToken, match="Malformed"):
+        decode_page_token("not-a-token")
+
+
+def test_expired_page_token_is_rejected(monkeypatch):
+    token = encode_page_token("SELECT a FROM t", 20, 10)
+    now = time.time()
+    monkeypatch.setattr(pagination.time, "time", lambda: now + pagination.PAGE_TOKEN_TTL_SECONDS + 1)
+    with pytest.raises(InvalidPageToken, match="expired"):
+        decode_page_token(token)
+
+
+def test_first_page_is_only_sorted_when_a_second_page_exists(tmp_path, monkeypatch):
+    import asyncio
+    import sqlite3
+
+    import main
+    from databases import Database
+
+    path = tmp_path / "pages.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (a INTEGER)")
+        conn.executemany("INSERT INTO t VALUES (?)", [(3,), (1,), (2,)])
+    executed = []
+    fetch_arrow = main.fetch_arrow
+
+    async def recording_fetch(sql_query, **kwargs):
+        executed.append(sql_query)
+        return await fetch_arrow(sql_query, **kwargs)
+
+    monkeypatch.setattr(main, "fetch_arrow", recording_fetch)
+
+    async def scenario():
+        db = Database("test", f"sqlite+aiosqlite:///{path}")
+        system = main.AgentSystem()
+        single, single_source = await system.execute_page("SELECT a FROM t", 5, db=db)
+        paged, paged_source = await system.execute_page("SELECT a FROM t", 2, db=db)
+        await db.dispose()
+        return single, single_source, paged, paged_source
+
+    single, single_source, paged, paged_source = asyncio.run(scenario())
+    assert single.num_rows == 3 and single_source == "SELECT a FROM t"
+    assert paged_source == "SELECT a FROM t"
+    assert paged.column("a").to_pylist() == [1, 2, 3]
+    assert executed == [
+        "SELECT a FROM t LIMIT 6 OFFSET 0",
+        "SELECT a FROM t LIMIT 3 OFFSET 0",
+        "SELECT a FROM t ORDER BY 1 LIMIT 3 OFFSET 0",
+    ]
@@ -0,0 +1,94 @@
+import uuid
+
+import numpy as np
+import pytest
+
+import rag
+from rag import SchemaIndex
+from schema import SchemaSnapshot, TableInfo
+
+VOCABULARY = ["sale", "employee", "product", "customer", "region", "supplier", "warehouse"]
+
+
+def embed(texts):
+    """
+    Embeds a text by which vocabulary words it mentions, so retrieval is
+    deterministic without an embedding model.
+    """
+    vectors = []
+    for text in texts:
+        text = text.lower()
+        vector = np.array([float(word in text) for word in VOCABULARY]) + 0.01
+        vectors.append(vector / np.linalg.norm(vector))
+    return vectors
+
+
+def table(name, *columns, foreign_keys=()):
+    info = TableInfo(name, [(column, "int", False, "") for column in columns], {}, f"{name}:{columns}")
+    info.foreign_keys = list(foreign_keys)
+    return info
+
+
+def schema(**changes):
+    tables = {
+        "sales": table("sales", "sale_id", "employee_id", "amount", foreign_keys=[("employee_id", "employee", "employee_id")]),
+        "employee": table("employee", "employee_id", "region_id", foreign_keys=[("region_id", "region", "region_id")]),
+        "region": table("region", "region_id", "name"),
+        "product": table("product", "product_id", "supplier_id"),
+        "supplier": table("supplier", "supplier_id", "name"),
+        "warehouse": table("warehouse", "warehouse_id", "name"),
+        "customer": table("customer", "customer_id", "name"),
+    }
+    tables.update(changes)
+    return SchemaSnapshot(tables)
+
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setattr(rag, "encode", embed)
+    monkeypatch.setattr(rag, "count_tokens", lambda text: len(text) // 4 + 1)
+    # A fresh collection per test in the throwaway Chroma directory
+    return SchemaIndex(f"schema_{uuid.uuid4().hex[:8]}")
+
+
+def test_small_schema_is_sent_whole(index):
+    snapshot = schema()
+    schema_slice = index.retrieve("total sales", snapshot, top_k=1, token_budget=10_000)
+    assert not schema_slice.retrieved
+    assert schema_slice.text == snapshot.text
+
+
+def test_top_k_tables_are_expanded_with_foreign_key_neighbours(index, monkeypatch):
+    monkeypatch.setattr(rag, "RAG_FK_EXPANSION", True)
+    schema_slice = index.retrieve("total sales", schema(), top_k=1, token_budget=40)
+    assert schema_slice.retrieved
+    assert schema_slice.tables == ["sales", "employee"]
+    assert "warehouse" not in schema_slice.text
+
+
+def test_token_budget_caps_the_slice(index, monkeypatch):
+    monkeypatch.setattr(rag, "RAG_FK_EXPANSION", True)
+    snapshot = schema()
+    one_table = rag.count_tokens(snapshot.tables["sales"].render())
+    schema_slice = index.retrieve("total sales", snapshot, top_k=1, token_budget=one_table)
+    assert schema_slice.tables == ["sales"]
+    assert schema_slice.tokens <= one_table
+
+
+def test_sync_re_embeds_only_changed_tables_and_drops_removed_ones(index, monkeypatch):
+    embedded = []
+
+    def counting_embed(texts):
+        embedded.extend(texts)
+        return embed(texts)
+
+    monkeypatch.setattr(rag, "encode", counting_embed)
+    index.sync(schema())
+    assert len(embedded) == 7
+    changed = schema(customer=table("customer", "customer_id", "name", "region_id"))
+    del changed.tables["warehouse"]
+    changed = SchemaSnapshot(changed.tables)
+    embedded.clear()
+    index.sync(changed)
+    assert len(embedded) == 1 and embedded[0].startswith("customer(")
+    assert "warehouse" not in index._get_collection().get()["ids"]
@@ -0,0 +1,154 @@
+import asyncio
+
+import pytest
+
+import ratelimit
+from ratelimit import AdaptiveConcurrency, InProcessBackend, RateLimiter, estimate_tokens, retry_after_seconds
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class Throttled(Exception):
+    status_code = 429
+
+    def __init__(self, retry_after=None):
+        super().__init__("rate limited")
+        self.litellm_response_headers = {"retry-after": retry_after} if retry_after is not None else {}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_drains_and_refills(clock):
+    backend = InProcessBackend()
+    limits = [(2, 1.0, 1)]
+    assert asyncio.run(backend.take("model", limits)) == 0
+    assert asyncio.run(backend.take("model", limits)) == 0
+    assert asyncio.run(backend.take("model", limits)) == pytest.approx(1.0)
+    clock.now += 0.5
+    assert asyncio.run(backend.take("model", limits)) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert asyncio.run(backend.take("model", limits)) == 0
+
+
+def test_bucket_takes_nothing_unless_every_limit_fits(clock):
+    backend = InProcessBackend()
+    # Plenty of requests left, but not enough tokens for this call
+    limits = [(10, 1.0, 1), (100, 10.0, 150)]
+    assert asyncio.run(backend.take("model", limits)) == pytest.approx(5.0)
+    assert asyncio.run(backend.take("model", [(10, 1.0, 10)])) == 0
+
+
+def test_block_stops_every_caller(clock):
+    backend = InProcessBackend()
+    asyncio.run(backend.block("model", 3))
+    assert asyncio.run(backend.take("model", [(5, 1.0, 1)])) == pytest.approx(3)
+    assert asyncio.run(backend.take("other", [(5, 1.0, 1)])) == 0
+    clock.now += 3
+    assert asyncio.run(backend.take("model", [(5, 1.0, 1)])) == 0
+
+
+def test_oversized_call_is_capped_to_the_bucket():
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=600)
+    assert limiter._limits(5000) == [(600, 10.0, 600)]
+
+
+def test_aimd_grows_additively_and_halves_on_throttle():
+    concurrency = AdaptiveConcurrency(max_limit=8, min_limit=2)
+    concurrency.on_throttled()
+    assert concurrency.limit == 4
+    concurrency.on_success()
+    assert concurrency.limit == pytest.approx(4.25)
+    for _ in range(5):
+        concurrency.on_throttled()
+    assert concurrency.limit == 2
+    for _ in range(200):
+        concurrency.on_success()
+    assert concurrency.limit == 8
+
+
+def test_concurrency_cap_limits_inflight_calls():
+    concurrency = AdaptiveConcurrency(max_limit=2, min_limit=1)
+    peak = 0
+
+    async def work():
+        nonlocal peak
+        async with concurrency:
+            peak = max(peak, concurrency.inflight)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        await asyncio.gather(*(work() for _ in range(6)))
+
+    asyncio.run(main())
+    assert peak == 2
+    assert concurrency.inflight == 0
+
+
+def test_run_retries_rate_limited_calls_and_backs_off():
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=0, max_retries=3, backoff_seconds=0.001)
+    attempts = []
+
+    async def start():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise Throttled()
+        return "ok"
+
+    assert asyncio.run(limiter.run("model", 10, start)) == "ok"
+    assert limiter.counters["throttled"] == 2
+    assert limiter.concurrency["model"].limit < limiter.concurrency["model"].max_limit
+
+
+def test_run_gives_up_after_max_retries():
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=0, max_retries=1, backoff_seconds=0.001)
+
+    async def start():
+        raise Throttled()
+
+    with pytest.raises(Throttled):
+        asyncio.run(limiter.run("model", 10, start))
+
+
+def test_other_errors_are_not_retried():
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=0)
+    attempts = []
+
+    async def start():
+        attempts.append(1)
+        raise ValueError("bad prompt")
+
+    with pytest.raises(ValueError):
+        asyncio.run(limiter.run("model", 10, start))
+    assert len(attempts) == 1
+
+
+def test_retry_after_and_token_estimate():
+    assert retry_after_seconds(Throttled("2.5")) == 2.5
+    assert retry_after_seconds(Throttled("soon")) is None
+    assert retry_after_seconds(Throttled()) is None
+    assert estimate_tokens(["x" * 400], max_tokens=50) == 150
+
+
+def test_run_does_not_retry_once_the_call_is_not_retryable():
+    limiter = RateLimiter(requests_per_minute=0, tokens_per_minute=0, max_retries=3, backoff_seconds=0.001)
+    attempts = []
+
+    async def start():
+        attempts.append(1)
+        raise Throttled()
+
+    # e.g. a streamed call that already sent tokens to the client
+    with pytest.raises(Throttled):
+        asyncio.run(limiter.run("model", 10, start, retryable=lambda: False))
+    assert len(attempts) == 1
@@ -0,0 +1,70 @@
+import pytest
+
+from repair import closest, edit_distance, repair_sql
+
+CATALOG = {
+    "employee": ["employee_id", "full_name", "department"],
+    "sales": ["sale_id", "employee_id", "units_sold", "sale_date"],
+    "product_sales": ["product_id", "units"],
+}
+
+
+class UnknownColumn(Exception):
+    def __init__(self, column):
+        super().__init__(1054, f"Unknown column '{column}' in 'field list'")
+
+
+def test_edit_distance():
+    assert edit_distance("employe", "employee") == 1
+    assert edit_distance("sale_date", "sale_id") == 4
+
+
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("Full_Name", "full_name"),
+        ("employe_id", "employee_id"),
+        ("units_sol", "units_sold"),
+        ("sale_dates", "sale_date"),
+        # One column is a trailing part of the name
+        ("employee_department", "department"),
+    ],
+)
+def test_closest_accepts_unambiguous_matches(name, expected):
+    columns = CATALOG["employee"] + CATALOG["sales"]
+    assert closest(name, columns) == expected
+
+
+@pytest.mark.parametrize(
+    "name",
+    ["employee_name", "sale_day", "name", "units_total", "id"],
+)
+def test_closest_refuses_different_columns(name):
+    columns = CATALOG["employee"] + CATALOG["sales"]
+    assert closest(name, columns) is None
+
+
+def test_closest_refuses_ambiguous_typos():
+    assert closest("sale_it", ["sale_id", "sale_at"]) is None
+
+
+def test_repair_sql_fixes_a_typo_everywhere_outside_literals():
+    sql = "SELECT e.ful_name FROM employee e WHERE e.ful_name <> 'e.ful_name' GROUP BY e.ful_name"
+    fixed, note = repair_sql(sql, UnknownColumn("e.ful_name"), CATALOG)
+    assert fixed == "SELECT e.full_name FROM employee e WHERE e.full_name <> 'e.ful_name' GROUP BY e.full_name"
+    assert note == "column `e.ful_name` -> `e.full_name`"
+
+
+def test_repair_sql_leaves_a_different_column_to_the_llm():
+    sql = "SELECT e.employee_name FROM employee e GROUP BY e.employee_name"
+    assert repair_sql(sql, UnknownColumn("e.employee_name"), CATALOG) is None
+
+
+def test_repair_sql_fixes_unknown_table():
+    sql = "SELECT COUNT(*) FROM sale"
+    fixed, _ = repair_sql(sql, Exception("no such table: sale"), CATALOG)
+    assert fixed == "SELECT COUNT(*) FROM sales"
+
+
+def test_repair_sql_ignores_other_errors():
+    assert repair_sql("SELECT 1", Exception("syntax error"), CATALOG) is None
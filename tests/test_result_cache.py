@@ -0,0 +1,88 @@
+import pyarrow as pa
+
+from result_cache import ResultCache, normalize_sql
+
+
+def test_normalize_sql_ignores_formatting_and_alias_names():
+    first, tables = normalize_sql("SELECT s.amount FROM `sales` AS s WHERE s.id = 1;")
+    second, _ = normalize_sql("select  t.amount\nfrom sales t where t.id=1")
+    assert first == second
+    assert tables == ["sales"]
+
+
+def test_normalize_sql_keeps_literals():
+    assert normalize_sql("SELECT * FROM sales WHERE region = 'EU'")[0] != normalize_sql(
+        "SELECT * FROM sales WHERE region = 'eu'"
+    )[0]
+
+
+def test_normalize_sql_keeps_identifier_case():
+    assert normalize_sql("SELECT * FROM Sales")[0] != normalize_sql("SELECT * FROM sales")[0]
+    assert normalize_sql("SELECT Amount FROM sales")[0] != normalize_sql("SELECT amount FROM sales")[0]
+
+
+def test_normalize_sql_resolves_comma_joins():
+    key, tables = normalize_sql(
+        "SELECT c.name, SUM(s.amount) FROM sales s, customers AS c, products "
+        "WHERE s.customer_id = c.id GROUP BY c.name"
+    )
+    assert tables == ["customers", "products", "sales"]
+    assert "customers _t1" in key
+
+
+def test_normalize_sql_refuses_unresolvable_from_list():
+    _, tables = normalize_sql("SELECT * FROM sales s, (SELECT id FROM customers) c")
+    assert tables is None
+
+
+def test_comma_joined_table_write_invalidates():
+    cache = ResultCache(poll_seconds=0)
+    table = pa.table({"n": [1]})
+    cache.put("SELECT COUNT(*) AS n FROM sales, customers", table)
+    assert cache.get("SELECT COUNT(*) AS n FROM sales, customers") is not None
+    assert cache.invalidate_table("customers") == 1
+    assert cache.get("SELECT COUNT(*) AS n FROM sales, customers") is None
+
+
+def test_unresolvable_query_is_not_cached():
+    cache = ResultCache(poll_seconds=0)
+    sql = "SELECT * FROM sales s, (SELECT id FROM customers) c"
+    cache.put(sql, pa.table({"n": [1]}))
+    assert cache.get(sql) is None
+
+
+def test_normalize_sql_resolves_schema_qualified_tables():
+    key, tables = normalize_sql("SELECT s.amount FROM shop.sales AS s JOIN `shop`.`customers` c ON s.id = c.id")
+    assert tables == ["customers", "sales"]
+    assert "shop.sales _t0" in key
+
+
+def test_results_read_from_a_lagging_replica_are_not_cached(tmp_path):
+    import asyncio
+    import sqlite3
+
+    from databases import Database
+    from main import AgentSystem
+
+    urls = []
+    for name in ("primary", "replica"):
+        path = tmp_path / f"{name}.db"
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE sales (amount INTEGER)")
+            conn.execute("INSERT INTO sales VALUES (1)")
+        urls.append(f"sqlite+aiosqlite:///{path}")
+
+    async def scenario():
+        db = Database("test", urls[0], replicas=urls[1:], max_lag_seconds=60)
+        db.result_cache = ResultCache(poll_seconds=0)
+        system = AgentSystem()
+        db.replicas[0].lag = 5.0
+        await system.execute_arrow("SELECT amount FROM sales", db=db)
+        lagging = db.result_cache.stats()["size"]
+        db.replicas[0].lag = 0.0
+        await system.execute_arrow("SELECT amount FROM sales", db=db)
+        current = db.result_cache.stats()["size"]
+        await db.dispose()
+        return lagging, current
+
+    assert asyncio.run(scenario()) == (0, 1)
@@ -0,0 +1,51 @@
+from routing import LARGE, SMALL, ModelRouter, complexity_features, complexity_score
+
+SCHEMA = "sales(sale_id int PK, employee_id int)\nemployee(employee_id int PK, department text)"
+
+
+class FakeLM:
+    def __init__(self, model):
+        self.model = model
+
+
+def make_router(**kwargs):
+    options = dict(small_model="small-model", large_model="large-model", threshold=3)
+    options.update(kwargs)
+    return ModelRouter(FakeLM, **options)
+
+
+def test_complexity_features_count_analytic_words_and_mentioned_tables():
+    features = complexity_features("Top employee by average sales per year", SCHEMA)
+    assert features["analytic"] == 3
+    assert features["temporal"] == 1
+    assert features["tables_mentioned"] == 2
+    assert complexity_score(features) == 4.5
+
+
+def test_simple_questions_go_to_the_small_model_and_complex_ones_skip_it():
+    router = make_router()
+    assert router.route("list employees", SCHEMA).tier == SMALL
+    decision = router.route("Top employee by average sales per year", SCHEMA)
+    assert decision.tier == LARGE and decision.escalated
+    assert router.lm(LARGE).model == "large-model"
+    assert router.lm(LARGE) is router.lm(LARGE)
+
+
+def test_failed_attempt_escalates_fixes_to_the_large_model():
+    router = make_router()
+    decision = router.route("list employees", SCHEMA)
+    assert not decision.escalated
+    assert router.fix_lm(decision).model == "large-model"
+    assert decision.escalated
+    router.record(decision, success=True, llm_attempts=2)
+    router.record(router.route("list employees", SCHEMA), success=True, llm_attempts=1)
+    assert router.stats()["by_tier_and_score"]["small:0"] == {"escalated": 1, "first_attempt": 1}
+
+
+def test_without_a_large_model_everything_stays_on_the_small_one():
+    router = make_router(large_model="")
+    assert not router.enabled
+    decision = router.route("Top employee by average sales per year", SCHEMA)
+    assert decision.tier == SMALL
+    assert router.fix_lm(decision).model == "small-model"
+    assert not decision.escalated
@@ -0,0 +1,92 @@
+import asyncio
+import sqlite3
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+
+import schema
+from schema import SchemaProvider
+
+
+@pytest.fixture
+def engine_url(tmp_path):
+    path = tmp_path / "schema.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE sales (sale_id INTEGER PRIMARY KEY, amount REAL)")
+    return path, f"sqlite+aiosqlite:///{path}"
+
+
+def test_due_refresh_serves_the_current_snapshot_and_reloads_in_background(engine_url):
+    path, url = engine_url
+
+    async def scenario():
+        engine = create_async_engine(url)
+        provider = SchemaProvider(engine, refresh_seconds=3600)
+        first = await provider.get()
+        assert set(first.tables) == {"sales"}
+
+        with sqlite3.connect(path) as conn:
+            conn.execute("CREATE TABLE customers (customer_id INTEGER PRIMARY KEY)")
+        provider.last_checked = 0.0
+
+        # The request that notices the refresh is not made to wait for it
+        assert await provider.get() is first
+        refreshing = provider._refreshing
+        assert refreshing is not None
+        # A second request does not start another refresh
+        assert await provider.get() is first
+        assert provider._refreshing is refreshing
+
+        await refreshing
+        second = await provider.get()
+        await engine.dispose()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert set(second.tables) == {"sales", "customers"}
+    assert second.version != first.version
+
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def fetchall(self):
+        return self.rows
+
+
+class FakeConnection:
+    def __init__(self, stats):
+        self.stats = stats
+        self.executed = []
+
+    async def execute(self, statement, params=None):
+        self.executed.append(statement)
+        if statement is schema.COLUMNS_SQL:
+            return FakeResult([("sales", "sale_id", "int", "NO", "PRI")])
+        if statement in (schema.TABLES_SQL, schema.ALL_TABLES_SQL):
+            return FakeResult([("sales", *self.stats)])
+        return FakeResult([])
+
+
+def test_row_estimates_of_unchanged_tables_refresh_on_the_slower_timer():
+    async def scenario():
+        provider = SchemaProvider(refresh_seconds=60, stats_refresh_seconds=3600)
+        provider.snapshot = schema.SchemaSnapshot(await provider._load_mysql(FakeConnection((100, "facts"))))
+        first = provider.snapshot.tables["sales"]
+
+        # Fingerprint unchanged and the stats timer not due: nothing is re-read
+        conn = FakeConnection((5000, "facts"))
+        tables = await provider._load_mysql(conn)
+        assert tables["sales"] is first
+        assert schema.ALL_TABLES_SQL not in conn.executed
+
+        provider.stats_checked = 0.0
+        tables = await provider._load_mysql(conn)
+        return first, tables["sales"]
+
+    first, refreshed = asyncio.run(scenario())
+    assert refreshed.row_estimate == 5000
+    # The previous snapshot keeps the estimate it was rendered with
+    assert first.row_estimate == 100
+    assert refreshed.fingerprint == first.fingerprint
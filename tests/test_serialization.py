@@ -0,0 +1,32 @@
+import pandas as pd
+import pyarrow as pa
+
+from serialization import dataframe_to_records, dumps, table_to_records, unique_columns
+
+
+def test_unique_columns_suffixes_repeats():
+    assert unique_columns(["id", "id", "name", "id"]) == ["id", "id_1", "name", "id_2"]
+
+
+def test_unique_columns_skips_existing_suffix():
+    assert unique_columns(["id", "id_1", "id"]) == ["id", "id_1", "id_2"]
+
+
+def test_dataframe_to_records_keeps_duplicate_columns():
+    df = pd.DataFrame([[1, 2]], columns=["id", "id"])
+    columns, rows = dataframe_to_records(df)
+    assert columns == ["id", "id_1"]
+    assert rows == [{"id": 1, "id_1": 2}]
+
+
+def test_table_to_records_keeps_duplicate_columns():
+    table = pa.Table.from_arrays([pa.array([1]), pa.array([2])], names=["id", "id"])
+    columns, rows = table_to_records(table)
+    assert columns == ["id", "id_1"]
+    assert rows == [{"id": 1, "id_1": 2}]
+
+
+def test_dumps_handles_decimal_and_na():
+    import decimal
+
+    assert dumps({"a": decimal.Decimal("3"), "b": pd.NA}) == b'{"a":3,"b":null}'
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def test_concurrent_callers_share_one_computation():
+    flight = SingleFlight()
+    runs = 0
+
+    async def compute():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.01)
+        return "rows"
+
+    async def main():
+        return await asyncio.gather(*(flight.do("q", compute) for _ in range(10)))
+
+    results = asyncio.run(main())
+    assert runs == 1
+    assert [result for result, _ in results] == ["rows"] * 10
+    assert sum(shared for _, shared in results) == 9
+    assert flight.stats() == {"in_flight": 0, "started": 1, "coalesced": 9}
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+
+    async def main():
+        return await asyncio.gather(
+            flight.do("a", lambda: asyncio.sleep(0.01, "a")),
+            flight.do("b", lambda: asyncio.sleep(0.01, "b")),
+        )
+
+    assert asyncio.run(main()) == [("a", False), ("b", False)]
+    assert flight.started == 2
+
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    flight = SingleFlight()
+    runs = 0
+
+    async def fail():
+        nonlocal runs
+        runs += 1
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def main():
+        results = await asyncio.gather(*(flight.do("q", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        with pytest.raises(RuntimeError):
+            await flight.do("q", fail)
+
+    asyncio.run(main())
+    assert runs == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_others():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "rows"
+
+    async def main():
+        first = asyncio.create_task(flight.do("q", compute))
+        second = asyncio.create_task(flight.do("q", compute))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(main()) == ("rows", True)
+
+
+def test_computation_is_cancelled_when_every_caller_leaves():
+    flight = SingleFlight()
+
+    async def main():
+        stopped = asyncio.Event()
+
+        async def compute():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                stopped.set()
+                raise
+
+        callers = [asyncio.create_task(flight.do("q", compute)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.wait_for(stopped.wait(), 1)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
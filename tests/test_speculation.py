@@ -0,0 +1,79 @@
+import asyncio
+
+from speculation import SpeculationBudget, first_valid, sql_key
+
+
+async def candidate(sql, delay=0.0):
+    await asyncio.sleep(delay)
+    return sql, f"response for {sql}"
+
+
+def test_first_candidate_to_validate_wins_and_losers_are_cancelled():
+    cancelled = []
+
+    async def validate(sql):
+        try:
+            await asyncio.sleep({"SELECT 1": 0.5, "SELECT 2": 0.01}[sql])
+        except asyncio.CancelledError:
+            cancelled.append(sql)
+            raise
+        return f"rows of {sql}"
+
+    async def scenario():
+        result = await first_valid([candidate("SELECT 1"), candidate("SELECT 2")], validate)
+        # Let the cancelled validation observe its cancellation
+        await asyncio.sleep(0)
+        return result
+
+    winner, failures = asyncio.run(scenario())
+    assert winner == (1, "SELECT 2", "response for SELECT 2", "rows of SELECT 2")
+    assert failures == []
+    assert cancelled == ["SELECT 1"]
+
+
+def test_failed_candidates_are_reported_in_completion_order():
+    async def validate(sql):
+        if "bad" in sql:
+            raise ValueError(sql)
+        await asyncio.sleep(0.05)
+        return "ok"
+
+    winner, failures = asyncio.run(
+        first_valid(
+            [candidate("SELECT bad_a", 0.02), candidate("SELECT ok"), candidate("SELECT bad_b")],
+            validate,
+        )
+    )
+    assert winner[1] == "SELECT ok"
+    assert [sql for sql, _, _ in failures] == ["SELECT bad_b", "SELECT bad_a"]
+
+
+def test_duplicate_candidates_are_validated_once():
+    validated = []
+
+    async def validate(sql):
+        validated.append(sql)
+        raise ValueError("no rows")
+
+    async def broken():
+        raise RuntimeError("generation failed")
+
+    winner, failures = asyncio.run(
+        first_valid([candidate("SELECT a FROM t"), candidate("select  a\nFROM t;"), broken()], validate)
+    )
+    assert winner is None
+    assert validated == ["SELECT a FROM t"]
+    assert len(failures) == 1
+    assert sql_key("SELECT a FROM t;") == sql_key("select a  from t")
+
+
+def test_budget_limits_tenants_and_inflight_requests():
+    budget = SpeculationBudget(candidates=3, temperatures=[0.0, 0.7], tenants=["acme"], max_inflight=1)
+    assert not budget.try_acquire("other")
+    assert budget.try_acquire("acme")
+    assert not budget.try_acquire("acme")
+    budget.release()
+    assert budget.try_acquire("acme")
+    assert budget.stats()["denied"] == 1
+    assert [budget.temperature(index) for index in range(3)] == [0.0, 0.7, 0.0]
+    assert not SpeculationBudget(candidates=1, tenants=[]).try_acquire("acme")
@@ -0,0 +1,40 @@
+import os
+import subprocess
+import sys
+
+from fastapi.testclient import TestClient
+
+
+def test_importing_the_app_leaves_heavy_libraries_unloaded():
+    # A fresh interpreter, so modules imported by other tests do not count
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = (
+        "import sys, app; "
+        "print(','.join(m for m in ('torch', 'sentence_transformers', 'chromadb') if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=root, capture_output=True, text=True, check=True
+    ).stdout
+    assert output.strip() == ""
+
+
+def test_agent_system_is_built_once_per_worker(monkeypatch):
+    import app
+
+    built = []
+    agent_system = app.AgentSystem
+
+    def counting_agent_system(*args, **kwargs):
+        built.append(1)
+        return agent_system(*args, **kwargs)
+
+    monkeypatch.setattr(app, "AgentSystem", counting_agent_system)
+    with TestClient(app.app) as client:
+        context = client.app.state.context
+        system = context.sql_system
+        first = client.get("/health").json()
+        client.get("/health")
+        assert client.app.state.context.sql_system is system
+    assert built == [1]
+    assert first["status"] == "ok"
+    assert {"imports", "lm", "databases", "total"} <= set(first["boot_seconds"])
@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+import orjson
+import pyarrow as pa
+from fastapi.testclient import TestClient
+
+from streaming import FieldStream
+
+
+def chunk(text):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+def test_field_stream_forwards_only_its_field():
+    received = []
+    stream = FieldStream("generated_sql", received.append)
+    pieces = [
+        "[[ ## reasoning ## ]]\nsum it\n\n[[ ## gener",
+        "ated_sql ## ]]\nSELECT SUM(",
+        "amount) FROM sales",
+        "\n\n[",
+        "[ ## completed ## ]]",
+    ]
+    for piece in pieces:
+        asyncio.run(stream.send(chunk(piece)))
+    assert "".join(received) == "SELECT SUM(amount) FROM sales\n\n"
+    assert received[0] == "SELECT SUM("
+
+
+def test_field_stream_ignores_chunks_without_text():
+    received = []
+    stream = FieldStream("generated_sql", received.append)
+    asyncio.run(stream.send(SimpleNamespace(choices=[])))
+    asyncio.run(stream.send(chunk(None)))
+    assert received == [] and stream.text == ""
+
+
+class FakeSystem:
+    """
+    Emits the events of one SQL generation, then returns a one-row result.
+    """
+
+    def database(self, name=None, tenant=None):
+        return name
+
+    async def forward(self, query, page_size=None, tenant=None, on_event=None, database=None):
+        on_event("generating", {"model": "small"})
+        for text in ("SELECT ", "1 AS n"):
+            await asyncio.sleep(0)
+            on_event("sql_token", {"text": text})
+        if query == "fail":
+            return {"result": None, "error": "no valid SQL"}
+        table = pa.table({"n": [1]})
+        return {
+            "final_sql": "SELECT 1 AS n",
+            "arrow": table,
+            "result": table.to_pandas(),
+            "has_more": False,
+            "database": database,
+            "truncated": False,
+        }
+
+
+def read_events(body):
+    events = []
+    for block in body.strip().split("\n\n"):
+        event, data = block.split("\n")
+        events.append((event.removeprefix("event: "), orjson.loads(data.removeprefix("data: "))))
+    return events
+
+
+def get_events(monkeypatch, query):
+    import app
+
+    monkeypatch.setattr(app.app.state, "context", SimpleNamespace(sql_system=FakeSystem()), raising=False)
+    # Without `with`, the application's lifespan (and its real context) never starts
+    client = TestClient(app.app)
+    response = client.get("/execute_query/events", params={"query": query})
+    assert response.headers["content-type"].startswith("text/event-stream")
+    return read_events(response.text)
+
+
+def test_events_stream_progress_tokens_then_the_result(monkeypatch):
+    events = get_events(monkeypatch, "one")
+    assert [event for event, _ in events] == [
+        "generating", "sql_token", "sql_token", "result", "rows", "done",
+    ]
+    assert "".join(data["text"] for event, data in events if event == "sql_token") == "SELECT 1 AS n"
+    assert events[3][1] == {"sql": "SELECT 1 AS n", "columns": ["n"], "truncated": False}
+    assert events[-1][1] == {"row_count": 1, "next_page_token": None}
+
+
+def test_events_end_with_failed_when_no_sql_works(monkeypatch):
+    events = get_events(monkeypatch, "fail")
+    assert events[-1] == ("failed", {"detail": "no valid SQL"})
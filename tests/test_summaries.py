@@ -0,0 +1,241 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from columnar import fetch_arrow
+from databases import Database
+from schema import SchemaProvider
+from summaries import Summary, SummaryManager, parse_aggregate
+
+CATALOG = {
+    "sales": ["sale_id", "employee_id", "units_sold", "sale_date"],
+    "employee": ["employee_id", "department"],
+}
+BY_EMPLOYEE = "SELECT employee_id, SUM(units_sold) AS units, COUNT(*) AS n FROM sales GROUP BY employee_id ORDER BY employee_id"
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = tmp_path / "summaries.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE employee (employee_id INTEGER PRIMARY KEY, department TEXT)")
+        conn.execute(
+            "CREATE TABLE sales (sale_id INTEGER PRIMARY KEY, employee_id INTEGER, units_sold REAL, sale_date TEXT)"
+        )
+        conn.executemany("INSERT INTO employee VALUES (?, ?)", [(1, "Sales"), (2, "Marketing"), (3, "Sales")])
+        conn.executemany(
+            "INSERT INTO sales VALUES (?, ?, ?, ?)",
+            [(i, i % 3 + 1, float(i % 7), f"2024-01-{i % 28 + 1:02d}") for i in range(1, 301)],
+        )
+    return f"sqlite+aiosqlite:///{path}"
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def manager(url, **kwargs):
+    db = Database("test", url)
+    db.schema_provider = SchemaProvider(db.engine)
+    await db.schema_provider.refresh()
+    options = dict(min_queries=2, min_rows=10, min_reduction=2, refresh_seconds=0, max_staleness=60)
+    options.update(kwargs)
+    return SummaryManager(db, **options)
+
+
+async def rows(db, sql_query):
+    return (await fetch_arrow(sql_query, engine=db.engine)).to_pylist()
+
+
+async def execute(db, sql_query, params=None):
+    from sqlalchemy import text
+
+    async with db.engine.begin() as conn:
+        await conn.execute(text(sql_query), params or {})
+
+
+async def insert_sale(db, sale_id, employee_id=1, units=2.0):
+    await execute(
+        db,
+        "INSERT INTO sales VALUES (:id, :employee, :units, '2024-02-01')",
+        {"id": sale_id, "employee": employee_id, "units": units},
+    )
+
+
+async def built(url, **kwargs):
+    summaries = await manager(url, **kwargs)
+    for _ in range(2):
+        summaries.observe(BY_EMPLOYEE)
+    await summaries.maintain()
+    return summaries
+
+
+def test_parse_aggregate_shape():
+    query = parse_aggregate(
+        "SELECT e.department, AVG(s.units_sold) FROM employee e JOIN sales s "
+        "ON e.employee_id = s.employee_id WHERE s.sale_date >= '2024-01-01' GROUP BY e.department",
+        CATALOG,
+    )
+    assert query.fact == "sales"
+    assert query.ref == "s"
+    assert query.groups == {"employee_id", "sale_date"}
+    assert query.measures == {("sum", "units_sold"), ("count", "units_sold")}
+
+
+@pytest.mark.parametrize(
+    "sql",
+    [
+        "SELECT COUNT(DISTINCT employee_id) FROM sales",
+        "SELECT e.department, COUNT(*) FROM employee e LEFT JOIN sales s ON e.employee_id = s.employee_id GROUP BY 1",
+        "SELECT * FROM sales",
+        "SELECT SUM(units_sold * 2) FROM sales",
+        "SELECT COUNT(*) FROM sales a JOIN sales b ON a.sale_id = b.sale_id",
+    ],
+)
+def test_parse_aggregate_rejects_unsupported_shapes(sql):
+    assert parse_aggregate(sql, CATALOG) is None
+
+
+def test_definition_round_trip_keeps_name():
+    summary = Summary("sales", {"employee_id"}, {("sum", "units_sold"), ("max", "units_sold")}, "sale_id")
+    restored = Summary.from_definition(summary.definition())
+    assert restored.name == summary.name
+    assert restored.measures == summary.measures and restored.watermark_column == "sale_id"
+
+
+def test_rewrite_matches_base_query_and_appends(database):
+    async def scenario():
+        summaries = await built(database)
+        db = summaries.db
+        rewritten, summary = await summaries.rewrite(BY_EMPLOYEE)
+        assert summary.name in rewritten
+        assert await rows(db, rewritten) == await rows(db, BY_EMPLOYEE)
+
+        await insert_sale(db, 1000)
+        built_at = summary.built_at
+        await summaries.maintain()
+        rewritten, _ = await summaries.rewrite(BY_EMPLOYEE)
+        assert await rows(db, rewritten) == await rows(db, BY_EMPLOYEE)
+        assert summary.watermark == "1000" and summary.base_rows == 301
+        assert summary.built_at == built_at
+        await db.dispose()
+
+    run(scenario())
+
+
+def test_summary_past_max_staleness_needs_unchanged_update_time(database):
+    async def scenario():
+        summaries = await built(database)
+        summary = next(iter(summaries.summaries.values()))
+        summary.refreshed_at -= 120
+        # No modification time off MySQL: updates could have been missed
+        assert await summaries.rewrite(BY_EMPLOYEE) is None
+
+        update_time = {"value": "2024-01-01 00:00:00"}
+
+        async def fake_update_time(conn, fact):
+            return update_time["value"]
+
+        summaries._update_time = fake_update_time
+        summary.update_time = "2024-01-01 00:00:00"
+        assert await summaries.rewrite(BY_EMPLOYEE) is not None
+        update_time["value"] = "2024-01-01 00:05:00"
+        assert await summaries.rewrite(BY_EMPLOYEE) is None
+        await summaries.db.dispose()
+
+    run(scenario())
+
+
+def test_deleted_rows_trigger_a_rebuild(database):
+    async def scenario():
+        summaries = await built(database)
+        db = summaries.db
+        summary = next(iter(summaries.summaries.values()))
+        built_at = summary.built_at
+        await execute(db, "DELETE FROM sales WHERE sale_id <= 10")
+        await insert_sale(db, 1000)
+        await summaries.maintain()
+        assert summary.built_at != built_at
+        rewritten, _ = await summaries.rewrite(BY_EMPLOYEE)
+        assert await rows(db, rewritten) == await rows(db, BY_EMPLOYEE)
+        await db.dispose()
+
+    run(scenario())
+
+
+def test_updated_rows_trigger_a_rebuild(database):
+    async def scenario():
+        summaries = await built(database)
+        db = summaries.db
+        summary = next(iter(summaries.summaries.values()))
+        built_at = summary.built_at
+        await execute(db, "UPDATE sales SET units_sold = units_sold + 100 WHERE sale_id = 5")
+
+        # What MySQL reports after the update
+        async def changed_update_time(conn, fact):
+            return "2024-01-01 00:05:00"
+
+        summaries._update_time = changed_update_time
+        await summaries.maintain()
+        assert summary.built_at != built_at
+        rewritten, _ = await summaries.rewrite(BY_EMPLOYEE)
+        assert await rows(db, rewritten) == await rows(db, BY_EMPLOYEE)
+        await db.dispose()
+
+    run(scenario())
+
+
+def test_processes_share_state_and_never_double_append(database):
+    async def scenario():
+        first = await built(database)
+        second = await manager(database)
+        reader = await manager(database, maintainer=False)
+
+        # Other workers pick up the summary from the state table
+        await second.maintain()
+        await reader.maintain()
+        assert set(reader.summaries) == set(first.summaries)
+        assert await reader.rewrite(BY_EMPLOYEE) is not None
+
+        # Both maintainers refresh in turn; the rows are appended once
+        await insert_sale(first.db, 1000, units=5.0)
+        await first.maintain()
+        await second.maintain()
+        rewritten, _ = await second.rewrite(BY_EMPLOYEE)
+        assert await rows(second.db, rewritten) == await rows(second.db, BY_EMPLOYEE)
+        for summaries in (first, second, reader):
+            await summaries.db.dispose()
+
+    run(scenario())
+
+
+def test_failed_summary_falls_back_and_is_rebuilt(database):
+    async def scenario():
+        summaries = await built(database)
+        db = summaries.db
+        _, summary = await summaries.rewrite(BY_EMPLOYEE)
+        summaries.fallback(summary, RuntimeError("table is gone"))
+        assert await summaries.rewrite(BY_EMPLOYEE) is None
+        await summaries.maintain()
+        assert await summaries.rewrite(BY_EMPLOYEE) is not None
+        await db.dispose()
+
+    run(scenario())
+
+
+def test_pages_read_from_a_summary_report_it_as_their_source(database):
+    from main import AgentSystem
+
+    async def scenario():
+        summaries = await built(database)
+        db = summaries.db
+        db.summaries = summaries
+        table, source = await AgentSystem().execute_page(BY_EMPLOYEE, 2, db=db)
+        await db.dispose()
+        return table, source, [summary.name for summary in summaries.summaries.values()]
+
+    table, source, names = run(scenario())
+    # Page 1 came from the summary, so the NDJSON stream continues from it too
+    assert any(name in source for name in names)
+    assert table.num_rows == 3